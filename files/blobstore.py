@@ -0,0 +1,172 @@
+"""Content-addressed, deduplicating storage behind every FileField.
+
+Each distinct content is written once, as a digest-named blob under
+MEDIA_ROOT/.blobs/ab/cd/<sha256>. The paths upload_to_file / upload_to_revision
+produce (uploads/product_.../stage_1/...) are still created, as hard links to that
+blob, so mpp_files keeps opening in any file manager as the folders the user built --
+the on-disk promise in the README -- while a library re-dropped into twenty stages
+occupies its bytes once.
+
+Reference counting is the filesystem's own: a blob's link count is 1 (the blob
+itself) plus one per human-readable path pointing at it. Removing a path -- through
+delete() or by hand -- drops the count, and prune_blobs() reclaims blobs back at 1.
+
+Where hard links are unavailable (some network and Windows bind mounts), uploads are
+stored as plain files exactly as before: nothing is deduplicated, but nothing breaks
+either.
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+
+BLOB_DIR = '.blobs'
+
+
+class DedupFileSystemStorage(FileSystemStorage):
+    def blob_path(self, digest):
+        return os.path.join(self.location, BLOB_DIR, digest[:2], digest[2:4], digest)
+
+    @property
+    def staging_dir(self):
+        """Where uploads are streamed while they arrive (files.digests) and content is
+        written before it becomes a blob: same filesystem as the blobs, so both end in a
+        rename or link, never a copy."""
+        return os.path.join(self.location, BLOB_DIR, 'tmp')
+
+    def _save(self, name, content):
+        digest = getattr(content, 'sha256', None)
+        tmp_path = None
+        if digest and os.path.exists(self.blob_path(digest)):
+            # Uploads arrive with a digest computed on receipt (files.digests): known
+            # content costs no write at all.
+            source = self.blob_path(digest)
+        elif digest and self._staged(content):
+            # Streamed into the staging directory on receipt: the temp file becomes the
+            # blob as it is.
+            tmp_path = content.temporary_file_path()
+            content.file.flush()
+            if self.file_permissions_mode is not None:
+                os.chmod(tmp_path, self.file_permissions_mode)  # tempfiles are created 0600
+            source = self._store_blob(tmp_path, digest)
+        else:
+            tmp_path, digest = self._write_hashed(content)
+            source = self._store_blob(tmp_path, digest)
+        try:
+            return self._place(source, name, move=source == tmp_path)
+        finally:
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _staged(self, content):
+        path = getattr(content, 'temporary_file_path', None)
+        return path is not None and os.path.dirname(os.path.abspath(path())) == os.path.abspath(self.staging_dir)
+
+    def _write_hashed(self, content):
+        """Write `content` to a temp file in the blob store, hashing it on the way."""
+        os.makedirs(self.staging_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.staging_dir)
+        hasher = hashlib.sha256()
+        with os.fdopen(fd, 'wb') as out:
+            if hasattr(content, 'seek'):
+                content.seek(0)
+            for chunk in content.chunks():
+                hasher.update(chunk)
+                out.write(chunk)
+        if self.file_permissions_mode is not None:
+            os.chmod(tmp_path, self.file_permissions_mode)
+        return tmp_path, hasher.hexdigest()
+
+    def _store_blob(self, tmp_path, digest):
+        """The blob path for freshly written content, or `tmp_path` itself when this
+        filesystem can't hard-link (the content is then stored as a plain file)."""
+        blob = self.blob_path(digest)
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        try:
+            os.link(tmp_path, blob)  # never replaces: an existing blob keeps its links
+        except FileExistsError:
+            pass
+        except OSError:
+            return tmp_path
+        return blob
+
+    def _place(self, source, name, move, suffix=''):
+        """Create the human-readable path `name` (+ `suffix` on disk) for `source`;
+        returns the name used."""
+        while True:
+            full_path = self.path(name) + suffix
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            try:
+                if move:
+                    file_move_safe(source, full_path, allow_overwrite=False)
+                else:
+                    self._link(source, full_path)
+                break
+            except FileExistsError:
+                # Taken between get_available_name() and now; pick another name.
+                name = self.get_available_name(name)
+        return str(name).replace('\\', '/')
+
+    def _link(self, blob, full_path):
+        try:
+            os.link(blob, full_path)
+        except FileExistsError:
+            raise
+        except OSError:
+            # e.g. the blob hit the filesystem's link limit: keep a private copy.
+            with open(blob, 'rb') as src, open(full_path, 'xb') as dst:
+                shutil.copyfileobj(src, dst)
+
+    def adopt(self, name):
+        """Move an existing plain file at `name` into the blob store, leaving a hard link
+        in its place. Returns True if the path now shares a blob."""
+        full_path = self.path(name)
+        with open(full_path, 'rb') as fh:
+            hasher = hashlib.sha256()
+            for block in iter(lambda: fh.read(1024 * 1024), b''):
+                hasher.update(block)
+        blob = self.blob_path(hasher.hexdigest())
+        if os.path.exists(blob) and os.path.samefile(blob, full_path):
+            return True
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        try:
+            os.link(full_path, blob)
+            return True
+        except FileExistsError:
+            pass
+        except OSError:
+            return False
+        # The content is already stored: swap this copy for a link to the blob.
+        swap = f"{full_path}.dedup"
+        os.link(blob, swap)
+        os.replace(swap, full_path)
+        return True
+
+    def release_blob(self, digest):
+        """Delete the blob for `digest` now if no path links to it any more (what
+        prune_blobs() would do, for one blob whose last path was just deleted)."""
+        blob = self.blob_path(digest)
+        try:
+            if os.stat(blob).st_nlink == 1:
+                os.remove(blob)
+        except FileNotFoundError:
+            pass
+
+    def prune_blobs(self):
+        """Delete blobs no human-readable path links to any more. Returns (count, bytes)."""
+        root = os.path.join(self.location, BLOB_DIR)
+        count = freed = 0
+        for dirpath, dirnames, filenames in os.walk(root):
+            if dirpath == self.staging_dir:
+                continue
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                stat = os.stat(path)
+                if stat.st_nlink == 1:
+                    os.remove(path)
+                    count += 1
+                    freed += stat.st_size
+        return count, freed
@@ -0,0 +1,269 @@
+"""Write tracking: the change feed, the version counters behind ETags, and the
+serialized-payload cache.
+
+For every write to a File, Folder or FileRevision:
+  - a ChangeLog row is written, read back by /api/products/<id>/changes/, its token
+    taken from the Product.version bump (see ChangeLog);
+  - Product.version and the container's Stage/Iteration.version are bumped, which the
+    conditional GETs in files.conditional turn into ETags;
+  - cached FileSerializer fragments of the affected files are invalidated
+    (files.payload_cache).
+
+Ordinary saves and deletes are caught by the signal receivers below (connected in
+FilesConfig.ready), which also covers cascades such as a folder's recursive delete.
+QuerySet.update() sends no signals, so the bulk move paths in views.py call
+record_changes(), bump_versions() and invalidate_file_payloads() themselves -- any new bulk update of File/Folder
+rows must do the same or clients will never hear about it.
+
+The ChangeLog token and the version bumps lock the product and container rows until
+the transaction commits, so every write to one product queues behind the others.
+Uploads and drops hold their transaction across storage writes, so they open
+deferred_changes() just inside it: the rows and bumps are collected while the files
+are written and go in as the transaction's last statements, which locks the product
+only for the moment before the commit. They still commit with the write, or not at
+all. Deletes wrap their cascade the same way, so a product or folder tree with
+thousands of files takes one token and one bump per container rather than several
+queries per row, and a product being deleted is neither logged nor bumped.
+"""
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.db import connection, transaction
+from django.db.models import F, Max
+from django.db.models.signals import post_delete, post_save
+
+from .models import ChangeLog, File, FileRevision, Folder, Iteration, ManualTraceEdge, Product, Stage
+from .payload_cache import invalidate_file_payloads
+from .traceability.containers import ITERATION, STAGE
+
+
+_deferred = threading.local()
+
+
+class _Pending:
+    """What a deferred_changes() block has held back so far."""
+
+    def __init__(self):
+        self.changes = []  # (product_id, container_keys, [(kind, object_id, action)])
+        self.revisions = []  # (file_id, revision_id, action), owner looked up when written
+        self.file_ids = set()  # payloads to invalidate
+
+
+@contextmanager
+def deferred_changes():
+    """Hold back the ChangeLog rows, version bumps and payload invalidations of the
+    writes made in the block and write them when it exits without an error. Open it
+    inside the transaction.atomic() of the writes, so they are written last in that
+    transaction and commit with it. Nested blocks leave the writing to the outermost
+    one.
+    """
+    if getattr(_deferred, 'pending', None) is not None:
+        yield
+        return
+    _deferred.pending = pending = _Pending()
+    try:
+        yield
+    finally:
+        _deferred.pending = None
+    _write_deferred(pending)
+
+
+def _pending():
+    return getattr(_deferred, 'pending', None)
+
+
+def _defer(*change):
+    pending = _pending()
+    if pending is None:
+        return False
+    pending.changes.append(change)
+    return True
+
+
+def _invalidate(file_ids):
+    pending = _pending()
+    if pending is None:
+        invalidate_file_payloads(file_ids)
+    else:
+        pending.file_ids.update(file_ids)
+
+
+def _write_deferred(pending):
+    changes = list(pending.changes)
+    if pending.revisions:
+        owners = {row[0]: row[1:] for row in File.objects.filter(id__in={r[0] for r in pending.revisions})
+                  .values_list('id', 'product_id', 'container_key', 'parent_file_id')}
+        for file_id, revision_id, action in pending.revisions:
+            if file_id not in owners:  # deleted in the block too; that delete covers it
+                continue
+            product_id, key, parent_id = owners[file_id]
+            changes.append((product_id, (key,), [(ChangeLog.REVISION, revision_id, action)]))
+            pending.file_ids.update((file_id, parent_id))
+
+    rows, products, keys = defaultdict(list), set(), defaultdict(set)
+    for product_id, container_keys, logged in changes:
+        if product_id:
+            products.add(product_id)
+            rows[product_id].extend(logged)
+        keys[product_id if product_id else None].update(key for key in container_keys if key)
+    with transaction.atomic():
+        for product_id in sorted(products):  # one lock order for every writer
+            token = next_token(product_id)
+            container_keys = keys.pop(product_id, ())
+            if token is None:  # the product was deleted in the block, containers and all
+                continue
+            ChangeLog.objects.bulk_create([
+                ChangeLog(product_id=product_id, kind=kind, object_id=object_id, action=action, token=token)
+                for kind, object_id, action in rows[product_id]
+            ])
+            bump_versions(None, *sorted(container_keys))
+        for container_keys in keys.values():
+            bump_versions(None, *sorted(container_keys))
+    invalidate_file_payloads(pending.file_ids)
+
+
+def record_changes(kind, product_id, object_ids, action=ChangeLog.UPSERT):
+    """Log one change per object id. A no-op without a product (unfiled rows)."""
+    object_ids = list(object_ids)
+    if not product_id or not object_ids:
+        return
+    if _defer(product_id, (), [(kind, object_id, action) for object_id in object_ids]):
+        return
+    with transaction.atomic():
+        token = next_token(product_id)
+        if token is None:  # the product is gone
+            return
+        ChangeLog.objects.bulk_create([
+            ChangeLog(product_id=product_id, kind=kind, object_id=object_id, action=action, token=token)
+            for object_id in object_ids
+        ])
+
+
+def next_token(product_id):
+    """Bump Product.version and return the new value, keeping the product row locked
+    until the caller's transaction ends; None if there is no such product."""
+    table = connection.ops.quote_name(Product._meta.db_table)
+    with connection.cursor() as cursor:
+        # One statement, so the value read back is the one this transaction wrote.
+        cursor.execute(f'UPDATE {table} SET version = version + 1 WHERE id = %s RETURNING version', [product_id])
+        row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def bump_versions(product_id, *container_keys):
+    """Invalidate cached reads of a product and of the given containers ('stage:1')."""
+    if _defer(product_id, container_keys, []):
+        return
+    if product_id:
+        Product.objects.filter(id=product_id).update(version=F('version') + 1)
+    for key in container_keys:
+        kind, _, object_id = (key or '').partition(':')
+        model = {STAGE: Stage, ITERATION: Iteration}.get(kind)
+        if model is not None:
+            model.objects.filter(id=object_id).update(version=F('version') + 1)
+
+
+def current_token(product_id):
+    """The newest change token for a product; 0 when nothing has been logged yet."""
+    return ChangeLog.objects.filter(product_id=product_id).aggregate(token=Max('token'))['token'] or 0
+
+
+def changes_since(product_id, since):
+    """(token, {kind: {object_id: last action}}) for everything logged after `since`.
+
+    Collapsed to the last action per object, so an object created and then deleted
+    inside the window only reports the delete.
+    """
+    latest = {ChangeLog.FILE: {}, ChangeLog.FOLDER: {}, ChangeLog.REVISION: {}}
+    token = since
+    rows = (ChangeLog.objects.filter(product_id=product_id, token__gt=since)
+            .order_by('token', 'id').values_list('token', 'kind', 'object_id', 'action'))
+    for row_token, kind, object_id, action in rows.iterator():
+        latest[kind][object_id] = action
+        token = row_token
+    return token, latest
+
+
+def _log(kind, product_id, object_ids, key, action=ChangeLog.UPSERT):
+    # Deferred as one change, so the container bump is dropped along with a deleted product.
+    if _defer(product_id, (key,), [(kind, object_id, action) for object_id in object_ids]):
+        return
+    record_changes(kind, product_id, object_ids, action)  # bumps Product.version too
+    bump_versions(None, key)
+
+
+def _file_saved(sender, instance, **kwargs):
+    _log(ChangeLog.FILE, instance.product_id, [instance.id], instance.container_key)
+    # A parent's payload embeds its children.
+    _invalidate([instance.id, instance.parent_file_id])
+
+
+def _file_deleted(sender, instance, **kwargs):
+    _log(ChangeLog.FILE, instance.product_id, [instance.id], instance.container_key, ChangeLog.DELETE)
+    _invalidate([instance.id, instance.parent_file_id])
+
+
+def _folder_saved(sender, instance, **kwargs):
+    _log(ChangeLog.FOLDER, instance.product_id, [instance.id], instance.container_key)
+
+
+def _folder_deleted(sender, instance, **kwargs):
+    _log(ChangeLog.FOLDER, instance.product_id, [instance.id], instance.container_key, ChangeLog.DELETE)
+
+
+def _revision_owner(revision):
+    # Looked up rather than read off revision.file: when a file is deleted its
+    # revisions go first in the cascade, and the file delete already tells clients to
+    # drop them, so a missing file simply means there is nothing extra to log.
+    owner = File.objects.filter(id=revision.file_id).values_list('product_id', 'container_key', 'parent_file_id')
+    return owner.first() or (None, '', None)
+
+
+def _revision_changed(revision, action):
+    pending = _pending()
+    if pending is not None:  # owners looked up all at once, when the block ends
+        pending.revisions.append((revision.file_id, revision.id, action))
+        return
+    product_id, key, parent_id = _revision_owner(revision)
+    _log(ChangeLog.REVISION, product_id, [revision.id], key, action)
+    invalidate_file_payloads([revision.file_id, parent_id])
+
+
+def _revision_saved(sender, instance, **kwargs):
+    _revision_changed(instance, ChangeLog.UPSERT)
+
+
+def _revision_deleted(sender, instance, **kwargs):
+    _revision_changed(instance, ChangeLog.DELETE)
+
+
+def _product_changed(sender, instance, **kwargs):
+    bump_versions(instance.id)
+    # product_name is part of every file payload; a rename must not serve the old one.
+    invalidate_file_payloads(File.objects.filter(product_id=instance.id).values_list('id', flat=True))
+
+
+def _container_changed(sender, instance, **kwargs):
+    # Container names and order show up in product reads and the traceability graph.
+    kind = STAGE if isinstance(instance, Stage) else ITERATION
+    bump_versions(instance.product_id, f"{kind}:{instance.id}")
+
+
+def _trace_link_changed(sender, instance, **kwargs):
+    bump_versions(instance.product_id)
+
+
+def connect_signals():
+    post_save.connect(_file_saved, sender=File, dispatch_uid='changes.file_saved')
+    post_delete.connect(_file_deleted, sender=File, dispatch_uid='changes.file_deleted')
+    post_save.connect(_folder_saved, sender=Folder, dispatch_uid='changes.folder_saved')
+    post_delete.connect(_folder_deleted, sender=Folder, dispatch_uid='changes.folder_deleted')
+    post_save.connect(_revision_saved, sender=FileRevision, dispatch_uid='changes.revision_saved')
+    post_delete.connect(_revision_deleted, sender=FileRevision, dispatch_uid='changes.revision_deleted')
+    post_save.connect(_product_changed, sender=Product, dispatch_uid='changes.product_saved')
+    for model in (Stage, Iteration):
+        post_save.connect(_container_changed, sender=model, dispatch_uid=f'changes.{model.__name__}_saved')
+        post_delete.connect(_container_changed, sender=model, dispatch_uid=f'changes.{model.__name__}_deleted')
+    post_save.connect(_trace_link_changed, sender=ManualTraceEdge, dispatch_uid='changes.manual_edge_saved')
+    post_delete.connect(_trace_link_changed, sender=ManualTraceEdge, dispatch_uid='changes.manual_edge_deleted')
@@ -0,0 +1,290 @@
+"""Gzip at rest for the compressible CAD, PCB and tabular formats (MEDIA_COMPRESSION).
+
+STEP, IGES, DXF, OBJ, Gerber/drill, CSV and log files are plain text and shrink
+5-10x. With MEDIA_COMPRESSION on, CompressedDedupStorage -- the default storage, a
+DedupFileSystemStorage (files.blobstore) underneath -- writes them gzipped:
+uploads/.../board.step is stored on disk as uploads/.../board.step.gz, hard-linked to
+the blob .blobs/ab/cd/<sha256>.gz, the digest still being that of the original bytes.
+Names in the database do not change.
+
+Reads are transparent: open() streams the decompressed bytes, size() is the original
+size (from the gzip trailer), exists() and delete() see either form. Files stored
+plain -- everything written before the switch, or while it is off -- stay plain and
+keep working, so the setting can be turned off again at any time.
+
+The codec is gzip rather than zstd so that the bytes on disk are also what goes over
+the wire: nginx sends a download of board.step (X-Accel-Redirect to /protected-media/)
+from the .gz with Content-Encoding: gzip (gzip_static) and only inflates it for a
+client that doesn't accept gzip (gunzip); serve_media() does the same job for the
+DEBUG media route. The folder zip export copies the deflate stream into the archive
+as it is (files.zipstream).
+
+Gzipping runs at tens of MB/s, so only files under MAX_INLINE_COMPRESS are packed in
+the upload request. A larger one is stored plain and its revision queued
+(FileRevision.compress_pending) for
+
+    python manage.py compress_media
+
+which packs it after the upload has committed and swaps the plain file for the .gz
+in place; until then it is simply read plain.
+"""
+import gzip
+import hashlib
+import io
+import mimetypes
+import os
+import struct
+import tempfile
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.base import File
+from django.core.files.move import file_move_safe
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.http import FileResponse, Http404
+from django.views.static import serve
+
+from .blobstore import DedupFileSystemStorage
+
+GZ = '.gz'
+
+# gzip level per extension: a faster one for the large CAD exchange formats, the
+# best one for the small Gerber and drill files.
+COMPRESS_LEVELS = {
+    'step': 6, 'stp': 6, 'iges': 6, 'igs': 6, 'dxf': 6, 'obj': 6,
+    'gbr': 9, 'ger': 9, 'gtl': 9, 'gbl': 9, 'gto': 9, 'gbo': 9, 'gts': 9, 'gbs': 9,
+    'gtp': 9, 'gbp': 9, 'gko': 9, 'gm1': 9, 'drl': 9, 'xln': 9,
+    'csv': 6, 'tsv': 6, 'log': 6,
+}
+# The gzip trailer records the size modulo 2**32; larger files stay plain.
+MAX_COMPRESS_SIZE = 2 ** 32
+# Larger files are gzipped by compress_media rather than in the upload request.
+MAX_INLINE_COMPRESS = 256 * 1024 * 1024
+# Revisions claimed per transaction by compress_pending().
+COMPRESS_BATCH = 10
+# Keep the gzip only if it is at most this fraction of the original.
+MAX_PACKED_RATIO = 0.9
+
+
+def compression_enabled():
+    return getattr(settings, 'MEDIA_COMPRESSION', False)
+
+
+def compress_level(name):
+    return COMPRESS_LEVELS.get(os.path.splitext(name or '')[1].lower().lstrip('.'))
+
+
+def compress_later(name, size):
+    """True if a file of this name and size is stored plain by the upload and left for
+    compress_media to gzip."""
+    return (compression_enabled() and compress_level(name) is not None
+            and MAX_INLINE_COMPRESS <= (size or 0) < MAX_COMPRESS_SIZE)
+
+
+def original_size(packed_path):
+    with open(packed_path, 'rb') as fh:
+        fh.seek(-4, io.SEEK_END)
+        return struct.unpack('<I', fh.read(4))[0]
+
+
+def gzip_member(packed_path):
+    """(offset, length, crc, size) of the raw deflate stream in a gzip file as written
+    here: one member, its header optionally carrying an extra field, name or comment."""
+    with open(packed_path, 'rb') as fh:
+        header = fh.read(10)
+        if len(header) < 10 or header[:3] != b'\x1f\x8b\x08':
+            raise IOError(f"{packed_path} is not a gzip file")
+        flags = header[3]
+        if flags & 0x04:  # FEXTRA
+            fh.seek(struct.unpack('<H', fh.read(2))[0], io.SEEK_CUR)
+        for flag in (0x08, 0x10):  # FNAME, FCOMMENT: zero-terminated
+            if flags & flag:
+                while fh.read(1) not in (b'\x00', b''):
+                    pass
+        if flags & 0x02:  # FHCRC
+            fh.seek(2, io.SEEK_CUR)
+        offset = fh.tell()
+        end = fh.seek(-8, io.SEEK_END)
+        crc, size = struct.unpack('<LL', fh.read(8))
+    return offset, end - offset, crc, size
+
+
+class PackedFile(File):
+    """A gzip-stored file, read as its original bytes."""
+
+    def __init__(self, packed_path, name):
+        super().__init__(gzip.open(packed_path, 'rb'), name=name)
+        self.packed_path = packed_path
+        self.size = original_size(packed_path)
+
+    def open(self, mode=None):
+        if mode and any(flag in mode for flag in 'wa+'):
+            raise ValueError("Gzip-stored files are read-only.")
+        if self.closed:
+            self.file = gzip.open(self.packed_path, 'rb')
+        else:
+            self.seek(0)
+        return self
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_END:  # GzipFile only seeks from the start or the current position
+            offset, whence = self.size + offset, io.SEEK_SET
+        return self.file.seek(offset, whence)
+
+
+class CompressedDedupStorage(DedupFileSystemStorage):
+    def _save(self, name, content):
+        level = compress_level(name)
+        digest = getattr(content, 'sha256', None)
+        blob, tmp_path = digest and self.blob_path(digest + GZ), None
+        packed = bool(blob) and os.path.exists(blob)
+        if (level is None or not compression_enabled() or content.size >= MAX_COMPRESS_SIZE
+                or (digest and os.path.exists(self.blob_path(digest)))
+                or (content.size >= MAX_INLINE_COMPRESS and not packed)):
+            # Already stored plain, so a link to it costs nothing; or too big to pack
+            # inside the request, so compress_media takes it (see compress_later).
+            return super()._save(name, content)
+
+        if not packed:
+            tmp_path, digest, packed_size = self._write_packed(content, level)
+            if packed_size > content.size * MAX_PACKED_RATIO:
+                os.remove(tmp_path)
+                return super()._save(name, content)
+            blob = self._store_blob(tmp_path, digest + GZ)
+        try:
+            return self._place(blob, name, move=blob == tmp_path, suffix=GZ)
+        finally:
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _write_packed(self, content, level):
+        """Gzip `content` into a temp file in the blob store, hashing the original bytes
+        on the way. Returns (path, digest, gzipped size)."""
+        os.makedirs(self.staging_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.staging_dir)
+        hasher = hashlib.sha256()
+        with os.fdopen(fd, 'wb') as out:
+            # No name or timestamp in the header: equal content, equal bytes.
+            with gzip.GzipFile(filename='', mode='wb', compresslevel=level, fileobj=out, mtime=0) as packed:
+                if hasattr(content, 'seek'):
+                    content.seek(0)
+                for chunk in content.chunks():
+                    hasher.update(chunk)
+                    packed.write(chunk)
+            packed_size = out.tell()
+        if self.file_permissions_mode is not None:
+            os.chmod(tmp_path, self.file_permissions_mode)
+        return tmp_path, hasher.hexdigest(), packed_size
+
+    def compress_stored(self, name, digest=None):
+        """Replace the plain file stored at `name` (content `digest`) by its gzipped
+        form. Returns True if it was replaced; False if there was nothing to do or the
+        gzip would not pay off."""
+        path, level = self.path(name), compress_level(name)
+        if level is None or not os.path.isfile(path) or os.path.lexists(path + GZ):
+            return False
+
+        blob, tmp_path = digest and self.blob_path(digest + GZ), None
+        if not (blob and os.path.exists(blob)):
+            with open(path, 'rb') as fh:
+                tmp_path, digest, packed_size = self._write_packed(File(fh), level)
+            if packed_size > os.path.getsize(path) * MAX_PACKED_RATIO:
+                os.remove(tmp_path)
+                return False
+            blob = self._store_blob(tmp_path, digest + GZ)
+        try:
+            if blob == tmp_path:
+                file_move_safe(tmp_path, path + GZ, allow_overwrite=False)
+            else:
+                self._link(blob, path + GZ)
+        except FileExistsError:  # packed meanwhile by another worker
+            return False
+        finally:
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        # Readers already holding the plain file keep reading it; new ones get the .gz.
+        os.remove(path)
+        super().release_blob(digest)
+        return True
+
+    def packed_path(self, name):
+        """The on-disk path of `name` if it is stored gzipped, else None."""
+        path = self.path(name)
+        if not os.path.exists(path) and os.path.exists(path + GZ):
+            return path + GZ
+        return None
+
+    def _open(self, name, mode='rb'):
+        packed = self.packed_path(name)
+        if packed is None:
+            return super()._open(name, mode)
+        return PackedFile(packed, name).open(mode)
+
+    def size(self, name):
+        packed = self.packed_path(name)
+        return original_size(packed) if packed else super().size(name)
+
+    def exists(self, name):
+        return super().exists(name) or os.path.lexists(self.path(name) + GZ)
+
+    def delete(self, name):
+        packed = self.packed_path(name) if name else None
+        if packed is None:
+            return super().delete(name)
+        try:
+            os.remove(packed)
+        except FileNotFoundError:
+            pass
+
+    def release_blob(self, digest):
+        super().release_blob(digest)
+        super().release_blob(digest + GZ)
+
+    def adopt(self, name):
+        # A gzip-stored file was linked to its blob when written; hashing the gzipped
+        # bytes here would only file it under a second digest.
+        if name.endswith(GZ) and os.stat(self.path(name)).st_nlink > 1:
+            return True
+        return super().adopt(name)
+
+
+def compress_pending(batch=COMPRESS_BATCH):
+    """Gzip the stored files of queued revisions until the queue is empty. Returns how
+    many were taken.
+
+    Claiming clears compress_pending under SELECT ... FOR UPDATE SKIP LOCKED, so workers
+    never take the same revision twice.
+    """
+    from .models import FileRevision
+
+    taken = 0
+    while True:
+        with transaction.atomic():
+            claimed = list(FileRevision.objects.filter(compress_pending=True).select_for_update(skip_locked=True)
+                           .order_by('id').values_list('id', flat=True)[:batch])
+            FileRevision.objects.filter(id__in=claimed).update(compress_pending=False)
+        if not claimed:
+            return taken
+        compress = getattr(default_storage, 'compress_stored', None)
+        if compression_enabled() and compress is not None:
+            for name, digest in (FileRevision.objects.filter(id__in=claimed, delta_base__isnull=True)
+                                 .order_by('id').values_list('uploaded_file', 'sha256')):
+                compress(name, digest or None)
+        taken += len(claimed)
+
+
+def serve_media(request, path, document_root=None, show_indexes=False):
+    """django.views.static.serve for the DEBUG media route, also serving gzip-stored
+    files (nginx's gzip_static/gunzip in production)."""
+    try:
+        return serve(request, path, document_root, show_indexes)
+    except Http404:
+        try:
+            packed = getattr(default_storage, 'packed_path', lambda name: None)(path)
+        except SuspiciousFileOperation:
+            packed = None
+        if packed is None:
+            raise
+    content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    return FileResponse(default_storage.open(path), content_type=content_type)
@@ -0,0 +1,235 @@
+"""Delta-compressed storage for text revisions (optional: REVISION_DELTAS).
+
+Markdown, KiCad, G-code, source and CSV revisions are mostly small edits of each
+other, yet each is stored in full. With REVISION_DELTAS on, uploading revision N+1 of
+such a file queues revision N to be re-stored as a compressed line delta against N+1
+(a reverse delta, as RCS does): the newest revision is always a plain file, so its
+media URL and every "current revision" reader are untouched, and only history reads
+pay for reconstruction. Every SNAPSHOT_EVERY-th revision (1, 11, 21, ... by default)
+stays in full, which bounds a reconstruction chain. A re-stored revision's file leaves
+the uploads/ tree; its delta lives under .deltas/.
+
+The diff grows faster than the file (about a minute for 10 MB of G-code), so it never
+runs in the upload request:
+
+    python manage.py encode_revision_deltas
+
+drains the queue (FileRevision.delta_pending), diffing outside any lock and only
+taking row locks to swap the stored file. A revision whose encoding is lost -- a
+worker killed mid-diff -- simply stays in full.
+
+Reconstruction is transparent: FileRevision.uploaded_file is a RevisionFieldFile, so
+open()/read() on a delta revision returns its full bytes, checked against the
+revision's SHA-256. They can only be served through /api/file-revisions/<id>/download/,
+the URL every serialized revision links to.
+
+    python manage.py measure_revision_deltas
+
+estimates what the mode would save on the existing MEDIA_ROOT, without writing.
+"""
+import difflib
+import hashlib
+import json
+import os
+import zlib
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+
+DELTA_DIR = '.deltas'
+
+# Line-oriented text formats that are revised by small edits.
+DELTA_EXTENSIONS = {
+    'md', 'txt', 'rst', 'csv', 'tsv', 'json', 'yaml', 'yml', 'xml', 'svg', 'ini', 'toml',
+    'kicad_sch', 'kicad_pcb', 'kicad_pro', 'kicad_sym', 'kicad_mod', 'net', 'sch',
+    'gcode', 'gco', 'nc', 'ngc',
+    'c', 'h', 'cpp', 'hpp', 'cc', 'py', 'js', 'ts', 'rs', 'go', 'java', 'ino', 'v', 'sv', 'vhd',
+}
+# Larger revisions stay in full: diffing them costs more than it saves.
+MAX_DELTA_SOURCE = 16 * 1024 * 1024
+# Revisions claimed per transaction by encode_pending().
+ENCODE_BATCH = 10
+# A delta must be at most this fraction of the full revision to be worth storing.
+MAX_DELTA_RATIO = 0.5
+
+
+def deltas_enabled():
+    return getattr(settings, 'REVISION_DELTAS', False)
+
+
+def snapshot_every():
+    return max(1, int(getattr(settings, 'REVISION_SNAPSHOT_EVERY', 10)))
+
+
+def delta_candidate(name):
+    return os.path.splitext(name or '')[1].lower().lstrip('.') in DELTA_EXTENSIONS
+
+
+def is_snapshot(revision_number):
+    return (revision_number - 1) % snapshot_every() == 0
+
+
+def _lines(data):
+    # latin-1 maps every byte to one code point, so any file round-trips exactly.
+    return data.decode('latin-1').splitlines(keepends=True)
+
+
+def make_delta(base, target):
+    """Compressed delta that rebuilds `target` (bytes) from `base` (bytes)."""
+    base_lines, target_lines = _lines(base), _lines(target)
+    ops = []
+    matcher = difflib.SequenceMatcher(None, base_lines, target_lines)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            ops.append([i1, i2])
+        elif j2 > j1:
+            ops.append(''.join(target_lines[j1:j2]))
+    return zlib.compress(json.dumps(ops, separators=(',', ':')).encode('utf-8'), 9)
+
+
+def apply_delta(base, delta):
+    base_lines = _lines(base)
+    parts = []
+    for op in json.loads(zlib.decompress(delta).decode('utf-8')):
+        parts.append(op if isinstance(op, str) else ''.join(base_lines[op[0]:op[1]]))
+    return ''.join(parts).encode('latin-1')
+
+
+def _read_stored(revision):
+    with default_storage.open(revision.uploaded_file.name, 'rb') as fh:
+        return fh.read()
+
+
+def read_revision_bytes(revision):
+    """Full content of a revision, rebuilt along its delta chain when it has one."""
+    from .models import FileRevision
+
+    chain = [revision]
+    while chain[-1].delta_base_id:
+        chain.append(FileRevision.objects.get(pk=chain[-1].delta_base_id))
+    data = _read_stored(chain[-1])
+    for link in reversed(chain[:-1]):
+        data = apply_delta(data, _read_stored(link))
+        if link.sha256 and hashlib.sha256(data).hexdigest() != link.sha256:
+            raise IOError(f"Revision {link.id} does not rebuild to its recorded digest")
+    return data
+
+
+def queue_previous(revision):
+    """Queue the revision before `revision` to be re-stored as a delta against it, when
+    REVISION_DELTAS is on and it could pay off. Cheap enough for the upload request:
+    the diff itself runs in encode_pending()."""
+    from .models import FileRevision
+
+    if not deltas_enabled() or not delta_candidate(revision.file.name):
+        return
+    previous = (FileRevision.objects.filter(file_id=revision.file_id, revision_number__lt=revision.revision_number)
+                .order_by('-revision_number').values_list('id', 'revision_number').first())
+    if previous is not None and not is_snapshot(previous[1]):
+        FileRevision.objects.filter(pk=previous[0], delta_base__isnull=True).update(delta_pending=True)
+
+
+def encode_pending(batch=ENCODE_BATCH):
+    """Encode queued revisions until the queue is empty. Returns how many were taken.
+
+    Claiming clears delta_pending under SELECT ... FOR UPDATE SKIP LOCKED, so workers
+    never take the same revision twice.
+    """
+    from .models import FileRevision
+
+    taken = 0
+    while True:
+        with transaction.atomic():
+            claimed = list(FileRevision.objects.filter(delta_pending=True).select_for_update(skip_locked=True)
+                           .order_by('id').values_list('id', flat=True)[:batch])
+            FileRevision.objects.filter(id__in=claimed).update(delta_pending=False)
+        if not claimed:
+            return taken
+        for revision in FileRevision.objects.filter(id__in=claimed).select_related('file').order_by('id'):
+            encode(revision)
+        taken += len(claimed)
+
+
+def encode(previous):
+    """Re-store `previous` as a delta against the revision after it, if that pays off.
+    Returns True if it was re-stored."""
+    from .models import FileRevision
+
+    base = (FileRevision.objects.filter(file_id=previous.file_id, revision_number__gt=previous.revision_number)
+            .order_by('revision_number').first())
+    if (base is None or previous.delta_base_id or not previous.uploaded_file or not base.uploaded_file
+            or not delta_candidate(previous.file.name) or is_snapshot(previous.revision_number)
+            or not previous.sha256
+            or (previous.file_size or 0) > MAX_DELTA_SOURCE or (base.file_size or 0) > MAX_DELTA_SOURCE):
+        return False
+
+    try:
+        # The base may itself have become a delta against a newer revision meanwhile.
+        source, target = read_revision_bytes(base), _read_stored(previous)
+    except OSError:
+        return False
+    delta = make_delta(source, target)
+    if len(delta) > len(target) * MAX_DELTA_RATIO or apply_delta(source, delta) != target:
+        return False
+    name = default_storage.save(
+        f"{DELTA_DIR}/{previous.sha256[:2]}/{previous.sha256}-{base.id}.delta", ContentFile(delta))
+
+    with transaction.atomic():
+        # Both rows locked: deleting the base (FileRevisionViewSet.perform_destroy) locks
+        # it too, so it either sees this revision as a dependent or has already gone.
+        current = {row.id: row for row in FileRevision.objects.select_for_update().filter(id__in=[previous.id, base.id])}
+        row = current.get(previous.id)
+        if base.id not in current or row is None or row.delta_base_id \
+                or row.uploaded_file.name != previous.uploaded_file.name:
+            transaction.on_commit(lambda: default_storage.delete(name))
+            return False
+        replaced, digest = previous.uploaded_file.name, previous.sha256
+        FileRevision.objects.filter(pk=previous.pk).update(uploaded_file=name, delta_base=base)
+        previous.uploaded_file.name, previous.delta_base = name, base
+        _announce(previous)
+        transaction.on_commit(lambda: release_stored(replaced, digest))
+    return True
+
+
+def materialize(revision):
+    """Store a delta revision in full again (before its base is deleted)."""
+    from .models import FileRevision
+
+    data = read_revision_bytes(revision)
+    replaced = revision.uploaded_file.name
+    digest = hashlib.sha256(_read_stored(revision)).hexdigest()
+    stored = ContentFile(data)
+    stored.sha256 = revision.sha256
+    name = revision.uploaded_file.field.generate_filename(revision, os.path.basename(revision.file.name))
+    name = default_storage.save(name, stored)
+    FileRevision.objects.filter(pk=revision.pk).update(uploaded_file=name, delta_base=None)
+    revision.uploaded_file.name, revision.delta_base = name, None
+    _announce(revision)
+    transaction.on_commit(lambda: release_stored(replaced, digest))
+
+
+def release_stored(name, digest):
+    """Delete a stored file (content `digest`) no File or FileRevision row references
+    any more -- copies made by duplicate_file share their source's stored names."""
+    from .models import File, FileRevision
+
+    if not name or File.objects.filter(uploaded_file=name).exists() \
+            or FileRevision.objects.filter(uploaded_file=name).exists():
+        return
+    default_storage.delete(name)
+    release_blob = getattr(default_storage, 'release_blob', None)
+    if release_blob:
+        release_blob(digest)
+
+
+def _announce(revision):
+    # Re-encoding changes the revision's download URL; the update() above sent no
+    # signals (see files.changes).
+    from .changes import record_changes
+    from .models import ChangeLog
+    from .payload_cache import invalidate_file_payloads
+
+    record_changes(ChangeLog.REVISION, revision.file.product_id, [revision.id])
+    invalidate_file_payloads([revision.file_id, revision.file.parent_file_id])
@@ -0,0 +1,95 @@
+"""SHA-256 content digests, computed while uploads are received.
+
+The upload handlers below are Django's own memory/temporary-file handlers with a
+running SHA-256 over the chunks they consume; the finished UploadedFile carries the
+hex digest as `.sha256`. FileRevision.save() stores it, so "is this upload identical to
+the last revision" is a string comparison instead of a re-read of stored bytes.
+
+DigestStagingFileUploadHandler, the one installed through FILE_UPLOAD_HANDLERS in
+settings.py, goes one step further: every upload, whatever its size, is streamed to a
+temp file in the media storage's own staging directory (MEDIA_ROOT/.blobs/tmp). Peak
+memory per upload stays at one chunk, and storing the upload later is a rename / hard
+link on the same filesystem (files.blobstore) rather than a copy from /tmp -- the
+cross-filesystem copy that fails on the WSL2 bind mount behind mpp_files.
+"""
+import hashlib
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import TemporaryUploadedFile, UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, MemoryFileUploadHandler, TemporaryFileUploadHandler
+
+HASH_BLOCK = 1024 * 1024
+
+
+class DigestMixin:
+    def new_file(self, *args, **kwargs):
+        # Before super(): the memory handler ends new_file() by raising StopFutureHandlers.
+        self.digest = hashlib.sha256()
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        passed_on = super().receive_data_chunk(raw_data, start)
+        if passed_on is None:  # consumed by this handler, not handed to the next one
+            self.digest.update(raw_data)
+        return passed_on
+
+    def file_complete(self, file_size):
+        uploaded = super().file_complete(file_size)
+        if uploaded is not None:
+            uploaded.sha256 = self.digest.hexdigest()
+        return uploaded
+
+
+class DigestMemoryFileUploadHandler(DigestMixin, MemoryFileUploadHandler):
+    pass
+
+
+class DigestTemporaryFileUploadHandler(DigestMixin, TemporaryFileUploadHandler):
+    pass
+
+
+class StagedUploadedFile(TemporaryUploadedFile):
+    """A TemporaryUploadedFile created in the media storage's staging directory."""
+
+    def __init__(self, name, content_type, size, charset, content_type_extra=None):
+        staging_dir = getattr(default_storage, 'staging_dir', None) or settings.FILE_UPLOAD_TEMP_DIR
+        if staging_dir:
+            os.makedirs(staging_dir, exist_ok=True)
+        file = tempfile.NamedTemporaryFile(suffix='.upload' + os.path.splitext(name)[1], dir=staging_dir)
+        UploadedFile.__init__(self, file, name, content_type, size, charset, content_type_extra)
+
+
+class StagingFileUploadHandler(TemporaryFileUploadHandler):
+    """Django's temporary-file handler, writing into the staging directory."""
+
+    def new_file(self, *args, **kwargs):
+        FileUploadHandler.new_file(self, *args, **kwargs)
+        self.file = StagedUploadedFile(self.file_name, self.content_type, 0, self.charset, self.content_type_extra)
+
+
+class DigestStagingFileUploadHandler(DigestMixin, StagingFileUploadHandler):
+    pass
+
+
+def sha256_of(filelike):
+    """Hex SHA-256 of a file-like object, read in blocks and rewound afterwards."""
+    digest = hashlib.sha256()
+    if hasattr(filelike, 'seek'):
+        filelike.seek(0)
+    for block in iter(lambda: filelike.read(HASH_BLOCK), b''):
+        digest.update(block)
+    if hasattr(filelike, 'seek'):
+        filelike.seek(0)
+    return digest.hexdigest()
+
+
+def content_digest(uploaded):
+    """The digest of an upload: the one computed on receipt when there is one, otherwise
+    hashed now (and remembered on the object)."""
+    digest = getattr(uploaded, 'sha256', None)
+    if not digest:
+        digest = uploaded.sha256 = sha256_of(uploaded)
+    return digest
@@ -0,0 +1,257 @@
+"""Folder drops: many files with their relative paths, stored in one request.
+
+A dropped repository used to arrive as one POST /api/files/ per file plus one POST
+/api/folders/ per directory, each re-resolving the container, looking the file up and
+committing on its own. DropTarget does that work once per drop instead: the
+container's folders are loaded in one query, missing directories are created once,
+and the files already in place are found with one bulk query per write batch, under
+that batch's name locks (files.locks).
+
+The rules are the ones FileViewSet.create (views.store_upload) and the frontend's
+drop handler follow, so a batch lands exactly where the same files uploaded one by one
+would have:
+  - a path's directories become nested folders, merged into existing ones by name;
+  - dropping onto a folder whose name matches the drop's top directory merges into
+    that folder instead of nesting a copy of it inside;
+  - a file versions the top-level file with its name in its folder, or failing that
+    the oldest one with its name anywhere in the container;
+  - with skip_identical, content equal to the current revision stores nothing.
+
+classify_manifest() answers the same question ahead of the upload: given each path's
+size and SHA-256, which would be created, revised or left unchanged, so a client
+re-syncing a folder sends only the files that differ.
+"""
+import os
+
+from django.db import transaction
+from django.db.models import Max
+
+from .changes import deferred_changes
+from .deltas import queue_previous
+from .digests import content_digest, sha256_of
+from .indexing import enqueue_index
+from .locks import lock_file_names
+from .models import File, FileRevision, Folder, category_for_extension
+from .traceability.containers import container_key
+
+# Files written per transaction (and looked up per query while writing); names per
+# bulk lookup query for a manifest.
+WRITE_BATCH = 100
+LOOKUP_BATCH = 500
+
+CREATED = 'created'
+REVISED = 'revised'
+UNCHANGED = 'unchanged'
+
+
+def split_path(raw):
+    """('dir', 'sub', 'name.ext') for a client-relative path; None if it is unusable."""
+    parts = [part for part in str(raw or '').replace('\\', '/').split('/') if part not in ('', '.')]
+    if not parts or '..' in parts:
+        return None
+    return tuple(parts)
+
+
+def same_content(uploaded, revision):
+    """True if the uploaded file is byte-identical to the stored revision.
+
+    Compares the upload's SHA-256 (computed while it was received, see files.digests)
+    with the digest stored on the revision, after a size check, so the stored bytes are
+    never read. Any error returns False (fall through to creating a normal revision).
+    """
+    try:
+        if revision.file_size is not None and getattr(uploaded, 'size', None) not in (None, revision.file_size):
+            return False
+        return content_digest(uploaded) == revision_digest(revision)
+    except Exception:
+        return False
+
+
+def revision_digest(revision):
+    """The revision's stored SHA-256. A revision from before digests were stored is
+    hashed once here and the digest kept (see backfill_revision_digests)."""
+    if not revision.sha256:
+        stored = revision.uploaded_file
+        stored.open('rb')
+        try:
+            revision.sha256 = sha256_of(stored)
+        finally:
+            stored.close()
+        FileRevision.objects.filter(pk=revision.pk).update(sha256=revision.sha256)
+    return revision.sha256
+
+
+class DropTarget:
+    """One stage/iteration (and optionally a folder in it) receiving a drop."""
+
+    def __init__(self, content_type, container, root_folder=None):
+        self.content_type = content_type
+        self.container = container
+        self.root_folder = root_folder
+        self.key = container_key(container)
+        self.folders = {
+            (parent_id, name): folder_id
+            for folder_id, parent_id, name in
+            Folder.objects.filter(container_key=self.key).values_list('id', 'parent_id', 'name')
+        }
+
+    def relative(self, parts):
+        """`parts` relative to the root folder, applying the merge-by-name rule."""
+        if self.root_folder is not None and len(parts) > 1 and parts[0] == self.root_folder.name:
+            return parts[1:]
+        return parts
+
+    def folder_id(self, directories, create=False):
+        """Folder id for a chain of directory names under the root folder. None is the
+        container root; False means the chain doesn't exist yet (and create is off)."""
+        folder_id = self.root_folder.id if self.root_folder is not None else None
+        for name in directories:
+            found = self.folders.get((folder_id, name))
+            if found is None:
+                if not create:
+                    return False
+                folder = Folder(name=name, parent_id=folder_id, product=self.container.product,
+                                content_object=self.container)
+                folder.save()
+                found = self.folders[(folder_id, name)] = folder.id
+            folder_id = found
+        return folder_id
+
+    def existing_files(self, names):
+        """{(folder_id, name): File} and {name: File} for the top-level files with these
+        names, each annotated with last_revision_number."""
+        by_folder, by_name = {}, {}
+        names = sorted(set(names))
+        for start in range(0, len(names), LOOKUP_BATCH):
+            files = (
+                File.objects.filter(container_key=self.key, parent_file__isnull=True,
+                                    name__in=names[start:start + LOOKUP_BATCH])
+                .select_related('current_file_revision')
+                .annotate(last_revision_number=Max('revisions__revision_number'))
+                .order_by('id')
+            )
+            for f in files:
+                f.content_object = self.container  # upload paths read it; spare a query per file
+                by_folder.setdefault((f.folder_id, f.name), f)
+                by_name.setdefault(f.name, f)
+        return by_folder, by_name
+
+
+def store_drop(target, entries, user, options):
+    """Store [(parts, uploaded_file), ...] into `target`. Returns one result dict per
+    entry: {'path', 'status' (created/revised/unchanged), 'file'}.
+
+    `options` carries the shared upload fields: change_description, status,
+    skip_identical.
+    """
+    description = options.get('change_description', '')
+    status_value = options.get('status', 'in_work')
+    stored, results = [], []
+
+    for start in range(0, len(entries), WRITE_BATCH):
+        batch = [(target.relative(parts), uploaded) for parts, uploaded in entries[start:start + WRITE_BATCH]]
+        names = [parts[-1] for parts, _ in batch]
+        with transaction.atomic(), deferred_changes():
+            # Looked up under the name locks (files.locks), so a parallel upload of any
+            # of these names can't slip in between the lookup and the write. The change
+            # feed and version bumps are written last, just before the commit, so the
+            # product row isn't locked across the batch's storage writes (files.changes).
+            lock_file_names(target.key, names)
+            by_folder, by_name = target.existing_files(names)
+            for parts, uploaded in batch:
+                name = parts[-1]
+                folder_id = target.folder_id(parts[:-1], create=True)
+                existing = by_folder.get((folder_id, name)) or by_name.get(name)
+
+                if existing is None:
+                    f = _create_file(target, name, folder_id, uploaded, user, description, status_value)
+                    by_folder[(folder_id, name)] = f
+                    by_name.setdefault(name, f)
+                    outcome = CREATED
+                elif options.get('skip_identical') and existing.current_file_revision_id and \
+                        same_content(uploaded, existing.current_file_revision):
+                    f, outcome = existing, UNCHANGED
+                else:
+                    f = _add_revision(existing, uploaded, user, description, status_value)
+                    outcome = REVISED
+
+                if outcome != UNCHANGED:
+                    stored.append(f)
+                results.append({'path': '/'.join(parts), 'status': outcome, 'file': f.id})
+
+    enqueue_index(stored)  # traceability reindex, run by the indexing worker
+    return results
+
+
+def classify_manifest(target, entries):
+    """Sort [(parts, size, sha256), ...] into {'new': [...], 'changed': [...],
+    'identical': [...]} paths against the target's current revisions, matching files
+    exactly as store_drop would. Reads no stored bytes except to hash a legacy
+    revision that has no digest yet (once; see revision_digest)."""
+    by_folder, by_name = target.existing_files(parts[-1] for parts, _, _ in entries)
+    answer = {'new': [], 'changed': [], 'identical': []}
+    for parts, size, digest in entries:
+        parts = target.relative(parts)
+        path = '/'.join(parts)
+        folder_id = target.folder_id(parts[:-1])
+        existing = (folder_id is not False and by_folder.get((folder_id, parts[-1]))) or by_name.get(parts[-1])
+        if existing is None:
+            answer['new'].append(path)
+        elif _matches(existing.current_file_revision, size, digest):
+            answer['identical'].append(path)
+        else:
+            answer['changed'].append(path)
+    return answer
+
+
+def _matches(revision, size, digest):
+    if revision is None or not revision.uploaded_file or revision.file_size not in (None, size):
+        return False
+    try:
+        return revision_digest(revision) == digest
+    except OSError:  # stored bytes gone missing: let the client upload them again
+        return False
+
+
+def _create_file(target, name, folder_id, uploaded, user, description, status_value):
+    digest = content_digest(uploaded)
+    f = File(
+        owner=user,
+        name=name,
+        uploaded_file=uploaded,
+        content_object=target.container,
+        folder_id=folder_id,
+        status=status_value,
+        category=category_for_extension(os.path.splitext(name)[1].lower().lstrip('.')),
+    )
+    f.save()
+    # Reference the stored upload rather than saving it twice (see views.store_upload).
+    FileRevision(
+        file=f,
+        revision_number=1,
+        uploaded_file=f.uploaded_file.name,
+        sha256=digest,
+        description=description,
+        status=status_value,
+        created_by=user,
+    ).save()
+    f.last_revision_number = 1
+    return f
+
+
+def _add_revision(f, uploaded, user, description, status_value):
+    revision_number = (f.last_revision_number or 0) + 1
+    revision = FileRevision(
+        file=f,
+        revision_number=revision_number,
+        uploaded_file=uploaded,
+        description=description,
+        status=status_value,
+        created_by=user,
+    )
+    revision.save()
+    f.last_revision_number = revision_number
+    f.file_path = revision.file_path
+    f.save(update_fields=['file_path', 'updated_at'])
+    queue_previous(revision)  # no-op unless REVISION_DELTAS is on
+    return f
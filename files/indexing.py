@@ -0,0 +1,120 @@
+"""The traceability indexing queue: reparsing documents off the request path.
+
+Uploads used to call parse_file_safely() inline, so every markdown or xlsx upload
+waited for the read-back from storage, the openpyxl load and the full rewrite of the
+file's TraceNode/TraceEdge rows before its response went out. Now the upload only
+enqueues the file (one IndexJob row, see the model) and
+
+    python manage.py index_traceability
+
+drains the queue, in as many worker processes as you like: each claims a batch with
+SELECT ... FOR UPDATE SKIP LOCKED, so workers never wait on or double-process each
+other's rows. A job whose worker died mid-parse is reclaimed after STALE_AFTER and
+given up on after MAX_ATTEMPTS.
+
+index_status() reports every file not yet indexed (pending, running or failed) for
+the matrix. With TRACE_INDEX_EAGER set, enqueue_index() runs the jobs right away
+instead -- for development without a worker running.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .changes import bump_versions
+from .models import File, IndexJob
+from .traceability.parse import indexable, parse_file
+
+logger = logging.getLogger('files')
+
+CLAIM_BATCH = 20
+STALE_AFTER = timedelta(minutes=10)
+MAX_ATTEMPTS = 3
+
+
+def enqueue_index(files):
+    """Queue a reindex of each of `files` that is a traceability document."""
+    ids = [f.id for f in files if indexable(f)]
+    if not ids:
+        return
+    now = timezone.now()
+    queued = IndexJob.objects.filter(file_id__in=ids)
+    queued.update(state=IndexJob.PENDING, generation=F('generation') + 1, attempts=0,
+                  error='', requested_at=now)
+    known = set(queued.values_list('file_id', flat=True))
+    IndexJob.objects.bulk_create(
+        [IndexJob(file_id=file_id, requested_at=now) for file_id in ids if file_id not in known],
+        ignore_conflicts=True,  # enqueued by a concurrent request in between
+    )
+    if getattr(settings, 'TRACE_INDEX_EAGER', False):
+        for job in claim_jobs(len(ids), file_ids=ids):
+            run_job(job)
+
+
+def claim_jobs(limit=CLAIM_BATCH, file_ids=None):
+    """Mark up to `limit` waiting jobs as running and return them.
+
+    Rows other workers hold are skipped, not waited on. A running job older than
+    STALE_AFTER belongs to a worker that died: it is claimed again, or failed once it
+    has had MAX_ATTEMPTS.
+    """
+    now = timezone.now()
+    stale = Q(state=IndexJob.RUNNING, started_at__lt=now - STALE_AFTER)
+    IndexJob.objects.filter(stale, attempts__gte=MAX_ATTEMPTS).update(
+        state=IndexJob.FAILED, finished_at=now, error="Indexing did not finish; gave up after retries.")
+
+    waiting = IndexJob.objects.filter(Q(state=IndexJob.PENDING) | stale)
+    if file_ids is not None:
+        waiting = waiting.filter(file_id__in=file_ids)
+    with transaction.atomic():
+        jobs = list(waiting.select_for_update(skip_locked=True).order_by('requested_at', 'id')[:limit])
+        IndexJob.objects.filter(id__in=[job.id for job in jobs]).update(
+            state=IndexJob.RUNNING, started_at=now, attempts=F('attempts') + 1)
+    return jobs
+
+
+def run_job(job):
+    """Reparse the job's file and record the outcome. Returns the state recorded."""
+    f = File.objects.select_related('product', 'current_file_revision').filter(id=job.file_id).first()
+    if f is None:
+        return None  # deleted meanwhile; the job went with it
+    state, error = IndexJob.DONE, ''
+    try:
+        parse_file(f)
+    except Exception as exc:
+        logger.exception("traceability: parse failed for %s (id=%s)", f.name, f.id)
+        state, error = IndexJob.FAILED, f"{type(exc).__name__}: {exc}"
+
+    # Only if nothing re-enqueued the file while it was being parsed; otherwise the
+    # newer request stays pending and the next claim picks it up.
+    IndexJob.objects.filter(id=job.id, generation=job.generation).update(
+        state=state, error=error, finished_at=timezone.now())
+    # The matrix shows index status; make sure its cached read moves on either way.
+    bump_versions(f.product_id)
+    return state
+
+
+def drain(limit=None, batch=CLAIM_BATCH):
+    """Run waiting jobs until the queue is empty (or `limit` ran). Returns the count."""
+    ran = 0
+    while limit is None or ran < limit:
+        jobs = claim_jobs(batch if limit is None else min(batch, limit - ran))
+        if not jobs:
+            break
+        for job in jobs:
+            run_job(job)
+        ran += len(jobs)
+    return ran
+
+
+def index_status(product_id):
+    """[{file_id, file_name, state, error}] for the product's files not yet indexed."""
+    jobs = (IndexJob.objects.filter(file__product_id=product_id).exclude(state=IndexJob.DONE)
+            .order_by('requested_at').values_list('file_id', 'file__name', 'state', 'error'))
+    return [
+        {'file_id': file_id, 'file_name': name, 'state': state, 'error': error}
+        for file_id, name, state, error in jobs
+    ]
@@ -0,0 +1,25 @@
+"""Per-(container, file name) locks for uploads.
+
+Deciding what an upload becomes -- a new File, or revision N+1 of the file holding its
+name -- is a read followed by a write. Two parallel uploads of one name used to both
+read revision N and both write N+1 (one then died on FileRevision's unique
+(file, revision_number)), or both miss the file and create two Files under one name.
+
+lock_file_names() serializes exactly those uploads and nothing else: uploads of
+different names, or into different containers, still run fully in parallel. It must
+be called inside transaction.atomic(); the locks are held until it commits. The lock
+rows are claimed with an insert first, so on SQLite (no SELECT ... FOR UPDATE) the
+transaction takes the database write lock before it reads anything and concurrent
+uploads queue on the busy timeout instead of deadlocking.
+"""
+from .models import FileNameLock
+
+
+def lock_file_names(key, names):
+    """Lock the given file names in container `key` until the transaction ends."""
+    names = sorted(set(names))  # one global order, so two multi-name locks can't deadlock
+    if not names:
+        return
+    FileNameLock.objects.bulk_create(
+        [FileNameLock(container_key=key, name=name) for name in names], ignore_conflicts=True)
+    list(FileNameLock.objects.select_for_update().filter(container_key=key, name__in=names).order_by('name'))
@@ -0,0 +1,48 @@
+"""Store SHA-256 digests (and sizes) on revisions uploaded before they were recorded.
+
+    python manage.py backfill_revision_digests
+    python manage.py backfill_revision_digests --limit 500   # in batches, e.g. from cron
+
+New revisions get their digest as the upload is received (files.digests); this reads
+each older revision's bytes once so skip_identical never has to. Safe to rerun: only
+revisions still missing a digest are read.
+"""
+from django.core.management.base import BaseCommand
+
+from files.digests import sha256_of
+from files.models import FileRevision
+
+
+class Command(BaseCommand):
+    help = "Compute and store SHA-256 digests for file revisions that have none."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=None,
+                            help="Stop after this many revisions (default: all)")
+
+    def handle(self, *args, **options):
+        pending = FileRevision.objects.filter(sha256='').exclude(uploaded_file='').order_by('id')
+        if options['limit']:
+            pending = pending[:options['limit']]
+
+        done = unreadable = 0
+        for revision in pending.iterator():
+            stored = revision.uploaded_file
+            try:
+                stored.open('rb')
+                try:
+                    digest = sha256_of(stored)
+                    size = stored.size
+                finally:
+                    stored.close()
+            except (OSError, ValueError) as exc:
+                unreadable += 1
+                self.stderr.write(f"  revision {revision.id} ({revision.uploaded_file.name}): {exc}")
+                continue
+            # .update(): no signals, no updated_at bump -- the content didn't change.
+            FileRevision.objects.filter(pk=revision.pk).update(sha256=digest, file_size=size)
+            done += 1
+
+        self.stdout.write(self.style.SUCCESS(f"Stored digests for {done} revision(s)"))
+        if unreadable:
+            self.stdout.write(self.style.WARNING(f"{unreadable} revision(s) could not be read"))
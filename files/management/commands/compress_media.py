@@ -0,0 +1,38 @@
+"""Drain the compression queue (files.compression).
+
+    python manage.py compress_media            # run forever, polling when idle
+    python manage.py compress_media --once     # empty the queue, then exit
+
+With MEDIA_COMPRESSION on, uploads of MAX_INLINE_COMPRESS or more are stored plain and
+their revision queued; this gzips them after the upload has committed. Several workers
+can run side by side: revisions are claimed with SELECT ... FOR UPDATE SKIP LOCKED.
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from files.compression import COMPRESS_BATCH, compress_pending
+
+
+class Command(BaseCommand):
+    help = "Gzip the stored files of queued revisions; runs until stopped unless --once is given."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help="Exit once the queue is empty")
+        parser.add_argument('--batch', type=int, default=COMPRESS_BATCH,
+                            help=f"Revisions claimed per transaction (default: {COMPRESS_BATCH})")
+        parser.add_argument('--poll', type=float, default=5.0,
+                            help="Seconds to sleep when the queue is empty (default: 5)")
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            ran = compress_pending(batch=options['batch'])
+            total += ran
+            if ran:
+                self.stdout.write(f"Processed {ran} queued revision(s)")
+            if options['once']:
+                break
+            time.sleep(options['poll'])
+        self.stdout.write(self.style.SUCCESS(f"Processed {total} queued revision(s) in total"))
@@ -0,0 +1,49 @@
+"""Move existing uploads into the content-addressed blob store and reclaim orphans.
+
+    python manage.py dedupe_media                # adopt every file, then prune
+    python manage.py dedupe_media --prune-only   # just reclaim unreferenced blobs
+
+Uploads saved since the blob store was introduced (files.blobstore) are already
+deduplicated; this brings older ones in line, replacing each duplicate copy with a hard
+link to a single blob. Paths and file names do not change. Safe to rerun.
+"""
+import os
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+
+from files.blobstore import BLOB_DIR, DedupFileSystemStorage
+
+
+class Command(BaseCommand):
+    help = "Deduplicate stored uploads into the blob store and delete unreferenced blobs."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--prune-only', action='store_true',
+                            help="Skip adopting existing files; only delete unreferenced blobs")
+
+    def handle(self, *args, **options):
+        if not isinstance(default_storage, DedupFileSystemStorage):
+            raise CommandError("The default storage is not files.blobstore.DedupFileSystemStorage.")
+
+        if not options['prune_only']:
+            adopted = skipped = 0
+            for name in self._stored_names(default_storage.location):
+                if default_storage.adopt(name):
+                    adopted += 1
+                else:
+                    skipped += 1
+            self.stdout.write(f"Linked {adopted} file(s) to blobs")
+            if skipped:
+                self.stdout.write(self.style.WARNING(
+                    f"{skipped} file(s) left as plain copies: this filesystem refused a hard link"))
+
+        count, freed = default_storage.prune_blobs()
+        self.stdout.write(self.style.SUCCESS(f"Pruned {count} unreferenced blob(s), {freed} bytes freed"))
+
+    def _stored_names(self, root):
+        for dirpath, dirnames, filenames in os.walk(root):
+            if dirpath == root:
+                dirnames[:] = [d for d in dirnames if d != BLOB_DIR]
+            for filename in filenames:
+                yield os.path.relpath(os.path.join(dirpath, filename), root)
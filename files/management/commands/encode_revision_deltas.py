@@ -0,0 +1,38 @@
+"""Drain the revision delta queue (files.deltas).
+
+    python manage.py encode_revision_deltas            # run forever, polling when idle
+    python manage.py encode_revision_deltas --once     # empty the queue, then exit
+
+With REVISION_DELTAS on, uploads only queue the revision they superseded; it stays
+stored in full until a worker has diffed it. Several workers can run side by side:
+revisions are claimed with SELECT ... FOR UPDATE SKIP LOCKED.
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from files.deltas import ENCODE_BATCH, encode_pending
+
+
+class Command(BaseCommand):
+    help = "Re-store queued revisions as deltas; runs until stopped unless --once is given."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help="Exit once the queue is empty")
+        parser.add_argument('--batch', type=int, default=ENCODE_BATCH,
+                            help=f"Revisions claimed per transaction (default: {ENCODE_BATCH})")
+        parser.add_argument('--poll', type=float, default=5.0,
+                            help="Seconds to sleep when the queue is empty (default: 5)")
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            ran = encode_pending(batch=options['batch'])
+            total += ran
+            if ran:
+                self.stdout.write(f"Processed {ran} queued revision(s)")
+            if options['once']:
+                break
+            time.sleep(options['poll'])
+        self.stdout.write(self.style.SUCCESS(f"Processed {total} queued revision(s) in total"))
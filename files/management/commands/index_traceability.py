@@ -0,0 +1,38 @@
+"""Drain the traceability indexing queue (files.indexing).
+
+    python manage.py index_traceability            # run forever, polling when idle
+    python manage.py index_traceability --once     # empty the queue, then exit
+
+Uploads only enqueue their documents; nothing appears in the matrix until a worker
+has parsed them. Several workers can run side by side: jobs are claimed with
+SELECT ... FOR UPDATE SKIP LOCKED.
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from files.indexing import CLAIM_BATCH, drain
+
+
+class Command(BaseCommand):
+    help = "Reindex queued traceability documents; runs until stopped unless --once is given."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help="Exit once the queue is empty")
+        parser.add_argument('--batch', type=int, default=CLAIM_BATCH,
+                            help=f"Jobs claimed per transaction (default: {CLAIM_BATCH})")
+        parser.add_argument('--poll', type=float, default=2.0,
+                            help="Seconds to sleep when the queue is empty (default: 2)")
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            ran = drain(batch=options['batch'])
+            total += ran
+            if ran:
+                self.stdout.write(f"Indexed {ran} file(s)")
+            if options['once']:
+                break
+            time.sleep(options['poll'])
+        self.stdout.write(self.style.SUCCESS(f"Indexed {total} file(s) in total"))
@@ -0,0 +1,73 @@
+"""Estimate what REVISION_DELTAS (files.deltas) saves on the existing MEDIA_ROOT.
+
+    python manage.py measure_revision_deltas
+    python manage.py measure_revision_deltas --product 3
+
+Read-only: every revision history of a text format is diffed exactly as the delta
+mode would store it -- newest revision and every REVISION_SNAPSHOT_EVERY-th one in
+full, the rest as deltas where a delta is small enough to pay off -- and the totals are
+printed. Revisions already stored as deltas are counted at their stored size. Sizes
+are logical: content shared through the blob store (files.blobstore) is counted once
+per revision.
+"""
+from django.core.management.base import BaseCommand
+
+from files.deltas import (MAX_DELTA_RATIO, MAX_DELTA_SOURCE, DELTA_EXTENSIONS, delta_candidate, is_snapshot,
+                          make_delta)
+from files.models import File, FileRevision
+
+
+class Command(BaseCommand):
+    help = "Estimate the disk space delta-compressed revision storage would save."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--product', type=int, default=None, help="Only this product id")
+
+    def handle(self, *args, **options):
+        files = File.objects.exclude(revisions=None).order_by('id')
+        if options['product']:
+            files = files.filter(product_id=options['product'])
+
+        revisions = full = projected = unreadable = 0
+        for f in files.iterator():
+            if not delta_candidate(f.name):
+                continue
+            history = list(FileRevision.objects.filter(file=f).exclude(uploaded_file='').order_by('revision_number'))
+            newer = None
+            for revision in reversed(history):  # newest first: each is diffed against the next one
+                try:
+                    data = self._read(revision)
+                except OSError:
+                    unreadable += 1
+                    newer = None
+                    continue
+                revisions += 1
+                full += len(data)
+                projected += self._stored_size(revision, data, newer)
+                newer = data
+
+        saved = full - projected
+        percent = 100.0 * saved / full if full else 0.0
+        self.stdout.write(f"Text revisions: {revisions} ({', '.join(sorted(DELTA_EXTENSIONS)[:8])}, ...)")
+        if unreadable:
+            self.stdout.write(self.style.WARNING(f"Unreadable (skipped): {unreadable}"))
+        self.stdout.write(f"Stored in full:  {_mb(full)}")
+        self.stdout.write(f"With deltas:     {_mb(projected)}")
+        self.stdout.write(self.style.SUCCESS(f"Saving:          {_mb(saved)} ({percent:.1f}%)"))
+
+    def _read(self, revision):
+        with revision.uploaded_file.open('rb') as fh:
+            return fh.read()
+
+    def _stored_size(self, revision, data, newer):
+        if revision.delta_base_id:
+            return revision.uploaded_file.storage.size(revision.uploaded_file.name)
+        if newer is None or is_snapshot(revision.revision_number) \
+                or len(data) > MAX_DELTA_SOURCE or len(newer) > MAX_DELTA_SOURCE:
+            return len(data)
+        delta = len(make_delta(newer, data))
+        return delta if delta <= len(data) * MAX_DELTA_RATIO else len(data)
+
+
+def _mb(size):
+    return f"{size / (1024 * 1024):.2f} MB"
@@ -10,7 +10,7 @@ meant to be read against the source files.
 """
 from django.core.management.base import BaseCommand, CommandError
 
-from files.models import File, Iteration, Product, Stage
+from files.models import File, Product
 from files.traceability.containers import display_name, list_containers
 from files.traceability.doctypes import detect_node_type
 from files.traceability.graph import DOC_ORDER, build_graph
@@ -79,7 +79,7 @@ class Command(BaseCommand):
         indexed = skipped = 0
         for file in files:
             # Deliberately unguarded here: the command is the place a parse failure
-            # should be loud. The upload path uses parse_file_safely instead.
+            # should be loud. The indexing queue records failures per file instead.
             result = parse_file(file)
             if result is None:
                 skipped += 1
@@ -156,14 +156,11 @@ class Command(BaseCommand):
 
 def _markdown_files(product):
     """Every .md file attached to any stage or iteration of this product."""
-    stage_ids = list(Stage.objects.filter(product=product).values_list('id', flat=True))
-    iteration_ids = list(Iteration.objects.filter(product=product).values_list('id', flat=True))
-    files = File.objects.filter(name__iendswith='.md').select_related('content_type')
-    return [
-        file for file in files
-        if (file.container_type == 'stage' and file.object_id in stage_ids)
-        or (file.container_type == 'iteration' and file.object_id in iteration_ids)
-    ]
+    return list(
+        File.objects.filter(product=product, name__iendswith='.md')
+        .exclude(container_key='')
+        .select_related('content_type', 'product', 'current_file_revision')
+    )
 
 
 def _clip(text, limit):
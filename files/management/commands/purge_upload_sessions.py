@@ -0,0 +1,32 @@
+"""Delete chunked upload sessions nobody is coming back for, with their part files.
+
+    python manage.py purge_upload_sessions              # untouched for 24 hours
+    python manage.py purge_upload_sessions --hours 2
+
+Finalized sessions go too: their part file is already gone and the File they produced
+is unaffected. Meant to run from cron.
+"""
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from files.models import UploadSession
+
+
+class Command(BaseCommand):
+    help = "Delete chunked upload sessions (and their part files) idle for longer than --hours."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=24,
+                            help="Idle time after which a session is purged (default: 24)")
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(hours=options['hours'])
+        purged = 0
+        # One at a time: UploadSession.delete() removes the part file, a queryset
+        # delete would not.
+        for session in UploadSession.objects.filter(updated_at__lt=cutoff).iterator():
+            session.delete()
+            purged += 1
+        self.stdout.write(self.style.SUCCESS(f"Purged {purged} upload session(s)"))
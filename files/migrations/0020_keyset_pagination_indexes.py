@@ -0,0 +1,25 @@
+# Generated by Django 4.2.1 on 2026-10-17 02:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0019_manualtraceedge_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='file',
+            index=models.Index(fields=['-updated_at', '-id'], name='files_file_updated_d2cab9_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='filerevision',
+            index=models.Index(fields=['-created_at', '-id'], name='files_filer_created_c1c634_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='folder',
+            index=models.Index(fields=['-updated_at', '-id'], name='files_folde_updated_430a53_idx'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 4.2.1 on 2026-10-17 02:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0020_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='file',
+            name='container_key',
+            field=models.CharField(blank=True, default='', max_length=32),
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='product',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='files', to='files.product'),
+        ),
+        migrations.AddField(
+            model_name='folder',
+            name='container_key',
+            field=models.CharField(blank=True, default='', max_length=32),
+        ),
+        migrations.AddIndex(
+            model_name='file',
+            index=models.Index(fields=['product', '-updated_at', '-id'], name='files_file_product_a41e56_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='file',
+            index=models.Index(fields=['container_key', '-updated_at', '-id'], name='files_file_contain_94106b_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='folder',
+            index=models.Index(fields=['container_key', 'parent'], name='files_folde_contain_5da00f_idx'),
+        ),
+    ]
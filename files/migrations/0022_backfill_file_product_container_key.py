@@ -0,0 +1,41 @@
+from django.db import migrations
+
+
+def backfill_product_and_container_key(apps, schema_editor):
+    """Fill File.product / File.container_key and Folder.container_key from the generic FK.
+
+    One UPDATE per container rather than per row. Uses .update() so updated_at is left
+    alone -- backfilling must not reorder everyone's "recently changed" listings.
+    """
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    Stage = apps.get_model('files', 'Stage')
+    Iteration = apps.get_model('files', 'Iteration')
+    File = apps.get_model('files', 'File')
+    Folder = apps.get_model('files', 'Folder')
+
+    for kind, model in (('stage', Stage), ('iteration', Iteration)):
+        ct = ContentType.objects.filter(app_label='files', model=kind).first()
+        if ct is None:
+            continue
+        for container_id, product_id in model.objects.values_list('id', 'product_id'):
+            key = f"{kind}:{container_id}"
+            File.objects.filter(content_type_id=ct.id, object_id=container_id).update(
+                product_id=product_id, container_key=key)
+            Folder.objects.filter(content_type_id=ct.id, object_id=container_id).update(container_key=key)
+
+
+def noop_reverse(apps, schema_editor):
+    """Reversing just drops the fields (handled by 0021); nothing to undo here."""
+    pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('files', '0021_file_product_container_key'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_product_and_container_key, noop_reverse),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.1 on 2026-10-17 02:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0022_backfill_file_product_container_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeLog',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('product_id', models.PositiveIntegerField()),
+                ('kind', models.CharField(choices=[('file', 'File'), ('folder', 'Folder'), ('revision', 'File revision')], max_length=16)),
+                ('object_id', models.PositiveIntegerField()),
+                ('action', models.CharField(choices=[('upsert', 'Created or changed'), ('delete', 'Deleted')], default='upsert', max_length=8)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['product_id', 'id'], name='files_chang_product_c1de9a_idx')],
+            },
+        ),
+    ]
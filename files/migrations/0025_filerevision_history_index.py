@@ -0,0 +1,17 @@
+# Generated by Django 4.2.1 on 2026-10-17 02:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0024_container_versions'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='filerevision',
+            index=models.Index(fields=['file', '-revision_number'], name='files_filer_file_id_da6895_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.2.1 on 2026-10-17 02:54
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0025_filerevision_history_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='file',
+            name='current_file_revision',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='files.filerevision'),
+        ),
+    ]
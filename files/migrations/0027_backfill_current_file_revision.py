@@ -0,0 +1,35 @@
+from django.db import migrations
+from django.db.models import OuterRef, Subquery
+
+
+def backfill_current_file_revision(apps, schema_editor):
+    """Point File.current_file_revision at the revision numbered current_revision, or the
+    newest one when that number has no row.
+
+    Two UPDATEs with correlated subqueries rather than a save() per file, which also
+    leaves updated_at alone.
+    """
+    File = apps.get_model('files', 'File')
+    FileRevision = apps.get_model('files', 'FileRevision')
+
+    revisions = FileRevision.objects.filter(file_id=OuterRef('pk'))
+    File.objects.update(current_file_revision=Subquery(
+        revisions.filter(revision_number=OuterRef('current_revision')).values('id')[:1]))
+    File.objects.filter(current_file_revision__isnull=True).update(current_file_revision=Subquery(
+        revisions.order_by('-revision_number').values('id')[:1]))
+
+
+def noop_reverse(apps, schema_editor):
+    """Reversing just drops the field (handled by 0026); nothing to undo here."""
+    pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0026_file_current_file_revision'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_current_file_revision, noop_reverse),
+    ]
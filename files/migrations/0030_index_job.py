@@ -0,0 +1,32 @@
+# Generated by Django 4.2.1 on 2026-10-17 03:11
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0029_revision_sha256'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IndexJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('state', models.CharField(choices=[('pending', 'Waiting to be indexed'), ('running', 'Indexing'), ('done', 'Indexed'), ('failed', 'Indexing failed')], default='pending', max_length=16)),
+                ('generation', models.PositiveIntegerField(default=0)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('requested_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('file', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='index_job', to='files.file')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['state', 'requested_at'], name='files_index_state_3ee99c_idx')],
+            },
+        ),
+    ]
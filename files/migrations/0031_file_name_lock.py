@@ -0,0 +1,25 @@
+# Generated by Django 4.2.1 on 2026-10-17 03:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0030_index_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FileNameLock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('container_key', models.CharField(max_length=32)),
+                ('name', models.CharField(max_length=255)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='filenamelock',
+            constraint=models.UniqueConstraint(fields=('container_key', 'name'), name='unique_file_name_lock'),
+        ),
+    ]
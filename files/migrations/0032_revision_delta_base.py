@@ -0,0 +1,25 @@
+# Generated by Django 4.2.1 on 2026-10-17 03:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+import files.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0031_file_name_lock'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='filerevision',
+            name='delta_base',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.RESTRICT, related_name='delta_dependents', to='files.filerevision'),
+        ),
+        migrations.AlterField(
+            model_name='filerevision',
+            name='uploaded_file',
+            field=files.models.RevisionFileField(upload_to=files.models.upload_to_revision),
+        ),
+    ]
@@ -0,0 +1,45 @@
+from django.db import migrations, models
+from django.db.models import F, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+
+def backfill_tokens(apps, schema_editor):
+    """Existing rows keep their id as token, and each product's version is raised past
+    its newest one, so a token a client already holds (an id) still means the same
+    thing and every new token is larger."""
+    ChangeLog = apps.get_model('files', 'ChangeLog')
+    Product = apps.get_model('files', 'Product')
+
+    ChangeLog.objects.update(token=F('id'))
+    newest = (ChangeLog.objects.filter(product_id=OuterRef('pk')).values('product_id')
+              .annotate(newest=Max('id')).values('newest'))
+    Product.objects.update(version=Greatest(F('version'), Coalesce(Subquery(newest), 0)))
+
+
+def noop_reverse(apps, schema_editor):
+    """Reversing just drops the field; ids are tokens again."""
+    pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0032_revision_delta_base'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='changelog',
+            name='token',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_tokens, noop_reverse),
+        migrations.RemoveIndex(
+            model_name='changelog',
+            name='files_chang_product_c1de9a_idx',
+        ),
+        migrations.AddIndex(
+            model_name='changelog',
+            index=models.Index(fields=['product_id', 'token'], name='files_chang_product_b10eb5_idx'),
+        ),
+    ]
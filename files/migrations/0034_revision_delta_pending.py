@@ -0,0 +1,22 @@
+# Generated by Django 4.2.1 on 2026-10-17 04:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0033_changelog_token'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='filerevision',
+            name='delta_pending',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddIndex(
+            model_name='filerevision',
+            index=models.Index(condition=models.Q(('delta_pending', True)), fields=['id'], name='files_rev_delta_pending_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.1 on 2026-10-17 04:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0034_revision_delta_pending'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='uploadsession',
+            name='state',
+            field=models.CharField(choices=[('open', 'Receiving chunks'), ('finalizing', 'Being stored'), ('complete', 'Finalized')], default='open', max_length=16),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.1 on 2026-10-17 04:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0035_upload_session_finalizing'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='filerevision',
+            name='compress_pending',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddIndex(
+            model_name='filerevision',
+            index=models.Index(condition=models.Q(('compress_pending', True)), fields=['id'], name='files_rev_compress_pending_idx'),
+        ),
+    ]
@@ -1,8 +1,17 @@
+from django.conf import settings
 from django.db import models
 from django.contrib.auth.models import User
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
+from django.core.files.base import ContentFile
+from django.db.models.fields.files import FieldFile
+from django.utils import timezone
 import os
+import uuid
+
+from .compression import compress_later
+from .digests import content_digest
+from .traceability.containers import container_key_for
 
 # --- File categorization (single source of truth for BOM binning) -----------------
 # Extension -> category. The category is user-overridable; extension is only the default
@@ -64,6 +73,40 @@ def upload_to_revision(instance, filename):
         # Fallback to simple path if anything goes wrong
         return f"uploads/revisions/{filename}"
 
+class RevisionFieldFile(FieldFile):
+    """FieldFile that reads a delta-encoded revision (files.deltas) as its full content.
+
+    Opening or reading such a revision rebuilds its bytes from the delta chain, so every
+    reader -- downloads, the zip export, digests, the traceability parser -- sees the
+    file as uploaded. `path` and `url` still name the stored delta.
+    """
+
+    def _get_file(self):
+        if getattr(self, '_file', None) is None and self.instance.delta_base_id:
+            from .deltas import read_revision_bytes
+            self._file = ContentFile(read_revision_bytes(self.instance), name=self.name)
+        return super()._get_file()
+
+    file = property(_get_file, FieldFile._set_file, FieldFile._del_file)
+
+    @property
+    def size(self):
+        if self.instance.delta_base_id and self.instance.file_size is not None:
+            return self.instance.file_size
+        return super().size
+
+    def open(self, mode='rb'):
+        if self.instance.delta_base_id:
+            self._require_file()
+            self.file.open(mode)
+            return self
+        return super().open(mode)
+
+
+class RevisionFileField(models.FileField):
+    attr_class = RevisionFieldFile
+
+
 def upload_to_file(instance, filename):
     """Generate upload path for original files following product hierarchy"""
     try:
@@ -92,8 +135,36 @@ def upload_to_file(instance, filename):
         # Fallback to simple path if anything goes wrong
         return f"uploads/{filename}"
 
-class Product(models.Model):
-    """Product model - each user can have multiple products"""
+class VersionCounted(models.Model):
+    """A row with a `version` write counter (Product, Stage, Iteration).
+
+    The counter only ever moves through F() updates (files.changes). save() never
+    writes it: a full save of an instance loaded before a concurrent bump would set it
+    back, and a number already handed out as an ETag or change token would be handed
+    out again for different data. Reload the instance to read the current value.
+    """
+    version = models.PositiveBigIntegerField(default=0, editable=False)
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = [name for name in update_fields if name != 'version']
+        elif not self._state.adding and not args and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                                       if not field.primary_key and field.name != 'version']
+        super().save(*args, **kwargs)
+
+
+class Product(VersionCounted):
+    """Product model - each user can have multiple products
+
+    version is bumped on any write to the product, its containers, files, folders or
+    trace links (files.changes.bump_versions); conditional GETs derive their ETag from
+    it and change tokens are taken from it (ChangeLog).
+    """
     name = models.CharField(max_length=255)
     description = models.TextField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -106,8 +177,11 @@ class Product(models.Model):
     def __str__(self):
         return self.name
 
-class Stage(models.Model):
-    """Stage model - each product can have multiple stages with S1, S2, S3... IDs"""
+class Stage(VersionCounted):
+    """Stage model - each product can have multiple stages with S1, S2, S3... IDs
+
+    version is bumped on any write to this stage's files/folders; see Product.
+    """
     STAGE_TYPES = [
         ('workflow', 'Workflow'),
         ('approval', 'Approval'),
@@ -149,8 +223,11 @@ class Stage(models.Model):
             self.name = f"S{self.stage_number}"
         super().save(*args, **kwargs)
 
-class Iteration(models.Model):
-    """Iteration model - each product can have multiple iterations with I1, I2, I3... IDs"""
+class Iteration(VersionCounted):
+    """Iteration model - each product can have multiple iterations with I1, I2, I3... IDs
+
+    version is bumped on any write to this iteration's files/folders; see Product.
+    """
     ITERATION_TYPES = [
         ('design', 'Design'),
         ('prototype', 'Prototype'),
@@ -211,16 +288,28 @@ class Folder(models.Model):
     content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE, null=True, blank=True, related_name='folders')
     object_id = models.PositiveIntegerField(null=True, blank=True)
     content_object = GenericForeignKey('content_type', 'object_id')
+    # 'iteration:3' / 'stage:1', same form as TraceNode.source_container_key. Derived from
+    # the generic FK on save so container-scoped queries are one indexed equality match.
+    container_key = models.CharField(max_length=32, blank=True, default='')
 
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ['name']
+        indexes = [
+            # Keyset pagination (files.pagination) pages newest-first on (updated_at, id).
+            models.Index(fields=['-updated_at', '-id']),
+            models.Index(fields=['container_key', 'parent']),
+        ]
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        self.container_key = container_key_for(self.content_type_id, self.object_id)
+        super().save(*args, **kwargs)
+
     @property
     def container_type(self):
         if isinstance(self.content_object, Stage):
@@ -387,13 +476,19 @@ class File(models.Model):
     # File storage
     uploaded_file = models.FileField(upload_to=upload_to_file, blank=True, null=True)
     file_path = models.CharField(max_length=500, blank=True)
-    file_size = models.PositiveIntegerField(null=True, blank=True)  # Size in bytes
+    file_size = models.PositiveBigIntegerField(null=True, blank=True)  # Size in bytes
 
     # Generic relationship to Stage OR Iteration
     content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
     object_id = models.PositiveIntegerField()
     content_object = GenericForeignKey('content_type', 'object_id')
 
+    # Denormalized from the container above so product- and container-wide listings are
+    # one indexed lookup instead of two GenericFK filters OR'd together. Kept in sync by
+    # save() and by every bulk .update() that moves files (see views.py).
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, null=True, blank=True, related_name='files')
+    container_key = models.CharField(max_length=32, blank=True, default='')
+
     # Owner
     owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='files')
 
@@ -406,6 +501,10 @@ class File(models.Model):
 
     # File metadata
     current_revision = models.IntegerField(default=1)
+    # The FileRevision numbered current_revision, kept in step by FileRevision.save() so
+    # reading it is a join (select_related) rather than an ordered query per file.
+    current_file_revision = models.ForeignKey(
+        'FileRevision', on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='in_work')
     quantity = models.IntegerField(default=1, help_text="Quantity for this file")
     price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True, help_text="Price for this file")
@@ -423,6 +522,12 @@ class File(models.Model):
 
     class Meta:
         ordering = ['-updated_at']
+        indexes = [
+            # Keyset pagination (files.pagination) pages newest-first on (updated_at, id).
+            models.Index(fields=['-updated_at', '-id']),
+            models.Index(fields=['product', '-updated_at', '-id']),
+            models.Index(fields=['container_key', '-updated_at', '-id']),
+        ]
 
     def __str__(self):
         return self.name
@@ -430,13 +535,35 @@ class File(models.Model):
     @property
     def is_child_file(self):
         """Check if this file is a child file"""
-        return self.parent_file is not None
+        return self.parent_file_id is not None
 
     @property
     def latest_revision(self):
-        """Get the latest revision of this file"""
+        """Get the current revision of this file.
+
+        Reads current_file_revision, which list views and the zip download load with
+        select_related (see views.prefetch_file_listing), so serializing N files doesn't
+        cost N extra queries. Files whose current revision was deleted fall back to the
+        newest remaining one.
+        """
+        if self.current_file_revision_id is not None:
+            return self.current_file_revision
+        prefetched = getattr(self, '_prefetched_objects_cache', {}).get('revisions')
+        if prefetched is not None:
+            return max(prefetched, key=lambda rev: rev.revision_number, default=None)
         return self.revisions.order_by('-revision_number').first()
 
+    @property
+    def revision_count(self):
+        """Number of revisions, from the list views' `_revision_count` annotation when present."""
+        annotated = getattr(self, '_revision_count', None)
+        if annotated is not None:
+            return annotated
+        prefetched = getattr(self, '_prefetched_objects_cache', {}).get('revisions')
+        if prefetched is not None:
+            return len(prefetched)
+        return self.revisions.count()
+
     @property
     def file_extension(self):
         """Get file extension from uploaded file"""
@@ -476,14 +603,18 @@ class File(models.Model):
             return self.content_object.iteration_id
         return None
 
-    @property
-    def product(self):
-        """Get the product this file belongs to"""
-        if self.content_object:
-            return self.content_object.product
-        return None
+    def sync_container(self):
+        """Refresh product/container_key from the generic FK. Only touches the database
+        when the container actually changed (or the product was never filled in)."""
+        key = container_key_for(self.content_type_id, self.object_id)
+        if key != self.container_key or (key and self.product_id is None):
+            self.container_key = key
+            container = self.content_object
+            self.product_id = container.product_id if container is not None else None
 
     def save(self, *args, **kwargs):
+        self.sync_container()
+
         # Auto-detect file type from extension
         if self.uploaded_file and (not self.file_type or self.file_type == 'other'):
             ext = self.file_extension
@@ -635,9 +766,21 @@ class FileRevision(models.Model):
     revision_number = models.IntegerField()
 
     # File storage for this revision
-    uploaded_file = models.FileField(upload_to=upload_to_revision)
+    uploaded_file = RevisionFileField(upload_to=upload_to_revision)
+    # Set when the stored file is a delta against this later revision rather than the
+    # full content (REVISION_DELTAS, files.deltas); uploaded_file still reads in full.
+    delta_base = models.ForeignKey('self', on_delete=models.RESTRICT, null=True, blank=True,
+                                   related_name='delta_dependents')
+    # Queued to be re-stored as a delta against the next revision (encode_revision_deltas).
+    delta_pending = models.BooleanField(default=False)
+    # Stored plain for now, queued to be gzipped (compress_media, files.compression).
+    compress_pending = models.BooleanField(default=False)
     file_path = models.CharField(max_length=500, blank=True)
-    file_size = models.PositiveIntegerField(null=True, blank=True)
+    file_size = models.PositiveBigIntegerField(null=True, blank=True)
+    # SHA-256 (hex) of the stored bytes, computed as the upload was received (see
+    # files.digests). Blank on rows from before it existed until
+    # backfill_revision_digests has run.
+    sha256 = models.CharField(max_length=64, blank=True, db_index=True)
 
     # Revision metadata
     description = models.TextField(blank=True, null=True, help_text="Description of changes in this revision")
@@ -651,6 +794,15 @@ class FileRevision(models.Model):
     class Meta:
         unique_together = ['file', 'revision_number']
         ordering = ['-revision_number']
+        indexes = [
+            models.Index(fields=['-created_at', '-id']),
+            # One file's history, newest first (/api/file-revisions/?file_id=).
+            models.Index(fields=['file', '-revision_number']),
+            # The delta encoding queue; almost every row is off it.
+            models.Index(fields=['id'], condition=models.Q(delta_pending=True), name='files_rev_delta_pending_idx'),
+            models.Index(fields=['id'], condition=models.Q(compress_pending=True),
+                         name='files_rev_compress_pending_idx'),
+        ]
 
     def __str__(self):
         return f"{self.file.name} - Rev {self.revision_number}"
@@ -665,13 +817,192 @@ class FileRevision(models.Model):
         if self.uploaded_file:
             if hasattr(self.uploaded_file, 'size'):
                 self.file_size = self.uploaded_file.size
+            if not self.sha256 and not self.uploaded_file._committed:
+                self.sha256 = content_digest(self.uploaded_file.file)
+            if self._state.adding:
+                self.compress_pending = compress_later(self.uploaded_file.name, self.file_size)
 
         super().save(*args, **kwargs)
 
         # Update parent file's current revision
         if self.file:
             self.file.current_revision = self.revision_number
-            self.file.save(update_fields=['current_revision', 'updated_at'])
+            self.file.current_file_revision = self
+            self.file.save(update_fields=['current_revision', 'current_file_revision', 'updated_at'])
+
+
+class ChangeLog(models.Model):
+    """One row per write to a File, Folder or FileRevision, feeding the per-product
+    change feed (/api/products/<id>/changes/), where "everything after token N" is one
+    indexed range scan.
+
+    The token is not the autoincrement id: ids are handed out at insert, but rows only
+    become visible at commit, so a poller could see id N+1 before id N commits and skip
+    it for good. It is the Product.version the writing transaction bumped instead
+    (files.changes.record_changes). That row lock is held until commit, so one product's
+    tokens commit in order; rows of one transaction share a token. Only F() updates move
+    the counter -- a model save never writes it back (VersionCounted) -- so a token is
+    never handed out twice.
+
+    Rows are written by files.changes (signals plus the bulk-update paths in views.py).
+    product_id is a plain column, not a FK: deleting a product cascades through its
+    files, and the deletions logged along the way must not block or join that cascade.
+    """
+    FILE = 'file'
+    FOLDER = 'folder'
+    REVISION = 'revision'
+    KINDS = [
+        (FILE, 'File'),
+        (FOLDER, 'Folder'),
+        (REVISION, 'File revision'),
+    ]
+
+    UPSERT = 'upsert'
+    DELETE = 'delete'
+    ACTIONS = [
+        (UPSERT, 'Created or changed'),
+        (DELETE, 'Deleted'),
+    ]
+
+    product_id = models.PositiveIntegerField()
+    kind = models.CharField(max_length=16, choices=KINDS)
+    object_id = models.PositiveIntegerField()
+    action = models.CharField(max_length=8, choices=ACTIONS, default=UPSERT)
+    token = models.PositiveBigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['product_id', 'token']),
+        ]
+
+    def __str__(self):
+        return f"@{self.token} {self.action} {self.kind} {self.object_id}"
+
+
+class UploadSession(models.Model):
+    """A resumable chunked upload in progress (files.upload_views).
+
+    Chunks are written straight into a part file under CHUNKED_UPLOAD_DIR at their
+    offset; `received` lists the byte ranges verified so far as merged [start, end)
+    pairs. Finalizing hands the assembled file to views.store_upload with the form
+    fields in `params`, exactly as if it had been posted to /api/files/ in one piece.
+    The session is FINALIZING meanwhile, which makes a second finalize a 409; one left
+    there by a worker that died is purged like any idle session (purge_upload_sessions).
+    """
+    OPEN = 'open'
+    FINALIZING = 'finalizing'
+    COMPLETE = 'complete'
+    STATES = [
+        (OPEN, 'Receiving chunks'),
+        (FINALIZING, 'Being stored'),
+        (COMPLETE, 'Finalized'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='upload_sessions')
+    filename = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField()
+    checksum = models.CharField(max_length=64, blank=True, help_text="SHA-256 (hex) of the whole file, if known")
+    params = models.JSONField(default=dict, blank=True)
+    received = models.JSONField(default=list, blank=True)
+    state = models.CharField(max_length=16, choices=STATES, default=OPEN)
+    file = models.ForeignKey(File, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.filename} ({self.state})"
+
+    @property
+    def part_path(self):
+        return os.path.join(settings.CHUNKED_UPLOAD_DIR, f"{self.id}.part")
+
+    @property
+    def received_bytes(self):
+        return sum(end - start for start, end in self.received)
+
+    def missing_ranges(self):
+        """[start, end) ranges not yet received, in order."""
+        missing, cursor = [], 0
+        for start, end in self.received:
+            if start > cursor:
+                missing.append([cursor, start])
+            cursor = max(cursor, end)
+        if cursor < self.size:
+            missing.append([cursor, self.size])
+        return missing
+
+    def discard_part(self):
+        try:
+            os.remove(self.part_path)
+        except FileNotFoundError:
+            pass
+
+    def delete(self, *args, **kwargs):
+        self.discard_part()
+        return super().delete(*args, **kwargs)
+
+
+class FileNameLock(models.Model):
+    """One row per file name ever uploaded into a container, locked while an upload of
+    that name looks up, numbers and writes its revision (files.locks).
+
+    The unique (container_key, name) pair is what makes the lock exist exactly once;
+    the rows hold no other state and can be deleted at any time.
+    """
+    container_key = models.CharField(max_length=32)
+    name = models.CharField(max_length=255)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['container_key', 'name'], name='unique_file_name_lock'),
+        ]
+
+    def __str__(self):
+        return f"{self.container_key}/{self.name}"
+
+
+class IndexJob(models.Model):
+    """A file waiting for (or done with) its traceability reindex.
+
+    One row per file: enqueueing a file that already has a row sets it back to pending
+    and bumps `generation`, so a burst of uploads of one document costs one reparse.
+    The worker (manage.py index_traceability, files.indexing) claims pending rows with
+    SELECT ... FOR UPDATE SKIP LOCKED and only records its result if `generation` is
+    still the one it claimed -- a file re-uploaded mid-parse stays pending.
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATES = [
+        (PENDING, 'Waiting to be indexed'),
+        (RUNNING, 'Indexing'),
+        (DONE, 'Indexed'),
+        (FAILED, 'Indexing failed'),
+    ]
+
+    file = models.OneToOneField(File, on_delete=models.CASCADE, related_name='index_job')
+    state = models.CharField(max_length=16, choices=STATES, default=PENDING)
+    generation = models.PositiveIntegerField(default=0)
+    attempts = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    requested_at = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['state', 'requested_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.file_id} ({self.state})"
 
 
 # --- Traceability index -----------------------------------------------------------
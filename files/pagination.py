@@ -0,0 +1,114 @@
+"""Opt-in keyset (cursor) pagination for the file, revision and folder listings.
+
+Listings stay unpaginated unless the caller asks for a page with ?page_size= or follows a
+?cursor= it was given, so existing clients keep receiving a plain list (endpoints that
+are new enough to have no such clients pass required=True). A page is selected with a
+(timestamp, id) comparison against the last row of the previous page
+rather than an OFFSET, so fetching page 1,000 of a 50k-file product costs the same
+indexed range scan as page 1 and rows edited mid-walk are never skipped or repeated
+because of shifted offsets.
+"""
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from .streaming import list_response
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+class KeysetPagination(BasePagination):
+    """Newest-first pages keyed on (`keyset_field`, id).
+
+    Views pick the ordering column -- a timestamp, or a counter such as
+    revision_number -- with a `keyset_field` attribute (default 'updated_at'); the
+    model needs a matching (field, id) index for the range scan to stay cheap.
+    Paginated responses are {"next": <url or null>, "results": [...]}.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    default_keyset_field = 'updated_at'
+    invalid_cursor_message = 'Invalid cursor'
+    required = False
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if (not self.required and self.cursor_query_param not in params
+                and self.page_size_query_param not in params):
+            return None
+
+        self.request = request
+        self.field = getattr(view, 'keyset_field', self.default_keyset_field)
+        self.model_field = queryset.model._meta.get_field(self.field)
+        self.page_size = self.get_page_size(request)
+
+        queryset = queryset.order_by(f'-{self.field}', '-id')
+        encoded = params.get(self.cursor_query_param)
+        if encoded:
+            position, last_id = self.decode_cursor(encoded)
+            queryset = queryset.filter(
+                Q(**{f'{self.field}__lt': position}) |
+                Q(**{self.field: position, 'id__lt': last_id})
+            )
+
+        rows = list(queryset[:self.page_size + 1])
+        self.has_next = len(rows) > self.page_size
+        self.page = rows[:self.page_size]
+        return self.page
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, DEFAULT_PAGE_SIZE))
+        except (TypeError, ValueError):
+            return DEFAULT_PAGE_SIZE
+        return max(1, min(size, MAX_PAGE_SIZE))
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        last = self.page[-1]
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(url, self.page_size_query_param, self.page_size)
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(last))
+
+    def get_paginated_response(self, data):
+        return Response({'next': self.get_next_link(), 'results': data})
+
+    def encode_cursor(self, row):
+        payload = json.dumps([self.model_field.value_to_string(row), row.id])
+        return base64.urlsafe_b64encode(payload.encode('ascii')).decode('ascii')
+
+    def decode_cursor(self, encoded):
+        """(position, id) from a cursor this class issued; NotFound for anything else."""
+        try:
+            position, last_id = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))
+            position = self.model_field.to_python(position)
+            last_id = int(last_id)
+        except (TypeError, ValueError, UnicodeEncodeError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        if position is None:
+            raise NotFound(self.invalid_cursor_message)
+        return position, last_id
+
+
+def paginate(queryset, request, serialize, view=None, required=False):
+    """Keyset-paginate `queryset` for an @action listing when the caller opted in
+    (always, with `required`).
+
+    `serialize` turns rows into response data. Returns the paginated Response, or the
+    whole list (streamed with ?stream=true, see files.streaming) when no page was
+    requested.
+    """
+    paginator = KeysetPagination()
+    paginator.required = required
+    page = paginator.paginate_queryset(queryset, request, view=view)
+    if page is None:
+        return list_response(queryset, request, serialize)
+    return paginator.get_paginated_response(serialize(page))
@@ -0,0 +1,120 @@
+"""Cache of serialized FileSerializer payloads, one fragment per file.
+
+A file's payload only changes when the file, its revisions or its child files change,
+so list views look every row up here first and serialize (with the usual bulk
+prefetches) only the rows that miss.
+
+A fragment key is built from:
+  - the file id, updated_at and container_key, so a row that changed in the database
+    can never be served from an older fragment;
+  - a per-file generation, replaced by invalidate_file_payloads() on every write that
+    leaves updated_at alone -- a child file or revision changing, a bulk move, a
+    product rename (see files.changes and the move paths in views.py);
+  - the payload variant: host (file URLs are absolute) and the ?fields= / ?expand=
+    selection.
+
+Runs on the Django cache named by FILE_PAYLOAD_CACHE (settings.py), which is only set
+when REDIS_URL points the default cache at a Redis every gunicorn worker shares. A
+per-process cache would keep serving a payload another worker had invalidated, so
+without one every request serializes afresh. Redis may evict a generation key like
+any other; the file then starts a new generation (see _generations()).
+"""
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import QuerySet
+
+from .models import File
+from .serializers import FileSerializer
+
+GENERATION_PREFIX = 'filepayload:gen:'
+FRAGMENT_PREFIX = 'filepayload:'
+FRAGMENT_TIMEOUT = 60 * 60 * 24
+
+
+def _cache():
+    alias = getattr(settings, 'FILE_PAYLOAD_CACHE', None)
+    return caches[alias] if alias else None
+
+
+def invalidate_file_payloads(file_ids):
+    """Orphan every cached payload of these files (stale fragments just expire).
+
+    Inside a transaction this happens again once it commits: until then a list request
+    still reads the old rows, and could cache them under the new generation.
+    """
+    file_ids = [file_id for file_id in file_ids if file_id]
+    if file_ids and _cache() is not None:
+        _new_generations(file_ids)
+        if transaction.get_connection().in_atomic_block:
+            transaction.on_commit(lambda: _new_generations(file_ids))
+
+
+def _new_generations(file_ids):
+    _cache().set_many({f'{GENERATION_PREFIX}{file_id}': uuid.uuid4().hex for file_id in file_ids},
+                      timeout=None)
+
+
+def _generations(cache, file_ids):
+    keys = {file_id: f'{GENERATION_PREFIX}{file_id}' for file_id in file_ids}
+    found = cache.get_many(keys.values())
+    generations, fresh = {}, {}
+    for file_id, key in keys.items():
+        if key in found:
+            generations[file_id] = found[key]
+        else:
+            # Never seen, or evicted: start a new generation so nothing cached under a
+            # forgotten one can be picked up again.
+            generations[file_id] = fresh[key] = uuid.uuid4().hex
+    if fresh:
+        cache.set_many(fresh, timeout=None)
+    return generations
+
+
+def _variant(request):
+    selection = ','.join(sorted(FileSerializer.requested_fields(request)))
+    raw = f"{request.scheme}://{request.get_host()}|{selection}"
+    return hashlib.sha256(raw.encode()).hexdigest()[:16]
+
+
+def file_payloads(rows, request, prefetch):
+    """Serialized FileSerializer dicts for `rows` (files or a File queryset), in order.
+
+    `prefetch(queryset, request)` prepares the misses for serialization -- the list
+    views pass views.prefetch_file_listing so misses cost the same fixed query count.
+    """
+    cache = _cache()
+    if cache is None:
+        if isinstance(rows, QuerySet):
+            return FileSerializer(prefetch(rows, request), many=True, context={'request': request}).data
+        rows = list(rows)
+        data = _serialize([row.id for row in rows], request, prefetch)
+        return [data[row.id] for row in rows if row.id in data]
+
+    rows = list(rows)
+    if not rows:
+        return []
+    generations = _generations(cache, [row.id for row in rows])
+    variant = _variant(request)
+    keys = {
+        row.id: (f"{FRAGMENT_PREFIX}{row.id}:{row.updated_at.timestamp()}:{row.container_key}:"
+                 f"{generations[row.id]}:{variant}")
+        for row in rows
+    }
+    cached = cache.get_many(keys.values())
+
+    missing = [row.id for row in rows if keys[row.id] not in cached]
+    if missing:
+        fresh = {keys[file_id]: item for file_id, item in _serialize(missing, request, prefetch).items()}
+        cache.set_many(fresh, timeout=FRAGMENT_TIMEOUT)
+        cached.update(fresh)
+
+    return [cached[keys[row.id]] for row in rows if keys[row.id] in cached]
+
+
+def _serialize(file_ids, request, prefetch):
+    rows = prefetch(File.objects.filter(id__in=file_ids), request)
+    return {item['id']: dict(item) for item in FileSerializer(rows, many=True, context={'request': request}).data}
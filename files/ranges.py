@@ -0,0 +1,110 @@
+"""HTTP byte ranges (Range / If-Range) for the downloads Django streams itself.
+
+Downloads nginx sends (X-Accel-Redirect, see FileRevisionViewSet.download) get ranges
+from nginx. This covers the others -- delta revisions and setups without nginx -- so
+the STEP/STL and image viewers can fetch just a file's header, and browsers and sync
+tools can resume a dropped transfer instead of starting over.
+
+Ranges are served by seeking the opened file: a real seek for plain files and rebuilt
+delta revisions, a forward decompression for gzip-stored media (files.compression).
+Only a single range is answered; a request for several gets the whole file, which
+RFC 9110 allows, and none of these clients asks for more than one.
+"""
+import re
+
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.http import content_disposition_header, http_date, parse_http_date_safe
+
+from .conditional import not_modified
+
+_RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class Unsatisfiable(Exception):
+    pass
+
+
+def parse_range(header, size):
+    """(first, last) byte offsets, inclusive, for a Range header on a `size`-byte file;
+    None when the header is absent, malformed or asks for several ranges (the whole file
+    is sent). Raises Unsatisfiable when no requested byte exists."""
+    match = _RANGE.match((header or '').replace(' ', ''))
+    if not match or match.group(1) == match.group(2) == '':
+        return None
+    first, last = match.groups()
+    if first == '':  # the final `last` bytes
+        length = int(last)
+        if length == 0 or size == 0:
+            raise Unsatisfiable()
+        return max(size - length, 0), size - 1
+    first = int(first)
+    if first >= size:
+        raise Unsatisfiable()
+    if last == '':
+        return first, size - 1
+    if int(last) < first:
+        return None  # syntactically invalid: ignored
+    return first, min(int(last), size - 1)
+
+
+def range_applies(request, etag, last_modified):
+    """False when If-Range names a validator other than the current one: the client's
+    partial copy is stale, so it must get the whole file."""
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith(('"', 'W/')):
+        return if_range == etag  # strong comparison: a weak tag never matches
+    return parse_http_date_safe(if_range) == last_modified
+
+
+def file_response(request, field, filename, content_type, etag, last_modified):
+    """Stream the FieldFile `field`: 304 if the client has it (If-None-Match), 206 for a
+    satisfiable Range, 416 for an unsatisfiable one, the whole file otherwise.
+    `last_modified` is a Unix timestamp."""
+    cached = not_modified(request, etag)
+    if cached is not None:
+        return cached
+
+    last_modified = int(last_modified)
+    size = field.size
+    requested = None
+    if range_applies(request, etag, last_modified):
+        try:
+            requested = parse_range(request.META.get('HTTP_RANGE'), size)
+        except Unsatisfiable:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return _validators(response, etag, last_modified)
+
+    fh = field.open('rb')
+    if requested is None:
+        response = FileResponse(fh, filename=filename, content_type=content_type)
+    else:
+        first, last = requested
+        response = StreamingHttpResponse(_read_range(fh, first, last - first + 1, FileResponse.block_size),
+                                         status=206, content_type=content_type)
+        response['Content-Range'] = f'bytes {first}-{last}/{size}'
+        response['Content-Length'] = str(last - first + 1)
+        response['Content-Disposition'] = content_disposition_header(False, filename)
+    return _validators(response, etag, last_modified)
+
+
+def _validators(response, etag, last_modified):
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    return response
+
+
+def _read_range(fh, offset, length, block_size):
+    try:
+        fh.seek(offset)
+        while length > 0:
+            chunk = fh.read(min(block_size, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        fh.close()
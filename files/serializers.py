@@ -1,7 +1,9 @@
 from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
 from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
-from .models import File, FileRevision, Product, Stage, Iteration, Folder
+from django.urls import reverse
+from .models import File, FileRevision, Product, Stage, Iteration, Folder, UploadSession
 
 class UserSerializer(serializers.ModelSerializer):
     """Simple user serializer for owner information"""
@@ -10,6 +12,14 @@ class UserSerializer(serializers.ModelSerializer):
         fields = ['id', 'username', 'first_name', 'last_name', 'email']
         read_only_fields = ['id']
 
+def _download_url(serializer, revision_id):
+    """Absolute URL of the access-checked download of revision `revision_id`. Serialized
+    file URLs point here: nginx serves no stored file by path."""
+    url = reverse('filerevision-download', args=[revision_id])
+    request = serializer.context.get('request')
+    return request.build_absolute_uri(url) if request else url
+
+
 class FileRevisionSerializer(serializers.ModelSerializer):
     """Serializer for file revisions"""
     created_by = UserSerializer(read_only=True)
@@ -19,6 +29,7 @@ class FileRevisionSerializer(serializers.ModelSerializer):
         model = FileRevision
         fields = [
             'id',
+            'file',
             'revision_number',
             'uploaded_file',
             'file_path',
@@ -30,7 +41,7 @@ class FileRevisionSerializer(serializers.ModelSerializer):
             'created_at',
             'created_by',
         ]
-        read_only_fields = ['id', 'revision_number', 'file_path', 'file_size', 'created_at']
+        read_only_fields = ['id', 'file', 'revision_number', 'file_path', 'file_size', 'created_at']
 
     def get_file_size_mb(self, obj):
         """Convert file size to MB"""
@@ -38,6 +49,12 @@ class FileRevisionSerializer(serializers.ModelSerializer):
             return round(obj.file_size / (1024 * 1024), 2)
         return None
 
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        if data.get('uploaded_file'):
+            data['uploaded_file'] = _download_url(self, instance.pk)
+        return data
+
 class StageSerializer(serializers.ModelSerializer):
     """Serializer for stages"""
     stage_id = serializers.CharField(read_only=True)
@@ -173,7 +190,7 @@ class FolderTreeSerializer(serializers.ModelSerializer):
 class ChildFileSerializer(serializers.ModelSerializer):
     """Serializer for child files (nested under parent files)"""
     latest_revision = FileRevisionSerializer(read_only=True)
-    revisions = FileRevisionSerializer(many=True, read_only=True)
+    revision_count = serializers.IntegerField(read_only=True)
     file_size_mb = serializers.SerializerMethodField()
     owner = UserSerializer(read_only=True)
     container_type = serializers.CharField(read_only=True)
@@ -202,7 +219,7 @@ class ChildFileSerializer(serializers.ModelSerializer):
             'updated_at',
             'owner',
             'latest_revision',
-            'revisions',
+            'revision_count',
         ]
         read_only_fields = [
             'id', 'file_path', 'file_size', 'current_revision',
@@ -215,12 +232,43 @@ class ChildFileSerializer(serializers.ModelSerializer):
             return round(obj.file_size / (1024 * 1024), 2)
         return None
 
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        # The file's own upload is its current revision's stored file.
+        revision_id = instance.current_file_revision_id
+        data['uploaded_file'] = _download_url(self, revision_id) if revision_id and data.get('uploaded_file') else None
+        return data
+
+# Nested blocks FileSerializer only embeds on request once a caller opts into sparse output.
+EXPANDABLE_FILE_FIELDS = ('revisions', 'child_files', 'owner')
+
+# Left out of the default payload too: a file's full history is paged from
+# /api/file-revisions/?file_id=<id>, and only embedded with ?expand=revisions.
+OPT_IN_FILE_FIELDS = ('revisions',)
+
+
+def _csv_param(request, name):
+    """Comma-separated query param as a set of names; None when the param is absent."""
+    raw = request.query_params.get(name)
+    if raw is None:
+        return None
+    return {part.strip() for part in raw.split(',') if part.strip()}
+
+
 class FileSerializer(serializers.ModelSerializer):
-    """Main file serializer"""
+    """Main file serializer.
+
+    Reads honour ?fields=a,b,c (top-level fields to keep) and ?expand=revisions,
+    child_files,owner (nested blocks to embed). With neither param every field except
+    the revision history is returned (latest_revision and revision_count stand in for
+    it); with either, unexpanded nested blocks are left out. See requested_fields(),
+    which the list views also use to skip unneeded prefetches.
+    """
     # Nested serializers
     child_files = ChildFileSerializer(many=True, read_only=True)
     latest_revision = FileRevisionSerializer(read_only=True)
     revisions = FileRevisionSerializer(many=True, read_only=True)
+    revision_count = serializers.IntegerField(read_only=True)
     owner = UserSerializer(read_only=True)
     
     # Computed fields
@@ -269,6 +317,7 @@ class FileSerializer(serializers.ModelSerializer):
             'owner',
             'child_files',
             'latest_revision',
+            'revision_count',
             'revisions',
             # Write-only fields
             'stage_id',
@@ -277,9 +326,36 @@ class FileSerializer(serializers.ModelSerializer):
         read_only_fields = [
             'id', 'file_path', 'file_size', 'file_extension', 'current_revision',
             'created_at', 'updated_at', 'owner', 'is_child_file', 'container_type',
-            'container_id', 'container_db_id', 'product_id', 'product_name'
+            'container_id', 'container_db_id', 'product_id', 'product_name', 'revision_count'
         ]
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        keep = self.requested_fields(self.context.get('request'))
+        for name in list(self.fields):
+            if name not in keep:
+                self.fields.pop(name)
+
+    @classmethod
+    def requested_fields(cls, request):
+        """Names of the fields a read should include.
+
+        Writes always get the default field set so ?fields= can never silently drop
+        input.
+        """
+        default = set(cls.Meta.fields) - set(OPT_IN_FILE_FIELDS)
+        if request is None or request.method not in SAFE_METHODS:
+            return default
+        fields = _csv_param(request, 'fields')
+        expand = _csv_param(request, 'expand')
+        if fields is None and expand is None:
+            return default
+        keep = set(fields) if fields is not None else set(cls.Meta.fields) - set(EXPANDABLE_FILE_FIELDS)
+        keep -= set(EXPANDABLE_FILE_FIELDS)
+        keep |= (expand or set()) & set(EXPANDABLE_FILE_FIELDS)
+        keep.add('id')
+        return keep
+
     def get_container_db_id(self, obj):
         """Get the database ID of the container"""
         if isinstance(obj.content_object, Stage):
@@ -296,15 +372,11 @@ class FileSerializer(serializers.ModelSerializer):
 
     def get_product_name(self, obj):
         """Get product name"""
-        if obj.content_object and hasattr(obj.content_object, 'product'):
-            return obj.content_object.product.name
-        return None
+        return obj.product.name if obj.product_id else None
 
     def get_product_id(self, obj):
         """Get product ID"""
-        if obj.content_object and hasattr(obj.content_object, 'product'):
-            return obj.content_object.product.id
-        return None
+        return obj.product_id
 
     def validate(self, data):
         """Cross-field validation"""
@@ -423,4 +495,27 @@ class ProductSerializer(serializers.ModelSerializer):
             'stages',
             'iterations'
         ]
-        read_only_fields = ['id', 'created_at', 'updated_at', 'owner']
\ No newline at end of file
+        read_only_fields = ['id', 'created_at', 'updated_at', 'owner']
+
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    """Resumable upload state: what has been received and what is still missing."""
+    received_bytes = serializers.IntegerField(read_only=True)
+    missing = serializers.SerializerMethodField()
+
+    class Meta:
+        model = UploadSession
+        fields = [
+            'id', 'filename', 'size', 'checksum', 'state', 'received', 'received_bytes',
+            'missing', 'file', 'created_at', 'updated_at',
+        ]
+        read_only_fields = ['id', 'state', 'received', 'file', 'created_at', 'updated_at']
+
+    def get_missing(self, obj):
+        return obj.missing_ranges()
+
+    def validate_checksum(self, value):
+        value = value.strip().lower()
+        if value and (len(value) != 64 or any(c not in '0123456789abcdef' for c in value)):
+            raise serializers.ValidationError("Expected a hex SHA-256 digest.")
+        return value
@@ -0,0 +1,35 @@
+"""Short-lived signed links to /api/file-revisions/<id>/download/.
+
+Downloads are for signed-in users, and nginx does not serve MEDIA_ROOT by path, so a
+service that fetches a file on the user's behalf -- the Google Docs viewer behind
+FileViewSet.preview_doc -- has no way in. It gets a link whose ?token= names the one
+revision, signed with SECRET_KEY and good for SIGNED_DOWNLOAD_MAX_AGE seconds.
+"""
+from urllib.parse import urlencode
+
+from django.core import signing
+from django.urls import reverse
+from rest_framework.permissions import BasePermission
+
+SALT = 'files.signed-download'
+SIGNED_DOWNLOAD_MAX_AGE = 10 * 60
+
+
+def signed_download_url(request, revision_id):
+    url = reverse('filerevision-download', args=[revision_id])
+    token = signing.dumps(revision_id, salt=SALT)
+    return request.build_absolute_uri(f"{url}?{urlencode({'token': token})}")
+
+
+class HasDownloadToken(BasePermission):
+    """Lets a request in whose ?token= was signed for the revision it asks for."""
+
+    def has_permission(self, request, view):
+        token = request.query_params.get('token')
+        if not token:
+            return False
+        try:
+            revision_id = signing.loads(token, salt=SALT, max_age=SIGNED_DOWNLOAD_MAX_AGE)
+        except signing.BadSignature:
+            return False
+        return str(revision_id) == str(view.kwargs.get('pk'))
@@ -0,0 +1,68 @@
+"""Streaming JSON rendering for the unpaginated file listings.
+
+An unpaginated listing is normally serialized into one list of dicts and then rendered
+into one string, so a 30k-row my-files call holds both in the worker at once. With
+?stream=true the rows are read with QuerySet.iterator() and serialized and written out
+one chunk at a time instead, keeping peak memory at roughly one chunk whatever the
+result size.
+
+The streamed body is byte-identical to what JSONRenderer would have produced (same
+encoder, separators and ensure_ascii), so ETags and clients don't care which path
+served it. Errors raised mid-stream can no longer change the status code -- the 200
+has already been sent -- which is why streaming stays opt-in.
+"""
+import json
+
+from django.http import StreamingHttpResponse
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+STREAM_QUERY_PARAM = 'stream'
+STREAM_CHUNK_SIZE = 500
+
+
+def wants_stream(request):
+    return request.query_params.get(STREAM_QUERY_PARAM, '').lower() in ('1', 'true')
+
+
+def _batches(queryset, chunk_size):
+    batch = []
+    for row in queryset.iterator(chunk_size=chunk_size):
+        batch.append(row)
+        if len(batch) == chunk_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def stream_json(queryset, serialize, chunk_size=STREAM_CHUNK_SIZE):
+    """A StreamingHttpResponse rendering `queryset` as a JSON array.
+
+    `serialize` turns a list of rows into a list of dicts and is called once per chunk,
+    so per-chunk prefetching (see views.serialize_files) still applies.
+    """
+    encoder = JSONEncoder(ensure_ascii=False, allow_nan=False, separators=(',', ':'))
+
+    def encode(item):
+        # Same escaping JSONRenderer applies, for JavaScript-safe output.
+        return encoder.encode(item).replace('\u2028', '\\u2028').replace('\u2029', '\\u2029')
+
+    def body():
+        yield '['
+        first = True
+        for batch in _batches(queryset, chunk_size):
+            items = ','.join(encode(item) for item in serialize(batch))
+            if items:
+                yield items if first else ',' + items
+                first = False
+        yield ']'
+
+    return StreamingHttpResponse(body(), content_type='application/json')
+
+
+def list_response(queryset, request, serialize):
+    """Unpaginated listing: streamed when the caller asked for ?stream=true."""
+    if wants_stream(request):
+        return stream_json(queryset, serialize)
+    return Response(serialize(queryset))
@@ -1,18 +1,36 @@
+import hashlib
 import io
+import os
 import shutil
 import tempfile
+import threading
 import zipfile
+import zlib
+from unittest import mock
+from urllib.parse import quote
 
 from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
+from django.core.cache import caches
+from django.core.management import call_command
+from django.core.files.storage import default_storage
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.test import override_settings
+from django.db import connection, transaction
+from django.test import RequestFactory, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from rest_framework import status
-from rest_framework.test import APITestCase
+from rest_framework.test import APIClient, APITestCase
 
-from .models import Product, Stage, File, Folder
+from .changes import deferred_changes
+from .compression import serve_media
+from .deltas import encode
+from .indexing import claim_jobs, run_job
+from .models import ChangeLog, Product, Stage, Iteration, File, FileRevision, Folder, IndexJob, TraceNode, UploadSession
+from .signed_downloads import signed_download_url
+from .zipstream import ReadAhead, ZipStream
 
 _TMP_MEDIA = tempfile.mkdtemp()
+_TMP_UPLOADS = tempfile.mkdtemp()
 
 
 class FolderAPITests(APITestCase):
@@ -161,7 +179,7 @@ class FolderDownloadTests(APITestCase):
         resp = self.client.get(f'/api/folders/{folder.id}/download/?container_type=stage&container_id={self.stage.id}')
         self.assertEqual(resp.status_code, status.HTTP_200_OK)
         self.assertEqual(resp['Content-Type'], 'application/zip')
-        zf = zipfile.ZipFile(io.BytesIO(resp.content))
+        zf = zipfile.ZipFile(io.BytesIO(resp.getvalue()))
         self.assertIn('a.txt', zf.namelist())
         self.assertEqual(zf.read('a.txt'), b'AAA')
 
@@ -172,12 +190,1373 @@ class FolderDownloadTests(APITestCase):
         self.make_file('deep.txt', sub, b'DEEP')
         resp = self.client.get(f'/api/folders/{root.id}/download/?container_type=stage&container_id={self.stage.id}')
         self.assertEqual(resp.status_code, status.HTTP_200_OK)
-        names = set(zipfile.ZipFile(io.BytesIO(resp.content)).namelist())
+        names = set(zipfile.ZipFile(io.BytesIO(resp.getvalue())).namelist())
         self.assertIn('top.txt', names)
         self.assertIn('Sub/deep.txt', names)
 
+    def download(self, folder):
+        resp = self.client.get(f'/api/folders/{folder.id}/download/?container_type=stage&container_id={self.stage.id}')
+        self.assertTrue(resp.streaming)
+        zf = zipfile.ZipFile(io.BytesIO(resp.getvalue()))
+        self.assertIsNone(zf.testzip())
+        return zf
+
+    def test_download_stores_compressed_formats_and_deflates_the_rest(self):
+        folder = Folder.objects.create(name='Docs', product=self.product)
+        self.make_file('photo.png', folder, b'\x89PNG' + b'p' * 1000)
+        self.make_file('notes.txt', folder, b'n' * 1000)
+        zf = self.download(folder)
+        self.assertEqual(zf.getinfo('photo.png').compress_type, zipfile.ZIP_STORED)
+        self.assertEqual(zf.getinfo('notes.txt').compress_type, zipfile.ZIP_DEFLATED)
+        self.assertEqual(zf.read('photo.png'), b'\x89PNG' + b'p' * 1000)
+
+    @override_settings(MEDIA_COMPRESSION=True)
+    def test_download_passes_gzip_stored_files_through(self):
+        folder = Folder.objects.create(name='CAD', product=self.product)
+        content = b''.join(f'#{i}=VERTEX_POINT(\'\',#{i + 1});\n'.encode() for i in range(500))
+        f = self.make_file('bracket.step', folder, content)
+        self.assertTrue(default_storage.packed_path(f.uploaded_file.name))
+        with mock.patch('files.zipstream.zlib.compressobj') as deflate:
+            zf = self.download(folder)
+        deflate.assert_not_called()
+        self.assertEqual(zf.read('bracket.step'), content)
+
+    def test_download_skips_unreadable_files(self):
+        folder = Folder.objects.create(name='Docs', product=self.product)
+        self.make_file('keep.txt', folder, b'KEEP')
+        gone = self.make_file('gone.txt', folder, b'GONE')
+        os.remove(gone.uploaded_file.path)
+        zf = self.download(folder)
+        self.assertEqual(zf.namelist(), ['keep.txt'])
+
+    def test_archive_order_is_deterministic(self):
+        root = Folder.objects.create(name='Root', product=self.product)
+        sub = Folder.objects.create(name='A', parent=root, product=self.product)
+        for name, folder in (('z.txt', root), ('b.txt', sub), ('a.txt', root), ('a.txt', sub)):
+            self.make_file(name, folder, name.encode())
+        self.assertEqual(self.download(root).namelist(), ['a.txt', 'z.txt', 'A/a.txt', 'A/b.txt'])
+
+    def test_queries_do_not_grow_with_file_count(self):
+        def queries(folder, count):
+            for i in range(count):
+                f = self.make_file(f'f{i}.txt', folder, b'x')
+                for n in (1, 2):
+                    FileRevision.objects.create(file=f, revision_number=n, created_by=self.user,
+                                                uploaded_file=SimpleUploadedFile(f'f{i}.txt', f'r{n}'.encode()))
+                if i % 2:  # current revision deleted: falls back to the newest remaining one
+                    f.current_file_revision.delete()
+            with CaptureQueriesContext(connection) as ctx:
+                zf = self.download(folder)
+            self.assertEqual(zf.read('f1.txt'), b'r1')
+            return len(ctx.captured_queries)
+
+        small = Folder.objects.create(name='Small', product=self.product)
+        large = Folder.objects.create(name='Large', product=self.product)
+        self.assertEqual(queries(small, 2), queries(large, 12))
+
+    def test_read_ahead_reraises_read_errors_and_stops_on_close(self):
+        def broken():
+            yield b'ok'
+            raise OSError('disk gone')
+
+        read_ahead = ReadAhead(workers=2, buffered=1)
+        with self.assertRaises(OSError):
+            list(read_ahead.read(broken()))
+        endless = read_ahead.read(iter(lambda: b'x', None))
+        self.assertEqual(next(endless), b'x')
+        read_ahead.close()  # the producer is blocked on a full buffer: it must give up
+        read_ahead._pool.shutdown(wait=True)
+
+    def test_zip64_members_read_back(self):
+        archive = ZipStream()
+        data = b''.join(archive.add('big.bin', [b'a' * 10, b'b' * 10], size=None))
+        data += b''.join(archive.add_deflated('raw.txt', [zlib.compress(b'raw', 9)[2:-4]], zlib.crc32(b'raw'), 3,
+                                              len(zlib.compress(b'raw', 9)) - 6))
+        data += archive.close()
+        zf = zipfile.ZipFile(io.BytesIO(data))
+        self.assertEqual(zf.read('big.bin'), b'a' * 10 + b'b' * 10)
+        self.assertEqual(zf.read('raw.txt'), b'raw')
+
     def test_download_folder_requires_auth(self):
         self.client.force_authenticate(user=None)
         folder = Folder.objects.create(name='Docs', product=self.product)
         resp = self.client.get(f'/api/folders/{folder.id}/download/')
         self.assertIn(resp.status_code, (status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN))
+
+
+class FileListingTestBase(APITestCase):
+    """Fixtures for the file list endpoints: a product with one stage and one iteration."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('lister', 'lister@test.com', 'password123')
+        self.client.force_authenticate(user=self.user)
+        self.product = Product.objects.create(name='Widget', owner=self.user)
+        self.stage = Stage.objects.create(product=self.product, name='Design', stage_number=1)
+        self.iteration = Iteration.objects.create(product=self.product, name='Proto', iteration_number=1)
+
+    def make_files(self, container, count):
+        ct = ContentType.objects.get_for_model(container)
+        for i in range(count):
+            parent = File.objects.create(name=f'{ct.model}_{i}.stl', owner=self.user, content_type=ct, object_id=container.id)
+            child = File.objects.create(name=f'{ct.model}_{i}_child.stl', owner=self.user, content_type=ct,
+                                        object_id=container.id, parent_file=parent)
+            for f in (parent, child):
+                for n in (1, 2):
+                    FileRevision.objects.create(file=f, revision_number=n, created_by=self.user)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(ctx.captured_queries), response
+
+
+class FileListingQueryTests(FileListingTestBase):
+    """List endpoints must cost a fixed number of queries, however many files they return."""
+
+    def assert_constant_queries(self, url, container, budget=10):
+        self.make_files(container, 2)
+        small, _ = self.count_queries(url)
+        self.make_files(container, 8)
+        large, response = self.count_queries(url)
+        self.assertEqual(small, large)
+        self.assertLessEqual(large, budget)
+        return response
+
+    def test_stage_files_query_count_is_constant(self):
+        response = self.assert_constant_queries(f'/api/stages/{self.stage.id}/files/', self.stage)
+        self.assertEqual(len(response.data), 20)
+
+    def test_iteration_files_query_count_is_constant(self):
+        self.assert_constant_queries(f'/api/iterations/{self.iteration.id}/files/', self.iteration)
+
+    def test_product_file_list_query_count_is_constant(self):
+        response = self.assert_constant_queries(f'/api/files/?product_id={self.product.id}', self.stage)
+        self.assertEqual(len(response.data), 10)
+        row = response.data[0]
+        self.assertEqual(row['product_name'], 'Widget')
+        self.assertEqual(row['latest_revision']['revision_number'], 2)
+        self.assertEqual(len(row['child_files']), 1)
+        self.assertEqual(row['child_files'][0]['latest_revision']['revision_number'], 2)
+
+
+class KeysetPaginationTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('pager', 'pager@test.com', 'password123')
+        self.client.force_authenticate(user=self.user)
+        self.product = Product.objects.create(name='Widget', owner=self.user)
+        self.stage = Stage.objects.create(product=self.product, name='Design', stage_number=1)
+        ct = ContentType.objects.get_for_model(Stage)
+        self.files = [
+            File.objects.create(name=f'part_{i}.stl', owner=self.user, content_type=ct, object_id=self.stage.id)
+            for i in range(7)
+        ]
+        # Give several rows the same timestamp so the id tiebreaker is exercised.
+        File.objects.filter(id__in=[f.id for f in self.files[:4]]).update(updated_at=self.files[0].updated_at)
+
+    def walk(self, url):
+        ids, pages = [], 0
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            ids.extend(row['id'] for row in response.data['results'])
+            url = response.data['next']
+            pages += 1
+        return ids, pages
+
+    def test_unpaginated_by_default(self):
+        response = self.client.get(f'/api/files/?product_id={self.product.id}')
+        self.assertIsInstance(response.data, list)
+        self.assertEqual(len(response.data), 7)
+
+    def test_cursor_walk_returns_every_file_once_in_order(self):
+        ids, pages = self.walk(f'/api/files/?product_id={self.product.id}&page_size=3')
+        self.assertEqual(pages, 3)
+        expected = list(File.objects.order_by('-updated_at', '-id').values_list('id', flat=True))
+        self.assertEqual(ids, expected)
+
+    def test_product_files_action_paginates(self):
+        ids, pages = self.walk(f'/api/products/{self.product.id}/files/?page_size=5')
+        self.assertEqual(pages, 2)
+        self.assertEqual(sorted(ids), sorted(f.id for f in self.files))
+
+    def test_invalid_cursor_is_rejected(self):
+        response = self.client.get('/api/files/?cursor=not-a-cursor')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class SparseFieldsetTests(FileListingTestBase):
+    """?fields= and ?expand= trim the FileSerializer payload and the queries behind it."""
+
+    def test_default_payload_leaves_out_revision_history(self):
+        self.make_files(self.stage, 1)
+        row = self.client.get(f'/api/stages/{self.stage.id}/files/').data[0]
+        for key in ('child_files', 'owner', 'latest_revision', 'revision_count', 'product_name'):
+            self.assertIn(key, row)
+        self.assertNotIn('revisions', row)
+
+    def test_fields_selects_top_level_fields(self):
+        self.make_files(self.stage, 1)
+        response = self.client.get(f'/api/files/?product_id={self.product.id}&fields=name,status,price')
+        self.assertEqual(set(response.data[0]), {'id', 'name', 'status', 'price'})
+
+    def test_expand_embeds_only_requested_blocks(self):
+        self.make_files(self.stage, 1)
+        response = self.client.get(f'/api/files/?product_id={self.product.id}&fields=name&expand=revisions')
+        row = response.data[0]
+        self.assertEqual(set(row), {'id', 'name', 'revisions'})
+        self.assertEqual(len(row['revisions']), 2)
+
+    def test_sparse_listing_skips_unneeded_prefetches(self):
+        self.make_files(self.stage, 5)
+        full, _ = self.count_queries(f'/api/stages/{self.stage.id}/files/')
+        sparse, _ = self.count_queries(f'/api/stages/{self.stage.id}/files/?fields=name,status')
+        self.assertLess(sparse, full)
+        self.assertLessEqual(sparse, 3)
+
+    def test_fields_param_does_not_affect_writes(self):
+        self.make_files(self.stage, 1)
+        f = File.objects.filter(parent_file__isnull=True).first()
+        response = self.client.patch(f'/api/files/{f.id}/?fields=name', {'status': 'approved'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        f.refresh_from_db()
+        self.assertEqual(f.status, 'approved')
+
+
+class RevisionHistoryTests(FileListingTestBase):
+    """A file's history is paged from /api/file-revisions/?file_id= instead of embedded."""
+
+    def setUp(self):
+        super().setUp()
+        ct = ContentType.objects.get_for_model(Stage)
+        self.file = File.objects.create(name='firmware.bin', owner=self.user, content_type=ct, object_id=self.stage.id)
+        for n in range(1, 8):
+            FileRevision.objects.create(file=self.file, revision_number=n, created_by=self.user)
+
+    def test_payload_carries_latest_revision_and_count(self):
+        row = self.client.get(f'/api/files/{self.file.id}/').data
+        self.assertNotIn('revisions', row)
+        self.assertEqual(row['latest_revision']['revision_number'], 7)
+        self.assertEqual(row['revision_count'], 7)
+
+    def test_history_is_paged_newest_first(self):
+        url = f'/api/file-revisions/?file_id={self.file.id}&page_size=3'
+        seen = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(response.data['results']), 3)
+            seen += [r['revision_number'] for r in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(seen, [7, 6, 5, 4, 3, 2, 1])
+
+    def test_history_is_always_paged(self):
+        response = self.client.get(f'/api/file-revisions/?file_id={self.file.id}')
+        self.assertEqual(len(response.data['results']), 7)
+        self.assertIsNone(response.data['next'])
+
+    def test_expand_still_embeds_history(self):
+        response = self.client.get(f'/api/files/{self.file.id}/?expand=revisions')
+        self.assertEqual(len(response.data['revisions']), 7)
+
+    def test_unfiltered_list_pages_by_created_at(self):
+        ct = ContentType.objects.get_for_model(Stage)
+        other = File.objects.create(name='other.bin', owner=self.user, content_type=ct, object_id=self.stage.id)
+        newest = FileRevision.objects.create(file=other, revision_number=1, created_by=self.user)
+        url = '/api/file-revisions/?page_size=4'
+        seen = []
+        while url:
+            response = self.client.get(url)
+            seen += [r['id'] for r in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(seen[0], newest.id)  # not the file with the highest revision_number
+        self.assertEqual(seen, list(FileRevision.objects.order_by('-created_at', '-id').values_list('id', flat=True)))
+
+
+class DenormalizedContainerTests(FileListingTestBase):
+    """File.product / File.container_key follow the generic FK through create, move and copy."""
+
+    def test_create_sets_product_and_container_key(self):
+        self.make_files(self.stage, 1)
+        f = File.objects.filter(parent_file__isnull=True).get()
+        self.assertEqual(f.product_id, self.product.id)
+        self.assertEqual(f.container_key, f'stage:{self.stage.id}')
+
+    def test_move_resyncs_file_and_children(self):
+        self.make_files(self.stage, 1)
+        parent = File.objects.get(parent_file__isnull=True)
+        other = Product.objects.create(name='Other', owner=self.user)
+        target = Iteration.objects.create(product=other, name='Elsewhere', iteration_number=1)
+        response = self.client.post(f'/api/files/{parent.id}/move/', {'iteration_id': target.id})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        for f in File.objects.all():
+            self.assertEqual(f.product_id, other.id)
+            self.assertEqual(f.container_key, f'iteration:{target.id}')
+
+    def test_copy_sets_target_container(self):
+        self.make_files(self.stage, 1)
+        parent = File.objects.get(parent_file__isnull=True)
+        response = self.client.post(f'/api/files/{parent.id}/copy/', {'iteration_id': self.iteration.id})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(File.objects.filter(container_key=f'iteration:{self.iteration.id}').count(), 2)
+
+    def test_folder_move_resyncs_files(self):
+        ct = ContentType.objects.get_for_model(Stage)
+        folder = Folder.objects.create(name='Docs', product=self.product, content_type=ct, object_id=self.stage.id)
+        self.assertEqual(folder.container_key, f'stage:{self.stage.id}')
+        File.objects.create(name='a.md', owner=self.user, content_type=ct, object_id=self.stage.id, folder=folder)
+        response = self.client.post(f'/api/folders/{folder.id}/move/', {'iteration_id': self.iteration.id})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        folder.refresh_from_db()
+        self.assertEqual(folder.container_key, f'iteration:{self.iteration.id}')
+        self.assertEqual(File.objects.get(name='a.md').container_key, f'iteration:{self.iteration.id}')
+
+    def test_product_files_match_both_container_types(self):
+        self.make_files(self.stage, 1)
+        self.make_files(self.iteration, 1)
+        response = self.client.get(f'/api/products/{self.product.id}/files/')
+        self.assertEqual(len(response.data), 4)
+
+
+class ChangeFeedTests(FileListingTestBase):
+    def token(self):
+        response = self.client.get(f'/api/products/{self.product.id}/changes/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data['token']
+
+    def changes(self, since):
+        response = self.client.get(f'/api/products/{self.product.id}/changes/?since={since}')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_returns_only_changes_after_token(self):
+        self.make_files(self.stage, 1)
+        token = self.token()
+        data = self.changes(token)
+        self.assertEqual(data['token'], token)
+        self.assertEqual(data['files'], [])
+
+        parent = File.objects.get(parent_file__isnull=True)
+        self.client.patch(f'/api/files/{parent.id}/', {'status': 'approved'}, format='json')
+        data = self.changes(token)
+        self.assertGreater(data['token'], token)
+        self.assertEqual([f['id'] for f in data['files']], [parent.id])
+        self.assertEqual(data['files'][0]['status'], 'approved')
+
+    def test_reports_new_revisions_and_deletions(self):
+        self.make_files(self.stage, 1)
+        parent = File.objects.get(parent_file__isnull=True)
+        token = self.token()
+        revision = FileRevision.objects.create(file=parent, revision_number=3, created_by=self.user)
+        data = self.changes(token)
+        self.assertEqual([r['id'] for r in data['revisions']], [revision.id])
+
+        token = data['token']
+        child_ids = list(parent.child_files.values_list('id', flat=True))
+        self.client.delete(f'/api/files/{parent.id}/')
+        data = self.changes(token)
+        self.assertEqual(data['files'], [])
+        self.assertEqual(sorted(data['deleted']['files']), sorted([parent.id] + child_ids))
+
+    def test_move_to_other_product_is_a_deletion_here(self):
+        self.make_files(self.stage, 1)
+        parent = File.objects.get(parent_file__isnull=True)
+        token = self.token()
+        other = Product.objects.create(name='Other', owner=self.user)
+        target = Stage.objects.create(product=other, name='Elsewhere', stage_number=1)
+        self.client.post(f'/api/files/{parent.id}/move/', {'stage_id': target.id})
+        data = self.changes(token)
+        self.assertEqual(len(data['deleted']['files']), 2)
+        other_feed = self.client.get(f'/api/products/{other.id}/changes/?since=0').data
+        self.assertEqual(len(other_feed['files']), 2)
+
+    def test_token_is_the_product_version_bumped_with_the_write(self):
+        self.make_files(self.stage, 1)
+        token = self.token()
+        self.product.refresh_from_db()
+        self.assertEqual(token, self.product.version)
+
+        other = Product.objects.create(name='Other', owner=self.user)
+        Folder.objects.create(name='elsewhere', product=other,
+                              content_object=Stage.objects.create(product=other, name='S', stage_number=1))
+        self.assertEqual(self.token(), token)  # tokens are per product
+
+        parent = File.objects.get(parent_file__isnull=True)
+        self.client.patch(f'/api/files/{parent.id}/', {'status': 'approved'}, format='json')
+        rows = ChangeLog.objects.filter(product_id=self.product.id, token__gt=token)
+        self.assertEqual(set(rows.values_list('token', flat=True)), {self.token()})
+
+    def test_saving_a_stale_product_never_reissues_a_token(self):
+        stale = Product.objects.get(pk=self.product.pk)
+        self.make_files(self.stage, 1)
+        token = self.token()
+        stale.name = 'Renamed'
+        stale.save()  # loaded before the writes above
+        parent = File.objects.get(parent_file__isnull=True)
+        self.client.patch(f'/api/files/{parent.id}/', {'status': 'approved'}, format='json')
+        self.assertEqual([f['id'] for f in self.changes(token)['files']], [parent.id])
+        self.assertEqual(ChangeLog.objects.filter(product_id=self.product.id, token__lte=token).count(),
+                         ChangeLog.objects.filter(product_id=self.product.id).count() - 1)
+
+    def test_deferred_changes_are_written_at_the_end_of_the_block(self):
+        token = self.token()
+        with transaction.atomic(), deferred_changes():
+            self.make_files(self.stage, 2)
+            self.assertEqual(self.token(), token)  # nothing locked or logged yet
+        data = self.changes(token)
+        self.assertEqual(len(data['files']), 4)
+        self.assertEqual(ChangeLog.objects.filter(token__gt=token).values('token').distinct().count(), 1)
+
+        token = data['token']
+        with self.assertRaises(RuntimeError), transaction.atomic(), deferred_changes():
+            self.make_files(self.stage, 1)
+            raise RuntimeError
+        self.assertEqual(self.token(), token)
+        self.assertEqual(File.objects.count(), 4)
+
+    def test_upload_logs_its_change_in_its_own_transaction(self):
+        token = self.token()
+        with mock.patch('files.changes.ChangeLog.objects.bulk_create', side_effect=RuntimeError), \
+                self.assertRaises(RuntimeError):
+            self.client.post('/api/files/', {'uploaded_file': SimpleUploadedFile('a.md', b'a'),
+                                             'stage_id': self.stage.id}, format='multipart')
+        self.assertFalse(File.objects.exists())  # the upload rolled back with its change rows
+        self.assertEqual(self.token(), token)
+
+    def folder_of_files(self, product, count):
+        stage = Stage.objects.create(product=product, name=f'S{count}', stage_number=count)
+        folder = Folder.objects.create(name='tree', product=product, content_object=stage)
+        sub = Folder.objects.create(name='sub', product=product, content_object=stage, parent=folder)
+        for i in range(count):
+            f = File.objects.create(name=f'{i}.c', owner=self.user, content_object=stage, folder=sub)
+            for n in (1, 2):
+                FileRevision.objects.create(file=f, revision_number=n, created_by=self.user)
+        return folder
+
+    def test_deleting_a_folder_tree_logs_once_per_product(self):
+        def delete(folder):
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.delete(f'/api/folders/{folder.id}/?recursive=true')
+            self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+            return len(ctx.captured_queries)
+
+        small, large = self.folder_of_files(self.product, 2), self.folder_of_files(self.product, 12)
+        token = self.token()
+        self.assertEqual(delete(small), delete(large))
+        deleted = ChangeLog.objects.filter(product_id=self.product.id, token__gt=token)
+        self.assertEqual(deleted.filter(kind=ChangeLog.FILE).count(), 14)
+        self.assertFalse(deleted.filter(kind=ChangeLog.REVISION).exists())  # covered by the files
+        self.assertEqual(deleted.values('token').distinct().count(), 2)
+
+    def test_deleting_a_product_logs_and_bumps_nothing(self):
+        stage = Stage.objects.create(product=self.product, name='Loose', stage_number=9)
+        for i in range(3):
+            f = File.objects.create(name=f'{i}.c', owner=self.user, content_object=stage)
+            FileRevision.objects.create(file=f, revision_number=1, created_by=self.user)
+        before = ChangeLog.objects.count()
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.delete(f'/api/products/{self.product.id}/')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(ChangeLog.objects.count(), before)
+        bumps = [q['sql'] for q in ctx.captured_queries if 'version' in q['sql'] and q['sql'].startswith('UPDATE')]
+        self.assertEqual(len(bumps), 1, bumps)  # the one token attempt, finding no product
+
+    def test_since_must_be_an_integer(self):
+        response = self.client.get(f'/api/products/{self.product.id}/changes/?since=abc')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class BootstrapTests(FileListingTestBase):
+    def test_bootstrap_query_count_is_constant(self):
+        url = '/api/products/bootstrap/'
+        self.make_files(self.stage, 2)
+        small, _ = self.count_queries(url)
+        for i in range(3):
+            product = Product.objects.create(name=f'Extra {i}', owner=self.user)
+            self.make_files(Stage.objects.create(product=product, name='S', stage_number=1), 3)
+        large, response = self.count_queries(url)
+        self.assertEqual(small, large)
+        self.assertEqual(len(response.data), 4)
+
+    def test_bootstrap_payload(self):
+        self.make_files(self.iteration, 1)
+        data = self.client.get('/api/products/bootstrap/').data
+        product = next(p for p in data if p['id'] == self.product.id)
+        self.assertEqual([c['key'] for c in product['containers']],
+                         [f'stage:{self.stage.id}', f'iteration:{self.iteration.id}'])
+        self.assertEqual(len(product['stages']), 1)
+        self.assertEqual(len(product['files']), 2)
+        self.assertEqual(product['files'][0]['container_key'], f'iteration:{self.iteration.id}')
+        self.assertGreater(product['change_token'], 0)
+
+
+class ConditionalGetTests(FileListingTestBase):
+    def assert_revalidates(self, url, change):
+        first = self.client.get(url)
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        etag = first['ETag']
+
+        with CaptureQueriesContext(connection) as ctx:
+            cached = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(cached.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertLessEqual(len(ctx.captured_queries), 1)
+
+        change()
+        fresh = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(fresh.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(fresh['ETag'], etag)
+
+    def add_file(self):
+        self.make_files(self.stage, 1)
+
+    def test_container_file_list(self):
+        self.assert_revalidates(f'/api/stages/{self.stage.id}/files/', self.add_file)
+
+    def test_container_folder_tree(self):
+        ct = ContentType.objects.get_for_model(Stage)
+        self.assert_revalidates(
+            f'/api/stages/{self.stage.id}/folders/',
+            lambda: Folder.objects.create(name='New', product=self.product, content_type=ct, object_id=self.stage.id),
+        )
+
+    def test_filtered_file_list(self):
+        self.assert_revalidates(f'/api/files/?product_id={self.product.id}', self.add_file)
+
+    def test_product_detail_changes_with_containers(self):
+        self.assert_revalidates(
+            f'/api/products/{self.product.id}/',
+            lambda: Stage.objects.create(product=self.product, name='Later', stage_number=2),
+        )
+
+    def test_traceability_graph(self):
+        self.assert_revalidates(f'/api/traceability/{self.product.id}/', self.add_file)
+
+    def test_other_container_write_keeps_tag(self):
+        url = f'/api/stages/{self.stage.id}/files/'
+        etag = self.client.get(url)['ETag']
+        self.make_files(self.iteration, 1)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_saving_a_stale_instance_keeps_the_version(self):
+        self.make_files(self.stage, 1)  # bumps both counters behind these instances' backs
+        bumped = Product.objects.get(pk=self.product.pk).version, Stage.objects.get(pk=self.stage.pk).version
+        response = self.client.patch(f'/api/products/{self.product.id}/', {'name': 'Renamed'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.product.description = 'stale full save'
+        self.product.save()
+        self.stage.name = 'Renamed'
+        self.stage.save()
+        self.assertGreater(Product.objects.get(pk=self.product.pk).version, bumped[0])
+        self.assertGreater(Stage.objects.get(pk=self.stage.pk).version, bumped[1])
+        self.assertEqual(Product.objects.get(pk=self.product.pk).description, 'stale full save')
+
+    def test_query_string_changes_tag(self):
+        url = f'/api/stages/{self.stage.id}/files/'
+        self.assertNotEqual(self.client.get(url)['ETag'], self.client.get(url + '?fields=name')['ETag'])
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                       'LOCATION': 'payload-cache-tests'}},
+                   FILE_PAYLOAD_CACHE='default')
+class PayloadCacheTests(FileListingTestBase):
+    url = '/api/files/'
+
+    def setUp(self):
+        super().setUp()
+        caches['default'].clear()
+        self.make_files(self.stage, 3)
+
+    def names(self, response):
+        return {f['id']: f for f in response.data}
+
+    def test_warm_listing_skips_serialization_queries(self):
+        cold, first = self.count_queries(self.url)
+        warm, second = self.count_queries(self.url)
+        self.assertLess(warm, cold)
+        self.assertEqual(first.data, second.data)
+
+    def test_patch_invalidates_payload(self):
+        self.client.get(self.url)
+        target = File.objects.filter(parent_file__isnull=True).first()
+        self.client.patch(f'/api/files/{target.id}/', {'description': 'updated'}, format='json')
+        self.assertEqual(self.names(self.client.get(self.url))[target.id]['description'], 'updated')
+
+    def test_revision_and_child_changes_invalidate_parent(self):
+        self.client.get(self.url)
+        parent = File.objects.filter(parent_file__isnull=True).first()
+        child = parent.child_files.get()
+        FileRevision.objects.create(file=parent, revision_number=3, created_by=self.user)
+        child.name = 'renamed.stl'
+        child.save()
+
+        payload = self.names(self.client.get(self.url))[parent.id]
+        self.assertEqual(payload['latest_revision']['revision_number'], 3)
+        self.assertEqual(payload['revision_count'], 3)
+        self.assertEqual(payload['child_files'][0]['name'], 'renamed.stl')
+
+    def test_product_rename_invalidates_payload(self):
+        self.client.get(self.url)
+        self.product.name = 'Renamed'
+        self.product.save()
+        for item in self.client.get(self.url).data:
+            self.assertEqual(item['product_name'], 'Renamed')
+
+    def test_generation_is_replaced_again_on_commit(self):
+        target = File.objects.filter(parent_file__isnull=True).first()
+        key = f'filepayload:gen:{target.id}'
+        with self.captureOnCommitCallbacks(execute=True):
+            target.description = 'updated'
+            target.save()
+            during = caches['default'].get(key)
+        # A listing between the save and the commit would have cached the old row
+        # under `during`; the commit orphans it.
+        self.assertIsNotNone(during)
+        self.assertNotEqual(caches['default'].get(key), during)
+
+    @override_settings(FILE_PAYLOAD_CACHE=None)
+    def test_disabled_without_a_shared_cache(self):
+        caches['default'].clear()
+        self.client.get(self.url)
+        self.assertFalse(caches['default'].get_many([f'filepayload:gen:{f.id}' for f in File.objects.all()]))
+        cold, first = self.count_queries(self.url)
+        warm, second = self.count_queries(self.url)
+        self.assertEqual(warm, cold)
+        self.assertEqual(first.data, second.data)
+
+
+class StreamingListTests(FileListingTestBase):
+    def setUp(self):
+        super().setUp()
+        self.make_files(self.stage, 5)
+
+    def assert_streams_same_body(self, url):
+        plain = self.client.get(url)
+        with mock.patch('files.streaming.STREAM_CHUNK_SIZE', 2):
+            streamed = self.client.get(url + ('&' if '?' in url else '?') + 'stream=true')
+        self.assertEqual(streamed.status_code, status.HTTP_200_OK)
+        self.assertTrue(streamed.streaming)
+        self.assertEqual(b''.join(streamed.streaming_content), plain.content)
+
+    def test_my_files(self):
+        self.assert_streams_same_body('/api/files/my-files/')
+
+    def test_file_list_with_children(self):
+        self.assert_streams_same_body('/api/files/?include_children=true')
+
+    def test_container_files(self):
+        self.assert_streams_same_body(f'/api/stages/{self.stage.id}/files/')
+
+    def test_empty_listing(self):
+        response = self.client.get(f'/api/iterations/{self.iteration.id}/files/', {'stream': 'true'})
+        self.assertEqual(b''.join(response.streaming_content), b'[]')
+
+    def test_paging_takes_precedence(self):
+        response = self.client.get('/api/files/my-files/', {'stream': 'true', 'page_size': 2})
+        self.assertFalse(response.streaming)
+        self.assertEqual(len(response.data['results']), 2)
+
+
+class CurrentFileRevisionTests(FileListingTestBase):
+    """File.current_file_revision follows new revisions so reads are a join, not a query."""
+
+    def setUp(self):
+        super().setUp()
+        self.make_files(self.stage, 1)
+        self.file = File.objects.get(parent_file__isnull=True)
+
+    def test_new_revision_becomes_current(self):
+        revision = FileRevision.objects.create(file=self.file, revision_number=3, created_by=self.user)
+        self.file.refresh_from_db()
+        self.assertEqual(self.file.current_file_revision_id, revision.id)
+        self.assertEqual(self.file.current_revision, 3)
+
+    def test_latest_revision_needs_no_query_when_joined(self):
+        f = File.objects.select_related('current_file_revision').get(id=self.file.id)
+        with self.assertNumQueries(0):
+            self.assertEqual(f.latest_revision.revision_number, 2)
+
+    def test_deleting_current_revision_falls_back_to_newest(self):
+        self.file.current_file_revision.delete()
+        self.file.refresh_from_db()
+        self.assertIsNone(self.file.current_file_revision_id)
+        self.assertEqual(self.file.latest_revision.revision_number, 1)
+
+    def test_copy_points_at_copied_revision(self):
+        response = self.client.post(f'/api/files/{self.file.id}/copy/', {'iteration_id': self.iteration.id}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        copy = File.objects.get(id=response.data['id'])
+        self.assertEqual(copy.current_file_revision.file_id, copy.id)
+        self.assertEqual(copy.current_file_revision.revision_number, 2)
+
+
+@override_settings(MEDIA_ROOT=_TMP_MEDIA, CHUNKED_UPLOAD_DIR=_TMP_UPLOADS)
+class ChunkedUploadTests(FileListingTestBase):
+    content = bytes(range(256)) * 40  # 10240 bytes
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(_TMP_UPLOADS, ignore_errors=True)
+        shutil.rmtree(_TMP_MEDIA, ignore_errors=True)
+        super().tearDownClass()
+
+    def open_session(self, **extra):
+        data = {'filename': 'assembly.step', 'size': len(self.content), 'stage_id': self.stage.id,
+                'checksum': hashlib.sha256(self.content).hexdigest(), **extra}
+        response = self.client.post('/api/uploads/', data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response.data['id']
+
+    def put_chunk(self, session_id, first, last, digest=None):
+        body = self.content[first:last + 1]
+        return self.client.generic(
+            'PUT', f'/api/uploads/{session_id}/', body, content_type='application/octet-stream',
+            HTTP_CONTENT_RANGE=f'bytes {first}-{last}/{len(self.content)}',
+            HTTP_X_CHUNK_SHA256=digest or hashlib.sha256(body).hexdigest(),
+        )
+
+    def test_chunks_in_any_order_assemble_into_a_file(self):
+        session_id = self.open_session(change_description='first cut')
+        for first in (4096, 0, 8192):
+            response = self.put_chunk(session_id, first, min(first + 4095, len(self.content) - 1))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['missing'], [])
+
+        response = self.client.post(f'/api/uploads/{session_id}/finalize/')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        f = File.objects.get(id=response.data['id'])
+        self.assertEqual(f.name, 'assembly.step')
+        self.assertEqual(f.container_key, f'stage:{self.stage.id}')
+        self.assertEqual(f.latest_revision.description, 'first cut')
+        with f.latest_revision.uploaded_file.open('rb') as stored:
+            self.assertEqual(stored.read(), self.content)
+
+    def test_resume_reports_missing_ranges(self):
+        session_id = self.open_session()
+        self.put_chunk(session_id, 0, 4095)
+        progress = self.client.get(f'/api/uploads/{session_id}/').data
+        self.assertEqual(progress['missing'], [[4096, len(self.content)]])
+        response = self.client.post(f'/api/uploads/{session_id}/finalize/')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+    def test_bad_chunk_checksum_is_rejected_and_stays_missing(self):
+        session_id = self.open_session()
+        self.put_chunk(session_id, 0, 4095)
+        response = self.put_chunk(session_id, 0, 4095, digest='0' * 64)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['missing'][0], [0, len(self.content)])
+
+    def test_second_upload_versions_existing_file(self):
+        for _ in range(2):
+            session_id = self.open_session()
+            self.put_chunk(session_id, 0, len(self.content) - 1)
+            self.client.post(f'/api/uploads/{session_id}/finalize/')
+        f = File.objects.get(name='assembly.step')
+        self.assertEqual(f.revision_count, 2)
+
+    def test_finalizing_twice_stores_one_revision(self):
+        session_id = self.open_session()
+        self.put_chunk(session_id, 0, len(self.content) - 1)
+        first = self.client.post(f'/api/uploads/{session_id}/finalize/')
+        second = self.client.post(f'/api/uploads/{session_id}/finalize/')
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(second.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(File.objects.get(name='assembly.step').revision_count, 1)
+
+    def test_failed_finalize_can_be_retried(self):
+        session_id = self.open_session()
+        self.put_chunk(session_id, 0, len(self.content) - 1)
+        with mock.patch('files.upload_views.store_upload', side_effect=OSError), self.assertRaises(OSError):
+            self.client.post(f'/api/uploads/{session_id}/finalize/')
+        self.assertEqual(UploadSession.objects.get(id=session_id).state, UploadSession.OPEN)
+        response = self.client.post(f'/api/uploads/{session_id}/finalize/')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_range_outside_upload_is_refused(self):
+        session_id = self.open_session()
+        response = self.client.generic(
+            'PUT', f'/api/uploads/{session_id}/', b'x', content_type='application/octet-stream',
+            HTTP_CONTENT_RANGE=f'bytes {len(self.content)}-{len(self.content)}/{len(self.content)}',
+            HTTP_X_CHUNK_SHA256=hashlib.sha256(b'x').hexdigest(),
+        )
+        self.assertEqual(response.status_code, status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+
+    def test_abandoning_removes_part_file(self):
+        session_id = self.open_session()
+        session = UploadSession.objects.get(id=session_id)
+        response = self.client.delete(f'/api/uploads/{session_id}/')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(os.path.exists(session.part_path))
+
+
+@override_settings(MEDIA_ROOT=_TMP_MEDIA)
+class ContentDigestTests(FileListingTestBase):
+    def upload(self, content, **extra):
+        data = {'uploaded_file': SimpleUploadedFile('lib.c', content), 'stage_id': self.stage.id, **extra}
+        return self.client.post('/api/files/', data, format='multipart')
+
+    def test_upload_stores_digest_and_size(self):
+        response = self.upload(b'int main;')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        revision = File.objects.get(id=response.data['id']).latest_revision
+        self.assertEqual(revision.sha256, hashlib.sha256(b'int main;').hexdigest())
+        self.assertEqual(revision.file_size, 9)
+
+    def test_new_revision_stores_its_own_digest(self):
+        self.upload(b'v1')
+        self.upload(b'v2')
+        revision = File.objects.get(name='lib.c').latest_revision
+        self.assertEqual(revision.revision_number, 2)
+        self.assertEqual(revision.sha256, hashlib.sha256(b'v2').hexdigest())
+
+    def test_skip_identical_compares_digests_without_reading_storage(self):
+        self.upload(b'same bytes')
+        with mock.patch('files.drops.sha256_of') as rehash:
+            response = self.upload(b'same bytes', skip_identical='true')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        rehash.assert_not_called()
+        self.assertEqual(File.objects.get(name='lib.c').revision_count, 1)
+
+    def test_backfill_command_fills_missing_digests(self):
+        self.upload(b'legacy')
+        FileRevision.objects.update(sha256='', file_size=None)
+        call_command('backfill_revision_digests', stdout=io.StringIO())
+        revision = FileRevision.objects.get()
+        self.assertEqual(revision.sha256, hashlib.sha256(b'legacy').hexdigest())
+        self.assertEqual(revision.file_size, 6)
+
+
+@override_settings(MEDIA_ROOT=_TMP_MEDIA)
+class BlobStoreTests(FileListingTestBase):
+    def upload(self, name, content, stage=None):
+        data = {'uploaded_file': SimpleUploadedFile(name, content), 'stage_id': (stage or self.stage).id}
+        response = self.client.post('/api/files/', data, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return File.objects.get(id=response.data['id']).latest_revision.uploaded_file
+
+    def test_identical_bytes_share_one_blob(self):
+        other = Stage.objects.create(product=self.product, name='Build', stage_number=2)
+        first = self.upload('lib_a.c', b'vendored library')
+        second = self.upload('lib_b.c', b'vendored library', stage=other)
+        self.assertNotEqual(first.name, second.name)
+        self.assertTrue(os.path.samefile(first.path, second.path))
+        with open(second.path, 'rb') as fh:
+            self.assertEqual(fh.read(), b'vendored library')
+
+    def test_different_bytes_get_their_own_blob(self):
+        first = self.upload('a.c', b'one')
+        second = self.upload('b.c', b'two')
+        self.assertFalse(os.path.samefile(first.path, second.path))
+
+    def test_prune_reclaims_unreferenced_blobs(self):
+        stored = self.upload('gone.c', b'short-lived')
+        default_storage.delete(stored.name)
+        blob = default_storage.blob_path(hashlib.sha256(b'short-lived').hexdigest())
+        self.assertTrue(os.path.exists(blob))
+        call_command('dedupe_media', '--prune-only', stdout=io.StringIO())
+        self.assertFalse(os.path.exists(blob))
+
+    def test_uploads_are_staged_on_the_media_filesystem_and_never_copied(self):
+        with mock.patch.object(type(default_storage._wrapped), '_write_hashed') as copy:
+            stored = self.upload('big.bin', b'x' * 300000)
+        copy.assert_not_called()
+        blob = default_storage.blob_path(hashlib.sha256(b'x' * 300000).hexdigest())
+        self.assertTrue(os.path.samefile(stored.path, blob))
+        self.assertEqual(os.stat(blob).st_mode & 0o777, 0o644)
+        self.assertEqual(os.listdir(default_storage.staging_dir), [])
+
+    def test_dedupe_media_links_existing_copies(self):
+        paths = []
+        for name in ('legacy_1.bin', 'legacy_2.bin'):
+            path = os.path.join(_TMP_MEDIA, 'uploads', 'legacy', name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as fh:
+                fh.write(b'same old bytes')
+            paths.append(path)
+        self.assertFalse(os.path.samefile(*paths))
+        call_command('dedupe_media', stdout=io.StringIO())
+        self.assertTrue(os.path.samefile(*paths))
+
+
+@override_settings(MEDIA_ROOT=_TMP_MEDIA, MEDIA_COMPRESSION=True)
+class CompressionTests(FileListingTestBase):
+    STEP = b''.join(f'#{i}=CARTESIAN_POINT(\'\',(0.,{i}.,0.));\n'.encode() for i in range(2000))
+
+    def upload(self, name, content):
+        data = {'uploaded_file': SimpleUploadedFile(name, content), 'stage_id': self.stage.id}
+        response = self.client.post('/api/files/', data, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return File.objects.get(id=response.data['id']).latest_revision
+
+    def test_compressible_format_is_stored_gzipped_and_reads_back(self):
+        revision = self.upload('bracket.step', self.STEP)
+        path = default_storage.path(revision.uploaded_file.name)
+        self.assertFalse(os.path.exists(path))
+        self.assertLess(os.path.getsize(path + '.gz'), len(self.STEP) // 5)
+        self.assertTrue(os.path.samefile(path + '.gz', default_storage.blob_path(revision.sha256 + '.gz')))
+        self.assertEqual(revision.file_size, len(self.STEP))
+        self.assertTrue(default_storage.exists(revision.uploaded_file.name))
+        self.assertEqual(default_storage.size(revision.uploaded_file.name), len(self.STEP))
+        with revision.uploaded_file.open('rb') as fh:
+            self.assertEqual(fh.read(), self.STEP)
+
+    def test_download_and_dev_media_route_serve_original_bytes(self):
+        revision = self.upload('bracket.step', self.STEP)
+        response = self.client.get(f'/api/file-revisions/{revision.id}/download/')
+        self.assertEqual(b''.join(response.streaming_content), self.STEP)
+        self.assertEqual(response['Content-Length'], str(len(self.STEP)))
+        request = RequestFactory().get(f'/media/{revision.uploaded_file.name}')
+        response = serve_media(request, revision.uploaded_file.name, document_root=_TMP_MEDIA)
+        self.assertEqual(b''.join(response.streaming_content), self.STEP)
+
+    def test_other_formats_and_incompressible_bytes_stay_plain(self):
+        for name, content in (('part.stl', self.STEP), ('noise.csv', os.urandom(4096))):
+            revision = self.upload(name, content)
+            self.assertTrue(os.path.exists(revision.uploaded_file.path))
+
+    def test_delete_removes_the_gzipped_file(self):
+        name = self.upload('bracket.step', self.STEP).uploaded_file.name
+        default_storage.delete(name)
+        self.assertFalse(default_storage.exists(name))
+        self.assertFalse(os.path.exists(default_storage.path(name) + '.gz'))
+
+    def test_large_files_are_stored_plain_and_gzipped_by_the_worker(self):
+        with mock.patch('files.compression.MAX_INLINE_COMPRESS', 4096):
+            revision = self.upload('housing.step', self.STEP + b'#0=HOUSING;\n')
+        path = default_storage.path(revision.uploaded_file.name)
+        self.assertTrue(os.path.exists(path))
+        self.assertTrue(revision.compress_pending)
+
+        call_command('compress_media', '--once', stdout=io.StringIO())
+        self.assertFalse(os.path.exists(path))
+        self.assertTrue(os.path.samefile(path + '.gz', default_storage.blob_path(revision.sha256 + '.gz')))
+        self.assertFalse(os.path.exists(default_storage.blob_path(revision.sha256)))
+        self.assertFalse(FileRevision.objects.filter(compress_pending=True).exists())
+        with revision.uploaded_file.open('rb') as fh:
+            self.assertEqual(fh.read(), self.STEP + b'#0=HOUSING;\n')
+
+    def test_switching_off_keeps_stored_files_readable(self):
+        revision = self.upload('bracket.step', self.STEP)
+        with self.settings(MEDIA_COMPRESSION=False):
+            later = self.upload('other.step', self.STEP + b'END;\n')
+            self.assertTrue(os.path.exists(later.uploaded_file.path))
+            with revision.uploaded_file.open('rb') as fh:
+                self.assertEqual(fh.read(), self.STEP)
+
+
+class DropTestBase(FileListingTestBase):
+    def drop(self, files, **extra):
+        data = {
+            'files': [SimpleUploadedFile(path.rsplit('/', 1)[-1], content) for path, content in files],
+            'relativePath': [path for path, _ in files],
+            'stage_id': self.stage.id,
+        }
+        data.update(extra)
+        return self.client.post('/api/files/batch/', data, format='multipart')
+
+
+@override_settings(MEDIA_ROOT=_TMP_MEDIA)
+class BatchUploadTests(DropTestBase):
+    def test_creates_folder_chain_once(self):
+        response = self.drop([('fw/src/main.c', b'main'), ('fw/src/uart.c', b'uart'), ('fw/README.md', b'hi')])
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([r['status'] for r in response.data['results']], ['created'] * 3)
+        self.assertEqual(Folder.objects.filter(name='fw').count(), 1)
+        src = Folder.objects.get(name='src')
+        self.assertEqual(src.parent.name, 'fw')
+        self.assertEqual(src.container_key, f'stage:{self.stage.id}')
+        self.assertEqual(set(File.objects.filter(folder=src).values_list('name', flat=True)), {'main.c', 'uart.c'})
+        revision = File.objects.get(name='main.c').latest_revision
+        self.assertEqual(revision.sha256, hashlib.sha256(b'main').hexdigest())
+
+    def test_redrop_versions_existing_files(self):
+        self.drop([('fw/main.c', b'v1')])
+        response = self.drop([('fw/main.c', b'v2'), ('fw/new.c', b'new')], change_description='sync')
+        self.assertEqual([r['status'] for r in response.data['results']], ['revised', 'created'])
+        main = File.objects.get(name='main.c')
+        self.assertEqual(main.current_revision, 2)
+        self.assertEqual(main.current_file_revision.description, 'sync')
+        self.assertEqual(Folder.objects.filter(name='fw').count(), 1)
+
+    def test_skip_identical_leaves_unchanged_files_alone(self):
+        self.drop([('a.c', b'same'), ('b.c', b'old')])
+        response = self.drop([('a.c', b'same'), ('b.c', b'new')], skip_identical='true')
+        self.assertEqual([r['status'] for r in response.data['results']], ['unchanged', 'revised'])
+        self.assertEqual(File.objects.get(name='a.c').revision_count, 1)
+        response = self.drop([('a.c', b'same')], skip_identical='true')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_drop_onto_same_named_folder_merges(self):
+        ct = ContentType.objects.get_for_model(Stage)
+        root = Folder.objects.create(name='fw', product=self.product, content_type=ct, object_id=self.stage.id)
+        self.drop([('fw/src/main.c', b'x')], folder=root.id)
+        self.assertEqual(Folder.objects.filter(name='fw').count(), 1)
+        self.assertEqual(Folder.objects.get(name='src').parent_id, root.id)
+
+    def test_lookup_queries_do_not_grow_with_file_count(self):
+        self.drop([(f'lib/f{i}.c', b'old') for i in range(3)])
+        with CaptureQueriesContext(connection) as small:
+            self.drop([(f'lib/f{i}.c', b'new') for i in range(3)], skip_identical='true')
+        self.drop([(f'lib/g{i}.c', b'old') for i in range(12)])
+        with CaptureQueriesContext(connection) as large:
+            self.drop([(f'lib/g{i}.c', b'new') for i in range(12)], skip_identical='true')
+        lookups = lambda ctx: [q['sql'] for q in ctx.captured_queries if q['sql'].startswith('SELECT') and (
+            '"files_file"."name" IN' in q['sql'] or 'FROM "files_folder"' in q['sql']
+            or 'FROM "files_stage"' in q['sql'] or 'FROM "files_product"' in q['sql'])]
+        self.assertEqual(len(lookups(small)), len(lookups(large)))
+
+    def test_rejects_paths_escaping_the_target(self):
+        response = self.drop([('../etc/passwd', b'x')])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(File.objects.exists())
+
+
+@override_settings(MEDIA_ROOT=_TMP_MEDIA)
+class ManifestTests(DropTestBase):
+    def manifest(self, files, **extra):
+        listed = [{'relativePath': path, 'size': len(content), 'sha256': hashlib.sha256(content).hexdigest()}
+                  for path, content in files]
+        return self.client.post('/api/files/manifest/', dict(extra, stage_id=self.stage.id, files=listed),
+                                format='json')
+
+    def test_sorts_paths_into_new_changed_identical(self):
+        self.drop([('fw/main.c', b'main'), ('fw/uart.c', b'uart')])
+        response = self.manifest([('fw/main.c', b'main'), ('fw/uart.c', b'uart v2'), ('fw/spi.c', b'spi')])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {'new': ['fw/spi.c'], 'changed': ['fw/uart.c'], 'identical': ['fw/main.c']})
+
+    def test_legacy_revision_is_hashed_once(self):
+        self.drop([('old.c', b'legacy')])
+        FileRevision.objects.update(sha256='')
+        self.assertEqual(self.manifest([('old.c', b'legacy')]).data['identical'], ['old.c'])
+        self.assertEqual(FileRevision.objects.get().sha256, hashlib.sha256(b'legacy').hexdigest())
+
+    def test_rejects_entries_without_digest(self):
+        response = self.client.post('/api/files/manifest/', {
+            'stage_id': self.stage.id, 'files': [{'relativePath': 'a.c', 'size': 1, 'sha256': 'nope'}],
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(MEDIA_ROOT=_TMP_MEDIA)
+class IndexQueueTests(FileListingTestBase):
+    SRS = b'### FR-I2-014 \xe2\x80\x94 Settings menu\nThe settings menu satisfies PRD-I2-001.\n'
+
+    def upload(self, name='2_INKFRAME-SRS-I2-001.md', content=SRS):
+        data = {'uploaded_file': SimpleUploadedFile(name, content), 'stage_id': self.stage.id}
+        response = self.client.post('/api/files/', data, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return File.objects.get(id=response.data['id'])
+
+    def graph(self):
+        return self.client.get(f'/api/traceability/{self.product.id}/').data
+
+    def test_upload_enqueues_instead_of_parsing(self):
+        f = self.upload()
+        self.assertEqual(f.index_job.state, IndexJob.PENDING)
+        self.assertFalse(TraceNode.objects.exists())
+        self.assertEqual([(e['file_id'], e['state']) for e in self.graph()['indexing']], [(f.id, 'pending')])
+
+        call_command('index_traceability', '--once', stdout=io.StringIO())
+        f.index_job.refresh_from_db()
+        self.assertEqual(f.index_job.state, IndexJob.DONE)
+        self.assertEqual(list(TraceNode.objects.values_list('tag_id', flat=True)), ['FR-I2-014'])
+        self.assertEqual(self.graph()['indexing'], [])
+
+    def test_non_documents_are_not_queued(self):
+        self.upload('board.stl', b'solid')
+        self.assertFalse(IndexJob.objects.exists())
+
+    def test_reupload_during_parse_stays_pending(self):
+        f = self.upload()
+        [job] = claim_jobs()
+        self.upload(content=self.SRS + b'### FR-I2-015 \xe2\x80\x94 Clock\n')
+        run_job(job)
+        job.refresh_from_db()
+        self.assertEqual(job.state, IndexJob.PENDING)
+        self.assertEqual(IndexJob.objects.filter(file=f).count(), 1)
+
+    def test_failure_is_recorded(self):
+        f = self.upload()
+        with mock.patch('files.indexing.parse_file', side_effect=ValueError('bad table')):
+            call_command('index_traceability', '--once', stdout=io.StringIO())
+        f.index_job.refresh_from_db()
+        self.assertEqual(f.index_job.state, IndexJob.FAILED)
+        self.assertIn('bad table', f.index_job.error)
+        self.assertEqual(self.graph()['indexing'][0]['state'], 'failed')
+
+    @override_settings(TRACE_INDEX_EAGER=True)
+    def test_eager_mode_indexes_inside_the_upload(self):
+        f = self.upload()
+        self.assertEqual(IndexJob.objects.get(file=f).state, IndexJob.DONE)
+        self.assertTrue(TraceNode.objects.exists())
+
+
+@override_settings(MEDIA_ROOT=_TMP_MEDIA)
+class RevisionDownloadTests(FileListingTestBase):
+    CONTENT = bytes(range(256)) * 40
+
+    def setUp(self):
+        super().setUp()
+        data = {'uploaded_file': SimpleUploadedFile('mount plate.stl', self.CONTENT), 'stage_id': self.stage.id}
+        response = self.client.post('/api/files/', data, format='multipart')
+        self.revision = File.objects.get(id=response.data['id']).latest_revision
+        self.url = f'/api/file-revisions/{self.revision.id}/download/'
+
+    def test_streams_the_file_without_nginx(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(b''.join(response.streaming_content), self.CONTENT)
+        self.assertIn('filename="mount plate.stl"', response['Content-Disposition'])
+
+    def get(self, **headers):
+        return self.client.get(self.url, **{f'HTTP_{name.upper().replace("-", "_")}': value
+                                            for name, value in headers.items()})
+
+    def test_range_returns_partial_content(self):
+        response = self.get(range='bytes=100-199')
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(b''.join(response.streaming_content), self.CONTENT[100:200])
+        self.assertEqual(response['Content-Range'], f'bytes 100-199/{len(self.CONTENT)}')
+        self.assertEqual(response['Content-Length'], '100')
+        self.assertEqual(b''.join(self.get(range='bytes=-16').streaming_content), self.CONTENT[-16:])
+        self.assertEqual(b''.join(self.get(range='bytes=10000-').streaming_content), self.CONTENT[10000:])
+
+    def test_unsatisfiable_and_ignored_ranges(self):
+        response = self.get(range=f'bytes={len(self.CONTENT)}-')
+        self.assertEqual(response.status_code, status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.CONTENT)}')
+        for header in ('bytes=0-1,5-9', 'lines=1-2', 'bytes=9-3'):
+            self.assertEqual(self.get(range=header).status_code, status.HTTP_200_OK)
+
+    def test_if_range_resumes_only_the_same_content(self):
+        full = self.get()
+        self.assertEqual(full['Accept-Ranges'], 'bytes')
+        resumed = self.get(range='bytes=5000-', if_range=full['ETag'])
+        self.assertEqual(resumed.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        by_date = self.get(range='bytes=5000-', if_range=full['Last-Modified'])
+        self.assertEqual(by_date.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        stale = self.get(range='bytes=5000-', if_range='"something-else"')
+        self.assertEqual(stale.status_code, status.HTTP_200_OK)
+        self.assertEqual(b''.join(stale.streaming_content), self.CONTENT)
+        self.assertEqual(self.get(if_none_match=full['ETag']).status_code, status.HTTP_304_NOT_MODIFIED)
+
+    @override_settings(MEDIA_COMPRESSION=True)
+    def test_range_of_gzip_stored_file(self):
+        data = {'uploaded_file': SimpleUploadedFile('trace.log', b'line\n' * 5000), 'stage_id': self.stage.id}
+        response = self.client.post('/api/files/', data, format='multipart')
+        revision = File.objects.get(id=response.data['id']).latest_revision
+        self.assertTrue(default_storage.packed_path(revision.uploaded_file.name))
+        response = self.client.get(f'/api/file-revisions/{revision.id}/download/', HTTP_RANGE='bytes=20000-20009')
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(b''.join(response.streaming_content), (b'line\n' * 5000)[20000:20010])
+
+    @override_settings(MEDIA_ACCEL_REDIRECT='/protected-media/')
+    def test_hands_the_transfer_to_nginx(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['X-Accel-Redirect'],
+                         '/protected-media/' + self.revision.uploaded_file.name.replace(' ', '%20'))
+        self.assertIn('filename="mount plate.stl"', response['Content-Disposition'])
+        self.assertEqual(response['Cache-Control'], 'private, no-cache')
+
+    def test_serialized_urls_link_the_download(self):
+        parent = self.revision.file
+        child = File.objects.create(name='insert.stl', owner=self.user, content_type=parent.content_type,
+                                    object_id=parent.object_id, parent_file=parent,
+                                    uploaded_file=self.revision.uploaded_file.name)
+        child_revision = FileRevision.objects.create(file=child, revision_number=1, created_by=self.user,
+                                                     uploaded_file=self.revision.uploaded_file.name)
+        data = self.client.get(f'/api/files/{parent.id}/').data
+        self.assertTrue(data['latest_revision']['uploaded_file'].endswith(self.url))
+        self.assertTrue(data['child_files'][0]['uploaded_file'].endswith(
+            f'/api/file-revisions/{child_revision.id}/download/'))
+        self.assertNotIn('/media/', str(data))
+
+    @override_settings(MEDIA_ACCEL_REDIRECT='/protected-media/')
+    def test_requires_sign_in(self):
+        self.client.force_authenticate(user=None)
+        response = self.client.get(self.url)
+        self.assertIn(response.status_code, (status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN))
+        self.assertNotIn('X-Accel-Redirect', response)
+
+    def test_signed_link_works_without_a_session_for_its_revision_only(self):
+        request = RequestFactory().get('/')
+        link = signed_download_url(request, self.revision.id)
+        self.client.force_authenticate(user=None)
+        response = self.client.get(link)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(b''.join(response.streaming_content), self.CONTENT)
+        other = FileRevision.objects.create(file=self.revision.file, revision_number=2,
+                                            uploaded_file=self.revision.uploaded_file.name)
+        token = link.split('?', 1)[1]
+        for url in (f'/api/file-revisions/{other.id}/download/?{token}', self.url + '?token=forged'):
+            self.assertIn(self.client.get(url).status_code, (status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN))
+
+    def test_word_preview_hands_google_a_signed_link(self):
+        data = {'uploaded_file': SimpleUploadedFile('spec.docx', b'PK\x03\x04'), 'stage_id': self.stage.id}
+        revision = File.objects.get(id=self.client.post('/api/files/', data, format='multipart').data['id']).latest_revision
+        response = self.client.get(f'/api/files/preview-doc/?revision_id={revision.id}')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn(quote(f'/api/file-revisions/{revision.id}/download/?token=', safe=''), response.content.decode())
+        self.assertNotIn('/media/', response.content.decode())
+        self.assertEqual(self.client.get('/api/files/preview-doc/?file_path=../../etc/passwd').status_code,
+                         status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(MEDIA_ROOT=_TMP_MEDIA, REVISION_DELTAS=True, REVISION_SNAPSHOT_EVERY=10)
+class DeltaStorageTests(FileListingTestBase):
+    LINES = [f'| REQ-{i:03} | The widget shall do thing {i}. |\n'.encode() for i in range(200)]
+
+    def version(self, n):
+        lines = list(self.LINES)
+        lines[n] = f'| REQ-{n:03} | Revised in version {n}. |\n'.encode()
+        return b''.join(lines)
+
+    def upload(self, content, name='spec.md'):
+        data = {'uploaded_file': SimpleUploadedFile(name, content), 'stage_id': self.stage.id}
+        response = self.client.post('/api/files/', data, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return File.objects.get(id=response.data['id'])
+
+    def revision(self, f, n):
+        return FileRevision.objects.get(file=f, revision_number=n)
+
+    def upload_versions(self, *numbers, name='spec.md'):
+        for n in numbers:
+            f = self.upload(self.version(n), name=name)
+        call_command('encode_revision_deltas', '--once', stdout=io.StringIO())
+        return f
+
+    def test_upload_only_queues_the_superseded_revision(self):
+        for n in (1, 2, 3):
+            f = self.upload(self.version(n))
+        self.assertFalse(f.revisions.exclude(delta_base=None).exists())
+        self.assertEqual(list(f.revisions.filter(delta_pending=True).values_list('revision_number', flat=True)), [2])
+        with open(self.revision(f, 2).uploaded_file.path, 'rb') as fh:
+            self.assertEqual(fh.read(), self.version(2))
+
+    def test_superseded_revision_is_stored_as_delta(self):
+        f = self.upload_versions(1, 2, 3)
+        first, second, third = (self.revision(f, n) for n in (1, 2, 3))
+        self.assertIsNone(first.delta_base_id)  # snapshot
+        self.assertEqual(second.delta_base_id, third.id)
+        self.assertIsNone(third.delta_base_id)  # newest stays a plain file
+        self.assertLess(os.path.getsize(second.uploaded_file.path), len(self.version(2)) // 10)
+        with second.uploaded_file.open('rb') as fh:
+            self.assertEqual(fh.read(), self.version(2))
+        self.assertEqual(second.uploaded_file.size, len(self.version(2)))
+        self.assertFalse(f.revisions.filter(delta_pending=True).exists())
+
+    def test_base_encoded_first_is_read_in_full(self):
+        for n in (1, 2, 3, 4):
+            f = self.upload(self.version(n))
+        self.assertTrue(encode(self.revision(f, 3)))  # 2's base is now a delta itself
+        self.assertTrue(encode(self.revision(f, 2)))
+        with self.revision(f, 2).uploaded_file.open('rb') as fh:
+            self.assertEqual(fh.read(), self.version(2))
+
+    def test_delta_revision_downloads_in_full(self):
+        f = self.upload_versions(1, 2, 3)
+        second = self.revision(f, 2)
+        response = self.client.get(f'/api/file-revisions/{second.id}/')
+        self.assertTrue(response.data['uploaded_file'].endswith(f'/api/file-revisions/{second.id}/download/'))
+        with self.settings(MEDIA_ACCEL_REDIRECT='/protected-media/'):  # nothing on disk to hand to nginx
+            response = self.client.get(f'/api/file-revisions/{second.id}/download/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('X-Accel-Redirect', response)
+        self.assertEqual(b''.join(response.streaming_content), self.version(2))
+        response = self.client.get(f'/api/file-revisions/{second.id}/download/', HTTP_RANGE='bytes=0-63')
+        self.assertEqual(b''.join(response.streaming_content), self.version(2)[:64])
+
+    def test_deleting_a_base_materializes_its_dependents(self):
+        f = self.upload_versions(1, 2, 3)
+        response = self.client.delete(f'/api/file-revisions/{self.revision(f, 3).id}/')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        second = self.revision(f, 2)
+        self.assertIsNone(second.delta_base_id)
+        with open(second.uploaded_file.path, 'rb') as fh:
+            self.assertEqual(fh.read(), self.version(2))
+
+    def test_binary_formats_stay_in_full(self):
+        f = self.upload_versions(1, 2, 3, name='part.stl')
+        self.assertFalse(f.revisions.exclude(delta_base=None).exists())
+
+    def test_measure_command_reports_saving(self):
+        with self.settings(REVISION_DELTAS=False):
+            for n in (1, 2, 3):
+                self.upload(self.version(n))
+        out = io.StringIO()
+        call_command('measure_revision_deltas', stdout=out)
+        self.assertIn('Text revisions: 3', out.getvalue())
+        self.assertRegex(out.getvalue(), r'Saving: +0\.0[1-9] MB \((2\d|3\d)\.\d%\)')
+
+
+@override_settings(MEDIA_ROOT=_TMP_MEDIA)
+class ConcurrentUploadTests(TransactionTestCase):
+    """Many uploads at once. Needs a test database separate threads can share: Postgres,
+    or the file-backed SQLite test database settings.py configures."""
+    UPLOADS = 16
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest("in-memory SQLite test database")
+        self.user = User.objects.create_user('tester', 'tester@test.com', 'password123')
+        self.product = Product.objects.create(name='Widget', owner=self.user)
+        self.stage = Stage.objects.create(product=self.product, name='Design', stage_number=1)
+
+    def run_in_parallel(self, post):
+        barrier, responses = threading.Barrier(self.UPLOADS), []
+
+        def worker(i):
+            client = APIClient()
+            client.force_authenticate(user=self.user)
+            barrier.wait()
+            try:
+                responses.append(post(client, i))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(self.UPLOADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return responses
+
+    def test_parallel_uploads_of_one_name_become_consecutive_revisions(self):
+        responses = self.run_in_parallel(lambda client, i: client.post('/api/files/', {
+            'uploaded_file': SimpleUploadedFile('board.kicad_pcb', f'rev {i}'.encode()),
+            'stage_id': self.stage.id,
+        }, format='multipart'))
+        self.assertEqual(sorted(r.status_code for r in responses), [status.HTTP_201_CREATED] * self.UPLOADS)
+        f = File.objects.get()
+        self.assertEqual(sorted(f.revisions.values_list('revision_number', flat=True)),
+                         list(range(1, self.UPLOADS + 1)))
+        self.assertEqual(f.current_revision, self.UPLOADS)
+
+    def test_parallel_drops_share_files(self):
+        responses = self.run_in_parallel(lambda client, i: client.post('/api/files/batch/', {
+            'files': [SimpleUploadedFile(name, f'{name} {i}'.encode()) for name in ('a.c', 'b.c')],
+            'relativePath': ['a.c', 'b.c'],
+            'stage_id': self.stage.id,
+        }, format='multipart'))
+        self.assertEqual({r.status_code for r in responses}, {status.HTTP_201_CREATED})
+        self.assertEqual(sorted(File.objects.values_list('name', flat=True)), ['a.c', 'b.c'])
+        for f in File.objects.all():
+            self.assertEqual(f.revisions.count(), self.UPLOADS)
+
+    @override_settings(CHUNKED_UPLOAD_DIR=_TMP_UPLOADS)
+    def test_parallel_finalizes_of_one_session_store_it_once(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        content = b'solid part\n' * 100
+        session_id = client.post('/api/uploads/', {'filename': 'part.step', 'size': len(content),
+                                                   'stage_id': self.stage.id}, format='json').data['id']
+        client.generic('PUT', f'/api/uploads/{session_id}/', content, content_type='application/octet-stream',
+                       HTTP_CONTENT_RANGE=f'bytes 0-{len(content) - 1}/{len(content)}',
+                       HTTP_X_CHUNK_SHA256=hashlib.sha256(content).hexdigest())
+        responses = self.run_in_parallel(lambda client, i: client.post(f'/api/uploads/{session_id}/finalize/'))
+        self.assertEqual(sorted(r.status_code for r in responses),
+                         [status.HTTP_201_CREATED] + [status.HTTP_409_CONFLICT] * (self.UPLOADS - 1))
+        self.assertEqual(FileRevision.objects.filter(file__name='part.step').count(), 1)
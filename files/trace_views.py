@@ -1,14 +1,16 @@
 """Traceability read endpoints and matrix-preference persistence.
 
 Kept in its own module so nothing in views.py (BOM, files, folders) has to change.
-The graph is read-only: the index is written by the upload hook and the
-parse_traceability command.
+The graph is read-only: the index is written by the indexing queue (files.indexing)
+and the parse_traceability command.
 """
 from rest_framework import status
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 
+from .conditional import conditional
+from .indexing import index_status
 from .models import Iteration, ManualTraceEdge, Product, TraceEdge, TraceMatrixPreference
 from .traceability.containers import find_container, list_containers
 from .traceability.extract import canonical
@@ -28,21 +30,31 @@ def traceability_graph(request, product_id):
       ?container=stage:1 / ?container=iteration:3   general form (either container type)
       ?iteration=<pk> / ?iteration_number=<n>       phase-1 form, still honoured
       (nothing)                                     the newest container in IIL order
+
+    Conditional on the product's version: an unchanged graph answers 304.
     """
     product = Product.objects.filter(id=product_id).first()
     if product is None:
         return Response({"error": "Product not found."}, status=status.HTTP_404_NOT_FOUND)
 
-    containers = list_containers(product)
-    if not containers:
-        return Response({"error": "Product has no stages or iterations."},
-                        status=status.HTTP_404_NOT_FOUND)
+    def build():
+        containers = list_containers(product)
+        if not containers:
+            return Response({"error": "Product has no stages or iterations."},
+                            status=status.HTTP_404_NOT_FOUND)
 
-    scope, error = resolve_scope(product, containers, request.query_params)
-    if error:
-        return Response({"error": error}, status=status.HTTP_404_NOT_FOUND)
+        scope, error = resolve_scope(product, containers, request.query_params)
+        if error:
+            return Response({"error": error}, status=status.HTTP_404_NOT_FOUND)
+
+        graph = build_graph(product, scope, containers=containers)
+        # Documents uploaded but not (yet, or not successfully) indexed, so the matrix
+        # can say it is incomplete rather than silently missing their rows.
+        graph['indexing'] = index_status(product.id)
+        return Response(graph)
 
-    return Response(build_graph(product, scope, containers=containers))
+    # Every reparse, container change and manual link bumps the product's version.
+    return conditional(request, f'trace:{product.id}', product.version, build)
 
 
 def resolve_scope(product, containers, params):
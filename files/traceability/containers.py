@@ -27,6 +27,20 @@ def container_key(obj):
     return ''
 
 
+def container_key_for(content_type_id, object_id):
+    """container_key() from a generic FK's raw columns, without loading the container.
+
+    '' when either column is unset or the content type is not a Stage/Iteration.
+    """
+    if not content_type_id or not object_id:
+        return ''
+    from django.contrib.contenttypes.models import ContentType
+    kind = ContentType.objects.get_for_id(content_type_id).model
+    if kind not in (ITERATION, STAGE):
+        return ''
+    return f"{kind}:{object_id}"
+
+
 def order_containers(iterations, stages):
     """Pure: merge the two lists into one ordered sequence of Container records.
 
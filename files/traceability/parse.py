@@ -35,9 +35,9 @@ def parse_file(file, id_pattern=None):
     Container-agnostic: a doc uploaded into a Stage indexes exactly like one uploaded
     into an Iteration, and inheritance places both by the continuous IIL order.
     """
-    suffix = _suffix(file)
-    if suffix not in MARKDOWN_SUFFIXES + SHEET_SUFFIXES:
+    if not indexable(file):
         return None
+    suffix = _suffix(file)
 
     container = file.content_object
     product = file.product
@@ -64,6 +64,11 @@ def parse_file(file, id_pattern=None):
     return len(nodes), len(edges)
 
 
+def indexable(file):
+    """True if parse_file() would read this file at all (markdown or a spreadsheet)."""
+    return _suffix(file) in MARKDOWN_SUFFIXES + SHEET_SUFFIXES
+
+
 def _resolve_node_type(file):
     """The doc type to index `file` as, or None when it must not be indexed.
 
@@ -94,9 +99,10 @@ def _resolve_node_type(file):
 def parse_file_safely(file):
     """parse_file() that can never fail its caller.
 
-    This is what the upload path calls. Indexing is a convenience built on top of the
-    files; a broken document, an unreadable blob or a bug in here must never cost
-    someone their upload, so every exception is logged and swallowed.
+    For callers that index inline rather than through the queue (files.indexing).
+    Indexing is a convenience built on top of the files; a broken document, an
+    unreadable blob or a bug in here must never cost someone their upload, so every
+    exception is logged and swallowed.
     """
     try:
         return parse_file(file)
@@ -176,9 +182,12 @@ def _read_bytes(file):
 
 
 def _clear(file):
+    from ..changes import bump_versions
     from ..models import TraceEdge, TraceNode
     TraceNode.objects.filter(source_file=file).delete()
     TraceEdge.objects.filter(source_file=file).delete()
+    # Every reindex passes through here; invalidate cached graph reads for the product.
+    bump_versions(file.product_id)
 
 
 def _write(file, product, container, node_type, nodes, edges):
@@ -0,0 +1,204 @@
+"""Resumable chunked uploads for files too big for one multipart POST.
+
+Kept out of views.py like the traceability endpoints. The protocol:
+
+  POST   /api/uploads/                 open a session: filename, size, optional
+                                       checksum (SHA-256 hex of the whole file) plus the
+                                       usual /api/files/ form fields (stage_id, folder,
+                                       parent_id, change_description, ...)
+  PUT    /api/uploads/<id>/            one chunk: raw bytes, Content-Range
+                                       "bytes <first>-<last>/<size>" and
+                                       X-Chunk-SHA256 (hex digest of the chunk body)
+  GET    /api/uploads/<id>/            progress, including the ranges still missing --
+                                       a client resuming after a dropped connection
+                                       re-sends exactly those
+  POST   /api/uploads/<id>/finalize/   assemble into a File / FileRevision
+  DELETE /api/uploads/<id>/            abandon the session
+
+Chunks are streamed from the request straight into the part file at their offset, so
+a worker never holds more than one read block of an upload in memory. A chunk whose
+digest doesn't match is dropped from `received` (and so reported missing again)
+rather than trusted.
+"""
+import hashlib
+import os
+import re
+
+from django.conf import settings
+from django.core.files import File as DjangoFile
+from django.db import transaction
+from django.utils import timezone
+from rest_framework import mixins, status, viewsets
+from rest_framework.decorators import action
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+
+from .digests import sha256_of
+from .models import UploadSession
+from .serializers import UploadSessionSerializer
+from .views import store_upload
+
+# What clients are told to send per PUT, and the most a single PUT may carry (nginx
+# caps request bodies at 100M).
+CHUNK_SIZE = 8 * 1024 * 1024
+MAX_CHUNK_SIZE = 64 * 1024 * 1024
+READ_BLOCK = 64 * 1024
+
+# /api/files/ form fields a session carries through to store_upload at finalize.
+UPLOAD_FIELDS = (
+    'original_name', 'is_child_file', 'parent_id', 'stage_id', 'iteration_id', 'folder',
+    'change_description', 'status', 'price', 'quantity', 'category', 'skip_identical',
+)
+
+CONTENT_RANGE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+
+
+def add_range(ranges, start, end):
+    """`ranges` (sorted, merged [start, end) pairs) with [start, end) added."""
+    merged = []
+    for lo, hi in sorted(ranges + [[start, end]]):
+        if merged and lo <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], hi)
+        else:
+            merged.append([lo, hi])
+    return merged
+
+
+def remove_range(ranges, start, end):
+    """`ranges` with [start, end) cut out."""
+    kept = []
+    for lo, hi in ranges:
+        if lo < start:
+            kept.append([lo, min(hi, start)])
+        if hi > end:
+            kept.append([max(lo, end), hi])
+    return kept
+
+
+class UploadSessionViewSet(mixins.CreateModelMixin, mixins.RetrieveModelMixin,
+                           mixins.DestroyModelMixin, viewsets.GenericViewSet):
+    """Open, fill, finalize and abandon chunked upload sessions (see module docstring)."""
+    permission_classes = [IsAuthenticated]
+    queryset = UploadSession.objects.all()
+    serializer_class = UploadSessionSerializer
+
+    def get_queryset(self):
+        return UploadSession.objects.filter(owner=self.request.user)
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        if not request.data.get('stage_id') and not request.data.get('iteration_id'):
+            return Response({"error": "Either stage_id or iteration_id must be provided."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        params = {name: str(request.data[name]) for name in UPLOAD_FIELDS if request.data.get(name) is not None}
+        session = serializer.save(owner=request.user, params=params)
+        os.makedirs(settings.CHUNKED_UPLOAD_DIR, exist_ok=True)
+        open(session.part_path, 'wb').close()
+
+        data = dict(serializer.data, chunk_size=CHUNK_SIZE)
+        return Response(data, status=status.HTTP_201_CREATED)
+
+    def update(self, request, *args, **kwargs):
+        """Write one chunk at the offset named by its Content-Range."""
+        session = self.get_object()
+        if session.state != UploadSession.OPEN:
+            return Response({"error": "Upload already finalized."}, status=status.HTTP_409_CONFLICT)
+
+        match = CONTENT_RANGE.match(request.META.get('HTTP_CONTENT_RANGE', ''))
+        if not match:
+            return Response({"error": "Content-Range: bytes <first>-<last>/<size> is required."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        first, last, total = (int(g) for g in match.groups())
+        if total != session.size or first > last or last >= session.size:
+            return Response({"error": f"Range does not fit a {session.size}-byte upload."},
+                            status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+        length = last - first + 1
+        if length > MAX_CHUNK_SIZE:
+            return Response({"error": f"Chunks are limited to {MAX_CHUNK_SIZE} bytes."},
+                            status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        expected = request.META.get('HTTP_X_CHUNK_SHA256', '').strip().lower()
+        if not expected:
+            return Response({"error": "X-Chunk-SHA256 is required."}, status=status.HTTP_400_BAD_REQUEST)
+
+        digest, written = hashlib.sha256(), 0
+        stream = request.stream
+        with open(session.part_path, 'r+b') as out:
+            out.seek(first)
+            while stream is not None and written < length:
+                block = stream.read(min(READ_BLOCK, length - written))
+                if not block:
+                    break
+                out.write(block)
+                digest.update(block)
+                written += len(block)
+
+        verified = written == length and digest.hexdigest() == expected
+        with transaction.atomic():
+            session = UploadSession.objects.select_for_update().get(pk=session.pk)
+            if verified:
+                session.received = add_range(session.received, first, last + 1)
+            else:
+                # Whatever landed in this range may have overwritten good bytes.
+                session.received = remove_range(session.received, first, last + 1)
+            session.save(update_fields=['received', 'updated_at'])
+
+        if written != length:
+            return Response({"error": f"Expected {length} bytes, received {written}."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if not verified:
+            return Response({"error": "Chunk checksum mismatch.", "missing": session.missing_ranges()},
+                            status=status.HTTP_400_BAD_REQUEST)
+        return Response(self.get_serializer(session).data)
+
+    @action(detail=True, methods=['post'])
+    def finalize(self, request, pk=None):
+        """Verify the whole file and store it through the regular upload rules."""
+        session = self.get_object()
+        # Claimed by a conditional UPDATE, so a retried or concurrent finalize of the
+        # same session gets a 409 instead of storing the file a second time. It writes
+        # before reading: SQLite ignores FOR UPDATE and can't upgrade a read lock while
+        # another finalize is writing.
+        with transaction.atomic():
+            claimed = UploadSession.objects.filter(pk=session.pk, state=UploadSession.OPEN).update(
+                state=UploadSession.FINALIZING, updated_at=timezone.now())
+            session.refresh_from_db()
+            missing = session.missing_ranges()
+            if claimed and missing:
+                transaction.set_rollback(True)
+                return Response({"error": "Upload incomplete.", "missing": missing}, status=status.HTTP_409_CONFLICT)
+        if not claimed:
+            busy = UploadSession.objects.filter(pk=session.pk, state=UploadSession.FINALIZING).exists()
+            return Response({"error": "Upload is being finalized." if busy else "Upload already finalized."},
+                            status=status.HTTP_409_CONFLICT)
+
+        try:
+            response = self._store(request, session)
+        except Exception:
+            session.state = UploadSession.OPEN
+            session.save(update_fields=['state', 'updated_at'])
+            raise
+        if response.status_code < 300:
+            session.state = UploadSession.COMPLETE
+            session.file_id = response.data.get('id')
+            session.save(update_fields=['state', 'file', 'updated_at'])
+            session.discard_part()
+        else:
+            # Refused: the client may fix things up and finalize again.
+            session.state = UploadSession.OPEN
+            session.save(update_fields=['state', 'received', 'updated_at'])
+        return response
+
+    def _store(self, request, session):
+        with open(session.part_path, 'rb') as fh:
+            digest = sha256_of(fh)
+        if session.checksum and digest != session.checksum:
+            session.received = []
+            return Response({"error": "File checksum mismatch; upload the file again."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        with open(session.part_path, 'rb') as fh:
+            assembled = DjangoFile(fh, name=session.filename)
+            assembled.sha256 = digest  # FileRevision stores it; see files.digests
+            return store_upload(request, assembled, session.params)
@@ -1,32 +1,49 @@
 import os
 import logging
 import mimetypes
-import hashlib
+import re
+from urllib.parse import quote
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
 from rest_framework import viewsets, status
 from rest_framework.response import Response
 from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
 from rest_framework.decorators import action
 from rest_framework.permissions import AllowAny, IsAuthenticated
 
-import io
-import zipfile
-from collections import defaultdict
+from collections import defaultdict, deque
 from django.db import transaction
-from django.db.models import Count, Q
-
-from .models import File, FileRevision, Product, Stage, Iteration, Folder, category_for_extension
+from django.db.models import Count, Max, OuterRef, Prefetch, Q, Subquery
+from django.utils import timezone
+from django.utils.html import escape
+from django.utils.http import content_disposition_header
+
+from .changes import bump_versions, changes_since, current_token, deferred_changes, record_changes
+from .conditional import conditional
+from .deltas import materialize, queue_previous
+from .digests import content_digest
+from .drops import UNCHANGED, DropTarget, classify_manifest, same_content, split_path, store_drop
+from .indexing import enqueue_index
+from .locks import lock_file_names
+from .models import ChangeLog, File, FileRevision, Product, Stage, Iteration, Folder, category_for_extension
+from .pagination import KeysetPagination, paginate
+from .payload_cache import file_payloads, invalidate_file_payloads
+from .ranges import file_response
+from .streaming import list_response
+from .traceability.containers import container_key, display_name, order_containers
+from .zipstream import READ_AHEAD, ReadAhead, ZipStream, field_member
+from .signed_downloads import HasDownloadToken, signed_download_url
 from .serializers import (
     FileSerializer, FileRevisionSerializer, ProductSerializer,
     StageSerializer, IterationSerializer, FolderSerializer, FolderTreeSerializer
 )
-from .traceability.parse import parse_file_safely
 
 logger = logging.getLogger('files')
 
+SHA256_HEX = re.compile(r'^[0-9a-f]{64}$')
+
 
 def build_folder_tree_response(folders, request):
     """Build the nested parent->children tree (in Python) from a flat folder list.
@@ -57,17 +74,96 @@ def build_folder_tree_response(folders, request):
     return Response(serializer.data)
 
 
+# Per-file columns in the bootstrap payload: enough to draw the file list and BOM, with
+# revisions and the rest fetched per file when the user opens one.
+FILE_SUMMARY_FIELDS = (
+    'id', 'name', 'file_type', 'container_key', 'folder_id', 'parent_file_id',
+    'current_revision', 'status', 'quantity', 'price', 'category', 'file_size', 'updated_at',
+)
+
+# FileSerializer fields that read through the stage/iteration generic FK.
+CONTAINER_FIELDS = {'container_type', 'container_id', 'container_db_id'}
+
+
+def prefetch_file_listing(queryset, request=None):
+    """Load everything FileSerializer touches for a list of files in bulk.
+
+    Revisions (with their authors), child files (with theirs), owners, products and
+    the stage/iteration behind the generic FK are each fetched once for the whole
+    page, so the query count stays fixed however many files are serialized. Only the
+    current revision of each file is loaded -- joined through current_file_revision --
+    with a revision count, unless the full history was expanded. When the request asks for a sparse payload (?fields= /
+    ?expand=), only the relations the selected fields read are loaded.
+    """
+    keep = FileSerializer.requested_fields(request)
+
+    if 'owner' in keep:
+        queryset = queryset.select_related('owner')
+    if 'revisions' in keep:
+        queryset = queryset.prefetch_related(
+            Prefetch('revisions', queryset=FileRevision.objects.select_related('created_by')))
+    if 'latest_revision' in keep:
+        queryset = queryset.select_related('current_file_revision__created_by')
+    if 'revision_count' in keep:
+        queryset = queryset.annotate(_revision_count=Count('revisions'))
+    if 'child_files' in keep:
+        queryset = queryset.prefetch_related(Prefetch(
+            'child_files',
+            queryset=File.objects.select_related('owner', 'current_file_revision__created_by')
+            .annotate(_revision_count=Count('revisions'))
+            .prefetch_related('content_object'),
+        ))
+    if 'product_name' in keep:
+        queryset = queryset.select_related('product')
+    if keep & CONTAINER_FIELDS:
+        queryset = queryset.prefetch_related('content_object')
+    return queryset
+
+
+def serialize_files(rows, request):
+    """FileSerializer data for a file listing, reusing cached per-file fragments and
+    serializing only the misses (see files.payload_cache)."""
+    return file_payloads(rows, request, prefetch_file_listing)
+
+
+def container_files_response(container, content_type, request):
+    """Every file in one stage/iteration, serialized with a fixed number of queries.
+
+    Conditional on the container's version: an unchanged container answers 304.
+    """
+    key = container_key(container)
+
+    def build():
+        files = File.objects.filter(container_key=key).order_by('-updated_at')
+        return paginate(files, request, lambda rows: serialize_files(rows, request))
+    return conditional(request, key, container.version, build)
+
+
 def container_folders_response(container, content_type, request):
     """Folder tree for one stage/iteration, with file counts scoped to that container."""
-    folders = (
-        Folder.objects.filter(content_type=content_type, object_id=container.id)
-        .select_related('parent')
-        .annotate(file_count=Count('files', filter=Q(files__content_type=content_type, files__object_id=container.id)))
-    )
-    return build_folder_tree_response(folders, request)
+    key = container_key(container)
+
+    def build():
+        folders = (
+            Folder.objects.filter(container_key=key)
+            .select_related('parent')
+            .annotate(file_count=Count('files', filter=Q(files__container_key=key)))
+        )
+        return build_folder_tree_response(folders, request)
+    return conditional(request, f'{key}/folders', container.version, build)
+
 
+class CascadeDestroyMixin:
+    """Deletes the row and everything cascading from it with their change-feed rows and
+    version bumps written once per product and container (files.changes), not once per
+    deleted row."""
 
-class ProductViewSet(viewsets.ModelViewSet):
+    def perform_destroy(self, instance):
+        with transaction.atomic(), deferred_changes():
+            instance.delete()
+
+
+class ProductViewSet(CascadeDestroyMixin, viewsets.ModelViewSet):
     """ViewSet for managing products"""
     permission_classes = [IsAuthenticated]  # Require authentication
     queryset = Product.objects.all().order_by('-created_at')
@@ -82,26 +178,113 @@ class ProductViewSet(viewsets.ModelViewSet):
         
         serializer.save(owner=user)
 
+    def retrieve(self, request, *args, **kwargs):
+        """Product detail, answered with 304 while the product's version is unchanged."""
+        product = self.get_object()
+        return conditional(request, f'product:{product.id}', product.version,
+                           lambda: Response(self.get_serializer(product).data))
+
     @action(detail=True, methods=['get'])
     def files(self, request, pk=None):
         """Get all files for a specific product"""
         product = self.get_object()
-        
-        # Get files from all stages and iterations of this product
-        stage_content_type = ContentType.objects.get_for_model(Stage)
-        iteration_content_type = ContentType.objects.get_for_model(Iteration)
-        
-        stage_ids = list(product.stages.values_list('id', flat=True))
-        iteration_ids = list(product.iterations.values_list('id', flat=True))
-        
-        from django.db import models
-        files = File.objects.filter(
-            models.Q(content_type=stage_content_type, object_id__in=stage_ids) |
-            models.Q(content_type=iteration_content_type, object_id__in=iteration_ids)
-        ).order_by('-updated_at')
-        
-        serializer = FileSerializer(files, many=True, context={'request': request})
-        return Response(serializer.data)
+
+        def build():
+            files = File.objects.filter(product=product).order_by('-updated_at')
+            return paginate(files, request, lambda rows: serialize_files(rows, request), view=self)
+        return conditional(request, f'product:{product.id}/files', product.version, build)
+
+    @action(detail=False, methods=['get'])
+    def bootstrap(self, request):
+        """Everything the workspace needs on login, in one response.
+
+        Every product with its stages and iterations, its containers in continuous IIL
+        order (traceability.containers), a summary row per file and the product's
+        current change token -- so the client can start polling changes/ straight away.
+        Replaces 1 + 3N requests with one, and costs a fixed number of queries however
+        many products and files there are.
+        """
+        products = list(
+            self.get_queryset().select_related('owner').prefetch_related('stages', 'iterations')
+        )
+        product_ids = [product.id for product in products]
+
+        files_by_product = defaultdict(list)
+        summaries = File.objects.filter(product_id__in=product_ids).order_by('-updated_at')
+        for row in summaries.values('product_id', *FILE_SUMMARY_FIELDS):
+            files_by_product[row.pop('product_id')].append(row)
+
+        tokens = dict(
+            ChangeLog.objects.filter(product_id__in=product_ids)
+            .values('product_id').annotate(token=Max('token')).values_list('product_id', 'token')
+        )
+
+        payload = ProductSerializer(products, many=True, context={'request': request}).data
+        for product, data in zip(products, payload):
+            containers = order_containers(product.iterations.all(), product.stages.all())
+            data['containers'] = [
+                {
+                    'key': c.key,
+                    'kind': c.kind,
+                    'id': c.id,
+                    'label': c.label,
+                    'name': c.name,
+                    'display_name': display_name(c),
+                    'ordinal': c.ordinal,
+                }
+                for c in containers
+            ]
+            data['files'] = files_by_product.get(product.id, [])
+            data['change_token'] = tokens.get(product.id, 0)
+        return Response(payload)
+
+    @action(detail=True, methods=['get'])
+    def changes(self, request, pk=None):
+        """Files, folders and revisions changed in this product since a change token.
+
+        GET without ?since returns only the current {"token"}: load the product the
+        normal way, then poll ?since=<token> and apply what comes back. Each response
+        carries the token to send next time, the changed rows (serialized as their
+        list endpoints would) and the ids deleted -- or moved out of this product --
+        since `since`.
+        """
+        product = self.get_object()
+        since = request.query_params.get('since')
+        if since is None:
+            return Response({'token': current_token(product.id)})
+        try:
+            since = int(since)
+        except (TypeError, ValueError):
+            return Response({"error": "since must be an integer change token."}, status=status.HTTP_400_BAD_REQUEST)
+
+        token, latest = changes_since(product.id, since)
+
+        def upserted(kind):
+            return [object_id for object_id, action in latest[kind].items() if action == ChangeLog.UPSERT]
+
+        files = list(prefetch_file_listing(File.objects.filter(product=product, id__in=upserted(ChangeLog.FILE)), request))
+        folders = list(Folder.objects.filter(product=product, id__in=upserted(ChangeLog.FOLDER)))
+        revisions = list(
+            FileRevision.objects.filter(file__product=product, id__in=upserted(ChangeLog.REVISION))
+            .select_related('created_by')
+        )
+
+        # A row logged as changed that is no longer in this product (deleted since, or
+        # moved to another product) is gone as far as this client is concerned.
+        found = {ChangeLog.FILE: files, ChangeLog.FOLDER: folders, ChangeLog.REVISION: revisions}
+        deleted = {}
+        for kind, rows in found.items():
+            present = {row.id for row in rows}
+            deleted[f'{kind}s'] = sorted(object_id for object_id in latest[kind] if object_id not in present)
+
+        context = {'request': request}
+        return Response({
+            'token': token,
+            'files': FileSerializer(files, many=True, context=context).data,
+            'folders': FolderSerializer(folders, many=True, context=context).data,
+            'revisions': FileRevisionSerializer(revisions, many=True, context=context).data,
+            'deleted': deleted,
+        })
 
     @action(detail=True, methods=['get'])
     def folders(self, request, pk=None):
@@ -112,27 +295,30 @@ class ProductViewSet(viewsets.ModelViewSet):
         total) regardless of tree depth/breadth, avoiding N+1 recursive lookups.
         """
         product = self.get_object()
-        folders = list(
-            Folder.objects.filter(product=product)
-            .select_related('parent')
-            .annotate(file_count=Count('files'))
-        )
 
-        by_parent = defaultdict(list)
-        for folder in folders:
-            by_parent[folder.parent_id].append(folder)
+        def build():
+            folders = list(
+                Folder.objects.filter(product=product)
+                .select_related('parent')
+                .annotate(file_count=Count('files'))
+            )
+
+            by_parent = defaultdict(list)
+            for folder in folders:
+                by_parent[folder.parent_id].append(folder)
 
-        def attach_children(node):
-            node._prefetched_children = by_parent.get(node.id, [])
-            for child in node._prefetched_children:
-                attach_children(child)
+            def attach_children(node):
+                node._prefetched_children = by_parent.get(node.id, [])
+                for child in node._prefetched_children:
+                    attach_children(child)
 
-        roots = by_parent.get(None, [])
-        for root in roots:
-            attach_children(root)
+            roots = by_parent.get(None, [])
+            for root in roots:
+                attach_children(root)
 
-        serializer = FolderTreeSerializer(roots, many=True, context={'request': request})
-        return Response(serializer.data)
+            serializer = FolderTreeSerializer(roots, many=True, context={'request': request})
+            return Response(serializer.data)
+        return conditional(request, f'product:{product.id}/folders', product.version, build)
 
 class StageViewSet(viewsets.ModelViewSet):
     """ViewSet for managing stages"""
@@ -152,15 +338,7 @@ class StageViewSet(viewsets.ModelViewSet):
     def files(self, request, pk=None):
         """Get all files for a specific stage"""
         stage = self.get_object()
-        stage_content_type = ContentType.objects.get_for_model(Stage)
-        
-        files = File.objects.filter(
-            content_type=stage_content_type,
-            object_id=stage.id
-        ).order_by('-updated_at')
-
-        serializer = FileSerializer(files, many=True, context={'request': request})
-        return Response(serializer.data)
+        return container_files_response(stage, ContentType.objects.get_for_model(Stage), request)
 
     @action(detail=True, methods=['get'])
     def folders(self, request, pk=None):
@@ -187,15 +365,7 @@ class IterationViewSet(viewsets.ModelViewSet):
     def files(self, request, pk=None):
         """Get all files for a specific iteration"""
         iteration = self.get_object()
-        iteration_content_type = ContentType.objects.get_for_model(Iteration)
-        
-        files = File.objects.filter(
-            content_type=iteration_content_type,
-            object_id=iteration.id
-        ).order_by('-updated_at')
-
-        serializer = FileSerializer(files, many=True, context={'request': request})
-        return Response(serializer.data)
+        return container_files_response(iteration, ContentType.objects.get_for_model(Iteration), request)
 
     @action(detail=True, methods=['get'])
     def folders(self, request, pk=None):
@@ -204,38 +374,28 @@ class IterationViewSet(viewsets.ModelViewSet):
         ct = ContentType.objects.get_for_model(Iteration)
         return container_folders_response(iteration, ct, request)
 
-def _hash_filelike(f):
-    h = hashlib.sha256()
-    for chunk in f.chunks():
-        h.update(chunk)
-    return h.hexdigest()
+def listing_version(key, product_id):
+    """(scope, version) a filtered file listing is conditional on, or (None, None).
 
-
-def _same_content(uploaded, stored_fieldfile):
-    """True if the uploaded file is byte-identical to the stored revision. Checks size
-    first (cheap), then SHA-256. Rewinds the uploaded file so it can still be saved.
-    Any error returns False (fall through to creating a normal revision)."""
+    The container wins when both filters are given: it is the narrower scope, and its
+    version moves on every write that could change the filtered result.
+    """
     try:
-        up_size = getattr(uploaded, 'size', None)
-        try:
-            st_size = stored_fieldfile.size
-        except Exception:
-            st_size = None
-        if up_size is not None and st_size is not None and up_size != st_size:
-            return False
-        up_hash = _hash_filelike(uploaded)
-        try:
-            uploaded.seek(0)
-        except Exception:
-            pass
-        stored_fieldfile.open('rb')
-        try:
-            st_hash = _hash_filelike(stored_fieldfile)
-        finally:
-            stored_fieldfile.close()
-        return up_hash == st_hash
-    except Exception:
-        return False
+        if key:
+            kind, _, object_id = key.partition(':')
+            model = Stage if kind == 'stage' else Iteration
+            version = model.objects.filter(id=int(object_id)).values_list('version', flat=True).first()
+            scope = f'files:{key}'
+        elif product_id:
+            version = Product.objects.filter(id=int(product_id)).values_list('version', flat=True).first()
+            scope = f'files:product:{product_id}'
+        else:
+            return None, None
+    except ValueError:
+        return None, None
+    if version is None:
+        return None, None
+    return scope, version
 
 
 def resolve_target_container(data):
@@ -254,6 +414,43 @@ def resolve_target_container(data):
     return None, None
 
 
+def drop_target(data):
+    """(DropTarget, None) for a folder drop's stage_id/iteration_id and optional
+    folder, or (None, error Response)."""
+    content_type, container = resolve_target_container(data)
+    if not container:
+        return None, Response({"error": "Either a valid stage_id or iteration_id must be provided."},
+                              status=status.HTTP_400_BAD_REQUEST)
+    root_folder = None
+    if data.get('folder'):
+        root_folder = Folder.objects.filter(id=data['folder'], content_type=content_type,
+                                            object_id=container.id).first()
+        if not root_folder:
+            return None, Response({"error": "Folder not found in this stage/iteration."},
+                                  status=status.HTTP_400_BAD_REQUEST)
+    return DropTarget(content_type, container, root_folder), None
+
+
+CURRENT_REVISION_BATCH = 500
+
+
+def current_revisions(files):
+    """{file id: current revision} for `files`, loaded with
+    select_related('current_file_revision'). Files whose current revision was deleted
+    get their newest remaining one, as File.latest_revision does, but with one query per
+    CURRENT_REVISION_BATCH of them instead of one each."""
+    revisions = {f.id: f.current_file_revision for f in files if f.current_file_revision_id is not None}
+    orphaned = [f.id for f in files if f.current_file_revision_id is None]
+    newest = FileRevision.objects.filter(file_id=OuterRef('file_id')).order_by('-revision_number')
+    for start in range(0, len(orphaned), CURRENT_REVISION_BATCH):
+        batch = orphaned[start:start + CURRENT_REVISION_BATCH]
+        revisions.update(
+            (rev.file_id, rev) for rev in FileRevision.objects.filter(
+                file_id__in=batch, revision_number=Subquery(newest.values('revision_number')[:1]))
+        )
+    return revisions
+
+
 def duplicate_file(src, content_type, container, folder, user, parent=None):
     """Copy a File (and all its revisions) into a target container/folder. Revisions
     reference the same stored files (identical content), so no bytes are re-written."""
@@ -273,30 +470,256 @@ def duplicate_file(src, content_type, container, folder, user, parent=None):
         category=src.category,
         metadata=src.metadata,
     )
-    for rev in src.revisions.all().order_by('revision_number'):
-        FileRevision.objects.create(
+    copies, delta_bases = {}, {}
+    revisions = list(src.revisions.all().order_by('revision_number'))
+    numbers = {rev.id: rev.revision_number for rev in revisions}
+    for rev in revisions:
+        copies[rev.revision_number] = FileRevision.objects.create(
             file=new_file,
             revision_number=rev.revision_number,
             uploaded_file=rev.uploaded_file.name if rev.uploaded_file else '',
             file_path=rev.file_path,
             file_size=rev.file_size,
+            sha256=rev.sha256,
             description=rev.description,
             status=rev.status,
             price=rev.price,
             created_by=user,
         )
+        if rev.delta_base_id:
+            delta_bases[rev.revision_number] = (numbers.get(rev.delta_base_id), rev.file_size)
+    # A delta revision shares its source's stored delta; rebase it onto the copy of its
+    # base (always a later revision, so only known once the loop is done). save() sized
+    # the copy from the stored delta, so restore the full size too.
+    for number, (base_number, size) in delta_bases.items():
+        FileRevision.objects.filter(pk=copies[number].pk).update(delta_base=copies[base_number], file_size=size)
     if src.current_revision:
         new_file.current_revision = src.current_revision
-        new_file.save(update_fields=['current_revision'])
+        new_file.current_file_revision = copies.get(src.current_revision, new_file.current_file_revision)
+        new_file.save(update_fields=['current_revision', 'current_file_revision'])
     return new_file
 
 
-class FileViewSet(viewsets.ModelViewSet):
+def store_upload(request, uploaded_file, data):
+    """Store an upload as a new File or as the next revision of an existing one.
+
+    The versioning rules behind FileViewSet.create, shared with the chunked upload
+    API (files.upload_views), which passes the assembled file and the form fields it
+    was opened with. `data` is the upload's form fields (request.data or a dict).
+    """
+    # Extract parameters from request
+    original_name = data.get('original_name', uploaded_file.name)
+    is_child_file = data.get('is_child_file', '').lower() == 'true'
+    parent_id = data.get('parent_id')
+    stage_id = data.get('stage_id')
+    iteration_id = data.get('iteration_id')
+    folder_id = data.get('folder') or None
+    change_description = data.get('change_description', '')
+    status_value = data.get('status', 'in_work')
+    price_value = data.get('price')
+    quantity_value = data.get('quantity', 1)
+    # Category: honor an explicit value from the request; otherwise guess from the
+    # file extension. The backend owns categorization so the frontend never re-derives it.
+    category_value = data.get('category')
+    valid_categories = {c[0] for c in File.CATEGORY_CHOICES}
+    if category_value not in valid_categories:
+        ext = os.path.splitext(original_name)[1].lower().lstrip('.')
+        category_value = category_for_extension(ext)
+
+    user = request.user if request.user.is_authenticated else User.objects.first()
+
+    # Validate container (stage or iteration)
+    container_object = None
+    if stage_id:
+        try:
+            container_object = Stage.objects.get(id=stage_id)
+            content_type = ContentType.objects.get_for_model(Stage)
+        except Stage.DoesNotExist:
+            return Response({"error": "Stage not found."}, status=status.HTTP_404_NOT_FOUND)
+    elif iteration_id:
+        try:
+            container_object = Iteration.objects.get(id=iteration_id)
+            content_type = ContentType.objects.get_for_model(Iteration)
+        except Iteration.DoesNotExist:
+            return Response({"error": "Iteration not found."}, status=status.HTTP_404_NOT_FOUND)
+    else:
+        return Response({"error": "Either stage_id or iteration_id must be provided."}, status=status.HTTP_400_BAD_REQUEST)
+
+    # Handle parent-child relationships
+    parent_file_obj = None
+    if is_child_file and parent_id:
+        try:
+            parent_file_obj = File.objects.get(id=parent_id)
+            # Ensure parent is in the same container
+            if parent_file_obj.content_type != content_type or parent_file_obj.object_id != container_object.id:
+                return Response({"error": "Parent file must be in the same container."}, status=status.HTTP_400_BAD_REQUEST)
+        except File.DoesNotExist:
+            return Response({"error": "Parent file not found."}, status=status.HTTP_404_NOT_FOUND)
+
+    # Resolve target folder (child files inherit their parent's folder).
+    folder_obj = None
+    if is_child_file and parent_file_obj:
+        folder_obj = parent_file_obj.folder
+    elif folder_id:
+        folder_obj = Folder.objects.filter(id=folder_id, content_type=content_type, object_id=container_object.id).first()
+        if not folder_obj:
+            return Response({"error": "Folder not found in this stage/iteration."}, status=status.HTTP_400_BAD_REQUEST)
+
+    # Everything from the lookup to the saved revision runs under a lock on this name in
+    # this container (files.locks). Parallel uploads of one file queue up here instead
+    # of both claiming revision N+1 or both creating a File; atomic also means a failed
+    # revision rolls its new File back rather than leaving an orphan row. The change
+    # feed rows and version bumps are written last, just before the commit
+    # (files.changes.deferred_changes), so uploads of other names into the product
+    # don't queue on its row lock while this one writes storage.
+    with transaction.atomic(), deferred_changes():
+        lock_file_names(container_key(container_object), [original_name])
+
+        # Check if file exists (for revisions)
+        file_lookup = {
+            'name': original_name,
+            'content_type': content_type,
+            'object_id': container_object.id
+        }
+
+        if is_child_file and parent_file_obj:
+            file_lookup['parent_file'] = parent_file_obj
+        else:
+            file_lookup['parent_file__isnull'] = True
+            # Scope by folder so a same-named file in a different folder is its own file,
+            # and re-uploading into the same folder versions the existing one.
+            file_lookup['folder'] = folder_obj
+
+        # The '+' button posts is_child_file with the clicked file as the parent. When the
+        # upload carries that parent's own name, the user is versioning that file, not
+        # attaching a sub-file — two rows sharing one name is never the intent.
+        if is_child_file and parent_file_obj and original_name == parent_file_obj.name:
+            existing_file = parent_file_obj
+        else:
+            existing_file = File.objects.filter(**file_lookup).first()
+
+        # A filename identifies one file within a stage/iteration, wherever it sits in the
+        # folder tree. The lookup above is folder-scoped, so an upload aimed anywhere but
+        # that file's own folder — dropped on the list background, sent to a different
+        # folder, or with no folder at all — would miss it and create a second row under
+        # the same name. Fall back to the file holding that name anywhere in this
+        # container so the upload versions it in place instead. Ordered by id so a
+        # container still holding duplicates from before this rule resolves to the
+        # original rather than an arbitrary row.
+        if existing_file is None and not is_child_file:
+            existing_file = File.objects.filter(
+                name=original_name,
+                content_type=content_type,
+                object_id=container_object.id,
+                parent_file__isnull=True,
+            ).order_by('id').first()
+
+        if existing_file:
+            # Creating a revision of existing file
+            logger.debug(f"Creating revision for existing file: {existing_file.name}")
+
+            last_revision = FileRevision.objects.filter(file=existing_file).order_by('-revision_number').first()
+
+            # A deliberate upload always produces a new revision, even when the bytes are
+            # unchanged — "Upload Revision" and re-uploading a same-named file are explicit
+            # requests to version. Only bulk folder re-drops opt in to skipping identical
+            # files, so syncing a repo doesn't version hundreds of untouched ones.
+            skip_identical = str(data.get('skip_identical', '')).lower() == 'true'
+            if skip_identical and last_revision and getattr(last_revision, 'uploaded_file', None):
+                if same_content(uploaded_file, last_revision):
+                    serializer = FileSerializer(existing_file, context={'request': request})
+                    return Response(serializer.data, status=status.HTTP_200_OK)
+
+            revision_number = 1 if last_revision is None else last_revision.revision_number + 1
+
+            new_revision = FileRevision(
+                file=existing_file,
+                revision_number=revision_number,
+                uploaded_file=uploaded_file,
+                description=change_description,
+                status=status_value,
+                created_by=user
+            )
+
+            if price_value:
+                try:
+                    new_revision.price = float(price_value)
+                except (ValueError, TypeError):
+                    pass
+
+            new_revision.save()
+
+            # Update file's current revision and file_path
+            existing_file.current_revision = revision_number
+            existing_file.current_file_revision = new_revision
+            existing_file.file_path = new_revision.file_path
+            existing_file.save()
+            queue_previous(new_revision)  # no-op unless REVISION_DELTAS is on
+            stored_file = existing_file
+        else:
+            # Creating new file
+            logger.debug(f"Creating new file: {original_name}")
+
+            file_instance = File(
+                owner=user,
+                name=original_name,
+                uploaded_file=uploaded_file,
+                content_type=content_type,
+                object_id=container_object.id,
+                parent_file=parent_file_obj,
+                folder=folder_obj,
+                status=status_value,
+                quantity=int(quantity_value) if quantity_value else 1,
+                category=category_value
+            )
+
+            if price_value:
+                try:
+                    file_instance.price = float(price_value)
+                except (ValueError, TypeError):
+                    pass
+
+            # Hash before the File save below, which may move a temp-file upload away.
+            digest = content_digest(uploaded_file)
+
+            file_instance.save()
+
+            # Create first revision. Reference the file already stored on file_instance
+            # instead of saving `uploaded_file` a second time: a disk-backed
+            # TemporaryUploadedFile is consumed/moved by the first save, so re-saving the
+            # raw upload here 500s with FileNotFoundError on the temp path.
+            new_revision = FileRevision(
+                file=file_instance,
+                revision_number=1,
+                uploaded_file=file_instance.uploaded_file.name,
+                sha256=digest,
+                description=change_description,
+                status=status_value,
+                created_by=user
+            )
+
+            if price_value:
+                try:
+                    new_revision.price = float(price_value)
+                except (ValueError, TypeError):
+                    pass
+
+            new_revision.save()
+            stored_file = file_instance
+
+    enqueue_index([stored_file])  # traceability reindex, run by the indexing worker
+
+    serializer = FileSerializer(stored_file, context={'request': request})
+    return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+
+class FileViewSet(CascadeDestroyMixin, viewsets.ModelViewSet):
     """ViewSet for managing files"""
     permission_classes = [IsAuthenticated]  # Require authentication
     queryset = File.objects.all()
     serializer_class = FileSerializer
     parser_classes = (MultiPartParser, FormParser, JSONParser)
+    pagination_class = KeysetPagination  # opt-in: only pages when ?page_size/?cursor is sent
 
     @action(detail=True, methods=['post'])
     def move(self, request, pk=None):
@@ -307,12 +730,25 @@ class FileViewSet(viewsets.ModelViewSet):
         content_type, container = resolve_target_container(request.data)
         if not container:
             return Response({"error": "Target stage/iteration not found."}, status=status.HTTP_400_BAD_REQUEST)
+        old_product_id, old_key = f.product_id, f.container_key
         with transaction.atomic():
-            File.objects.filter(parent_file=f).update(content_type=content_type, object_id=container.id, folder=None)
+            children = File.objects.filter(parent_file=f)
+            child_ids = list(children.values_list('id', flat=True))
+            children.update(
+                content_type=content_type, object_id=container.id, folder=None,
+                product=container.product, container_key=container_key(container),
+            )
             f.content_type = content_type
             f.object_id = container.id
             f.folder = None
             f.save()
+            # .update() sends no signals; log the children for the change feed by hand.
+            record_changes(ChangeLog.FILE, f.product_id, child_ids)
+            invalidate_file_payloads(child_ids)
+            if old_product_id != f.product_id:
+                record_changes(ChangeLog.FILE, old_product_id, [f.id] + child_ids, ChangeLog.DELETE)
+            # The save above bumped the target; the container the files left changed too.
+            bump_versions(old_product_id, old_key)
         return Response(FileSerializer(f, context={'request': request}).data)
 
     @action(detail=True, methods=['post'])
@@ -331,77 +767,82 @@ class FileViewSet(viewsets.ModelViewSet):
         return Response(FileSerializer(new_file, context={'request': request}).data, status=status.HTTP_201_CREATED)
 
     def list(self, request, *args, **kwargs):
-        """List files with optional filtering"""
+        """List files with optional filtering.
+
+        Scoped to a container or product, the listing is conditional on that scope's
+        version (ETag / 304); an unscoped listing is always rebuilt.
+        """
         queryset = self.get_queryset()
         
         # Filter by container type and id
         container_type = request.query_params.get('container_type', None)
         container_id = request.query_params.get('container_id', None)
+        key = None
         
-        if container_type and container_id:
-            if container_type == 'stage':
-                stage_content_type = ContentType.objects.get_for_model(Stage)
-                queryset = queryset.filter(content_type=stage_content_type, object_id=container_id)
-            elif container_type == 'iteration':
-                iteration_content_type = ContentType.objects.get_for_model(Iteration)
-                queryset = queryset.filter(content_type=iteration_content_type, object_id=container_id)
+        if container_type in ('stage', 'iteration') and container_id:
+            key = f"{container_type}:{container_id}"
+            queryset = queryset.filter(container_key=key)
         
         # Filter by product
         product_id = request.query_params.get('product_id', None)
         if product_id:
-            from django.db import models
-            stage_content_type = ContentType.objects.get_for_model(Stage)
-            iteration_content_type = ContentType.objects.get_for_model(Iteration)
-            
-            stage_ids = Stage.objects.filter(product_id=product_id).values_list('id', flat=True)
-            iteration_ids = Iteration.objects.filter(product_id=product_id).values_list('id', flat=True)
-            
-            queryset = queryset.filter(
-                models.Q(content_type=stage_content_type, object_id__in=stage_ids) |
-                models.Q(content_type=iteration_content_type, object_id__in=iteration_ids)
-            )
+            queryset = queryset.filter(product_id=product_id)
         
         # Filter out child files by default, unless specifically requested
         include_children = request.query_params.get('include_children', 'false').lower() == 'true'
         if not include_children:
             queryset = queryset.filter(parent_file__isnull=True)
-        
-        queryset = queryset.order_by('-updated_at')
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
+
+        def build():
+            rows = queryset.order_by('-updated_at')
+            page = self.paginate_queryset(rows)
+            if page is not None:
+                return self.get_paginated_response(serialize_files(page, request))
+            return list_response(rows, request, lambda batch: serialize_files(batch, request))
+
+        scope, version = listing_version(key, product_id)
+        if scope is None:
+            return build()
+        return conditional(request, scope, version, build)
 
     @action(detail=False, methods=['get'], url_path='my-files')
     def my_files(self, request):
-        """Get files for the current user"""
+        """Get files for the current user (?stream=true streams the unpaginated list)"""
         # Temporarily bypass auth check: return all files
         files = File.objects.filter(parent_file__isnull=True).order_by('-updated_at')
-        serializer = self.get_serializer(files, many=True)
-        return Response(serializer.data)
+        page = self.paginate_queryset(files)
+        if page is not None:
+            return self.get_paginated_response(serialize_files(page, request))
+        return list_response(files, request, lambda batch: serialize_files(batch, request))
 
     @action(detail=False, methods=['get'], url_path='preview-doc')
     def preview_doc(self, request):
-        """Preview document using Google Docs viewer"""
-        file_path = request.query_params.get('file_path')
-        if not file_path:
-            return Response({"error": "No file path provided"}, status=status.HTTP_400_BAD_REQUEST)
+        """Preview a Word revision (?revision_id=) using Google Docs viewer.
 
-        media_path = os.path.join(settings.MEDIA_ROOT, file_path)
-        if not os.path.exists(media_path):
-            return Response({"error": f"File not found: {file_path}"}, status=status.HTTP_404_NOT_FOUND)
-
-        mime_type, _ = mimetypes.guess_type(media_path)
+        The viewer fetches the file itself, without the user's session: it is handed a
+        signed download link that expires (files.signed_downloads).
+        """
+        revision_id = request.query_params.get('revision_id')
+        if not revision_id:
+            return Response({"error": "No revision_id provided"}, status=status.HTTP_400_BAD_REQUEST)
+        revision = FileRevision.objects.select_related('file').filter(pk=revision_id).first() \
+            if revision_id.isdigit() else None
+        if revision is None or not revision.uploaded_file:
+            return Response({"error": f"Revision not found: {revision_id}"}, status=status.HTTP_404_NOT_FOUND)
+
+        mime_type, _ = mimetypes.guess_type(revision.file.name)
         is_word_doc = mime_type in ['application/msword', 'application/vnd.openxmlformats-officedocument.wordprocessingml.document']
         if not is_word_doc:
             return Response({"error": "Not a Word document"}, status=status.HTTP_400_BAD_REQUEST)
 
-        file_url = request.build_absolute_uri(f'/media/{file_path}')
+        file_url = quote(signed_download_url(request, revision.pk), safe='')
         html_content = f"""
         <!DOCTYPE html>
         <html>
         <head>
             <meta charset="UTF-8">
             <meta name="viewport" content="width=device-width, initial-scale=1.0">
-            <title>{os.path.basename(file_path)}</title>
+            <title>{escape(revision.file.name)}</title>
             <style>
                 body, html {{
                     margin: 0;
@@ -432,224 +873,168 @@ class FileViewSet(viewsets.ModelViewSet):
         if not uploaded_file:
             return Response({"error": "No file uploaded."}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Extract parameters from request
-        original_name = request.data.get('original_name', uploaded_file.name)
-        is_child_file = request.data.get('is_child_file', '').lower() == 'true'
-        parent_id = request.data.get('parent_id')
-        stage_id = request.data.get('stage_id')
-        iteration_id = request.data.get('iteration_id')
-        folder_id = request.data.get('folder') or None
-        change_description = request.data.get('change_description', '')
-        status_value = request.data.get('status', 'in_work')
-        price_value = request.data.get('price')
-        quantity_value = request.data.get('quantity', 1)
-        # Category: honor an explicit value from the request; otherwise guess from the
-        # file extension. The backend owns categorization so the frontend never re-derives it.
-        category_value = request.data.get('category')
-        valid_categories = {c[0] for c in File.CATEGORY_CHOICES}
-        if category_value not in valid_categories:
-            ext = os.path.splitext(original_name)[1].lower().lstrip('.')
-            category_value = category_for_extension(ext)
-
-        user = request.user if request.user.is_authenticated else User.objects.first()
-
-        # Validate container (stage or iteration)
-        container_object = None
-        if stage_id:
-            try:
-                container_object = Stage.objects.get(id=stage_id)
-                content_type = ContentType.objects.get_for_model(Stage)
-            except Stage.DoesNotExist:
-                return Response({"error": "Stage not found."}, status=status.HTTP_404_NOT_FOUND)
-        elif iteration_id:
-            try:
-                container_object = Iteration.objects.get(id=iteration_id)
-                content_type = ContentType.objects.get_for_model(Iteration)
-            except Iteration.DoesNotExist:
-                return Response({"error": "Iteration not found."}, status=status.HTTP_404_NOT_FOUND)
-        else:
-            return Response({"error": "Either stage_id or iteration_id must be provided."}, status=status.HTTP_400_BAD_REQUEST)
+        return store_upload(request, uploaded_file, request.data)
 
-        # Handle parent-child relationships
-        parent_file_obj = None
-        if is_child_file and parent_id:
-            try:
-                parent_file_obj = File.objects.get(id=parent_id)
-                # Ensure parent is in the same container
-                if parent_file_obj.content_type != content_type or parent_file_obj.object_id != container_object.id:
-                    return Response({"error": "Parent file must be in the same container."}, status=status.HTTP_400_BAD_REQUEST)
-            except File.DoesNotExist:
-                return Response({"error": "Parent file not found."}, status=status.HTTP_404_NOT_FOUND)
-
-        # Resolve target folder (child files inherit their parent's folder).
-        folder_obj = None
-        if is_child_file and parent_file_obj:
-            folder_obj = parent_file_obj.folder
-        elif folder_id:
-            folder_obj = Folder.objects.filter(id=folder_id, content_type=content_type, object_id=container_object.id).first()
-            if not folder_obj:
-                return Response({"error": "Folder not found in this stage/iteration."}, status=status.HTTP_400_BAD_REQUEST)
+    @action(detail=False, methods=['post'])
+    def batch(self, request):
+        """Store a dropped folder in one request (see files.drops).
 
-        # Check if file exists (for revisions)
-        file_lookup = {
-            'name': original_name,
-            'content_type': content_type,
-            'object_id': container_object.id
+        Multipart: repeated `files` parts with a parallel repeated `relativePath`
+        ('src/drivers/uart.c', in the same order), stage_id or iteration_id, and
+        optionally folder, change_description, status and skip_identical. Returns one
+        result per file: {"path", "status": created|revised|unchanged, "file"}.
+        """
+        uploads = request.FILES.getlist('files')
+        paths = request.data.getlist('relativePath') if hasattr(request.data, 'getlist') else []
+        if not uploads:
+            return Response({"error": "No files uploaded."}, status=status.HTTP_400_BAD_REQUEST)
+        if paths and len(paths) != len(uploads):
+            return Response({"error": "Send one relativePath per file."}, status=status.HTTP_400_BAD_REQUEST)
+
+        target, error = drop_target(request.data)
+        if error:
+            return error
+
+        entries, invalid = [], []
+        for index, uploaded in enumerate(uploads):
+            raw = paths[index] if paths else uploaded.name
+            parts = split_path(raw)
+            if parts is None:
+                invalid.append(raw)
+            else:
+                entries.append((parts, uploaded))
+        if invalid:
+            return Response({"error": "Invalid relativePath.", "paths": invalid}, status=status.HTTP_400_BAD_REQUEST)
+
+        options = {
+            'change_description': request.data.get('change_description', ''),
+            'status': request.data.get('status', 'in_work'),
+            'skip_identical': str(request.data.get('skip_identical', '')).lower() == 'true',
         }
-        
-        if is_child_file and parent_file_obj:
-            file_lookup['parent_file'] = parent_file_obj
-        else:
-            file_lookup['parent_file__isnull'] = True
-            # Scope by folder so a same-named file in a different folder is its own file,
-            # and re-uploading into the same folder versions the existing one.
-            file_lookup['folder'] = folder_obj
-
-        # The '+' button posts is_child_file with the clicked file as the parent. When the
-        # upload carries that parent's own name, the user is versioning that file, not
-        # attaching a sub-file — two rows sharing one name is never the intent.
-        if is_child_file and parent_file_obj and original_name == parent_file_obj.name:
-            existing_file = parent_file_obj
-        else:
-            existing_file = File.objects.filter(**file_lookup).first()
-
-        # A filename identifies one file within a stage/iteration, wherever it sits in the
-        # folder tree. The lookup above is folder-scoped, so an upload aimed anywhere but
-        # that file's own folder — dropped on the list background, sent to a different
-        # folder, or with no folder at all — would miss it and create a second row under
-        # the same name. Fall back to the file holding that name anywhere in this
-        # container so the upload versions it in place instead. Ordered by id so a
-        # container still holding duplicates from before this rule resolves to the
-        # original rather than an arbitrary row.
-        if existing_file is None and not is_child_file:
-            existing_file = File.objects.filter(
-                name=original_name,
-                content_type=content_type,
-                object_id=container_object.id,
-                parent_file__isnull=True,
-            ).order_by('id').first()
-
-        if existing_file:
-            # Creating a revision of existing file
-            logger.debug(f"Creating revision for existing file: {existing_file.name}")
-
-            last_revision = FileRevision.objects.filter(file=existing_file).order_by('-revision_number').first()
-
-            # A deliberate upload always produces a new revision, even when the bytes are
-            # unchanged — "Upload Revision" and re-uploading a same-named file are explicit
-            # requests to version. Only bulk folder re-drops opt in to skipping identical
-            # files, so syncing a repo doesn't version hundreds of untouched ones.
-            skip_identical = str(request.data.get('skip_identical', '')).lower() == 'true'
-            if skip_identical and last_revision and getattr(last_revision, 'uploaded_file', None):
-                if _same_content(uploaded_file, last_revision.uploaded_file):
-                    serializer = FileSerializer(existing_file, context={'request': request})
-                    return Response(serializer.data, status=status.HTTP_200_OK)
-
-            revision_number = 1 if last_revision is None else last_revision.revision_number + 1
-
-            new_revision = FileRevision(
-                file=existing_file,
-                revision_number=revision_number,
-                uploaded_file=uploaded_file,
-                description=change_description,
-                status=status_value,
-                created_by=user
-            )
-            
-            if price_value:
-                try:
-                    new_revision.price = float(price_value)
-                except (ValueError, TypeError):
-                    pass
-            
-            new_revision.save()
-
-            # Update file's current revision and file_path
-            existing_file.current_revision = revision_number
-            existing_file.file_path = new_revision.file_path
-            existing_file.save()
-
-            parse_file_safely(existing_file)  # traceability index; never raises
-
-            # ✅ FIXED: Use FileSerializer instead of custom response
-            serializer = FileSerializer(existing_file, context={'request': request})
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
-        else:
-            # Creating new file
-            logger.debug(f"Creating new file: {original_name}")
-            
-            file_instance = File(
-                owner=user,
-                name=original_name,
-                uploaded_file=uploaded_file,
-                content_type=content_type,
-                object_id=container_object.id,
-                parent_file=parent_file_obj,
-                folder=folder_obj,
-                status=status_value,
-                quantity=int(quantity_value) if quantity_value else 1,
-                category=category_value
-            )
-            
-            if price_value:
-                try:
-                    file_instance.price = float(price_value)
-                except (ValueError, TypeError):
-                    pass
-
-            # Atomic so a failure creating the revision rolls back the File too,
-            # instead of leaving an orphan File row with no revisions.
-            with transaction.atomic():
-                file_instance.save()
-
-                # Create first revision. Reference the file already stored on file_instance
-                # instead of saving `uploaded_file` a second time: a disk-backed
-                # TemporaryUploadedFile (>2.5MB) is consumed/moved by the first save, so
-                # re-saving the raw upload here 500s with FileNotFoundError on the temp path.
-                new_revision = FileRevision(
-                    file=file_instance,
-                    revision_number=1,
-                    uploaded_file=file_instance.uploaded_file.name,
-                    description=change_description,
-                    status=status_value,
-                    created_by=user
-                )
-
-                if price_value:
-                    try:
-                        new_revision.price = float(price_value)
-                    except (ValueError, TypeError):
-                        pass
+        user = request.user if request.user.is_authenticated else User.objects.first()
+        results = store_drop(target, entries, user, options)
 
-                new_revision.save()
+        stored = any(result['status'] != UNCHANGED for result in results)
+        return Response({"results": results}, status=status.HTTP_201_CREATED if stored else status.HTTP_200_OK)
 
-            parse_file_safely(file_instance)  # traceability index; never raises
+    @action(detail=False, methods=['post'])
+    def manifest(self, request):
+        """Which files of a drop need uploading (see files.drops.classify_manifest).
 
-            # ✅ FIXED: Use FileSerializer instead of custom response
-            serializer = FileSerializer(file_instance, context={'request': request})
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
+        JSON: {"stage_id" | "iteration_id", "folder"?, "files": [{"relativePath",
+        "size", "sha256"}, ...]}, the same target a batch upload would name. Answers
+        {"new": [paths], "changed": [paths], "identical": [paths]}; only new and
+        changed files need to be sent to /api/files/batch/.
+        """
+        target, error = drop_target(request.data)
+        if error:
+            return error
+        listed = request.data.get('files')
+        if not isinstance(listed, list) or not listed:
+            return Response({"error": "files must be a non-empty list."}, status=status.HTTP_400_BAD_REQUEST)
+
+        entries, invalid = [], []
+        for item in listed:
+            item = item if isinstance(item, dict) else {}
+            parts = split_path(item.get('relativePath'))
+            digest = str(item.get('sha256') or '').strip().lower()
+            try:
+                size = int(item.get('size'))
+            except (TypeError, ValueError):
+                size = None
+            if parts is None or size is None or size < 0 or not SHA256_HEX.match(digest):
+                invalid.append(item.get('relativePath'))
+            else:
+                entries.append((parts, size, digest))
+        if invalid:
+            return Response({"error": "Each file needs a relativePath, size and sha256.", "paths": invalid},
+                            status=status.HTTP_400_BAD_REQUEST)
+        return Response(classify_manifest(target, entries))
 
 class FileRevisionViewSet(viewsets.ModelViewSet):
 
-    """ViewSet for managing file revisions"""
+    """ViewSet for managing file revisions.
+
+    ?file_id=<id> is a file's revision history -- the paged resource that replaces
+    embedding every revision in the file payload. It is always paged, newest first.
+    """
     permission_classes = [AllowAny]
     queryset = FileRevision.objects.all().order_by('-revision_number')
     serializer_class = FileRevisionSerializer
+    pagination_class = KeysetPagination
+
+    @property
+    def keyset_field(self):
+        # One file's history pages by revision_number on the (file, -revision_number)
+        # index. Across files the number means nothing, so the unfiltered list pages by
+        # created_at on the (-created_at, -id) index.
+        if self.request.query_params.get('file_id') is not None:
+            return 'revision_number'
+        return 'created_at'
 
     def get_queryset(self):
         """Filter revisions by file if provided"""
-        queryset = FileRevision.objects.all().order_by('-revision_number')
+        queryset = FileRevision.objects.select_related('created_by').order_by('-revision_number')
         file_id = self.request.query_params.get('file_id', None)
         if file_id is not None:
             queryset = queryset.filter(file_id=file_id)
         return queryset
 
+    def list(self, request, *args, **kwargs):
+        if request.query_params.get('file_id') is None:
+            return super().list(request, *args, **kwargs)
+        return paginate(
+            self.get_queryset(), request,
+            lambda rows: self.get_serializer(rows, many=True).data,
+            view=self, required=True,
+        )
+
+    @action(detail=True, methods=['get'], permission_classes=[IsAuthenticated | HasDownloadToken])
+    def download(self, request, pk=None):
+        """The revision's content as uploaded, for signed-in users and signed links
+        (files.signed_downloads) only.
+
+        Behind nginx (MEDIA_ACCEL_REDIRECT set) Django only checks access and answers
+        with an X-Accel-Redirect; nginx then sends the stored file itself, with
+        sendfile, ranges and gzip-stored media (files.compression).
+        Delta revisions (files.deltas) have no stored file to hand over and are rebuilt
+        and streamed from here, with Range/If-Range support of their own (files.ranges).
+        """
+        revision = self.get_object()
+        if not revision.uploaded_file:
+            return Response({"error": "Revision has no stored file."}, status=status.HTTP_404_NOT_FOUND)
+        filename = revision.file.name
+        content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        accel_root = getattr(settings, 'MEDIA_ACCEL_REDIRECT', '')
+        if accel_root and not revision.delta_base_id:
+            response = HttpResponse(content_type=content_type)
+            response['X-Accel-Redirect'] = accel_root.rstrip('/') + '/' + quote(revision.uploaded_file.name)
+            response['Content-Disposition'] = content_disposition_header(False, filename)
+        else:
+            # Content never changes under a revision: its digest is a strong validator.
+            etag = f'"{revision.sha256}"' if revision.sha256 else f'"revision-{revision.pk}"'
+            response = file_response(request, revision.uploaded_file, filename, content_type,
+                                     etag, revision.created_at.timestamp())
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+
+    def perform_destroy(self, instance):
+        # Older revisions stored as deltas against this one must not lose their base.
+        # Locking the row first makes a concurrent files.deltas.encode() either finish
+        # before the dependents are read or find the base gone.
+        with transaction.atomic(), deferred_changes():
+            FileRevision.objects.select_for_update().filter(pk=instance.pk).exists()
+            for dependent in instance.delta_dependents.all():
+                materialize(dependent)
+            instance.delete()
+
 
 class FolderViewSet(viewsets.ModelViewSet):
     """ViewSet for managing folders (create, rename, move, delete)"""
     permission_classes = [IsAuthenticated]
     queryset = Folder.objects.all().select_related('parent', 'product')
     serializer_class = FolderSerializer
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
         """Filter folders by product if provided"""
@@ -704,7 +1089,7 @@ class FolderViewSet(viewsets.ModelViewSet):
                 fid = stack.pop()
                 ordered.append(fid)
                 stack.extend(children_map.get(fid, []))
-            with transaction.atomic():
+            with transaction.atomic(), deferred_changes():
                 File.objects.filter(folder_id__in=ordered).delete()  # cascades revisions
                 for fid in reversed(ordered):  # children first, then parents
                     Folder.objects.filter(id=fid).delete()
@@ -734,12 +1119,29 @@ class FolderViewSet(viewsets.ModelViewSet):
         if not container:
             return Response({"error": "Target stage/iteration not found."}, status=status.HTTP_400_BAD_REQUEST)
         ids = self._subtree_ids(folder)
+        old_product_id = folder.product_id
         with transaction.atomic():
-            Folder.objects.filter(id__in=ids).update(content_type=content_type, object_id=container.id, product=container.product)
-            File.objects.filter(folder_id__in=ids).update(content_type=content_type, object_id=container.id)
+            key = container_key(container)
+            files = File.objects.filter(folder_id__in=ids)
+            file_ids = list(files.values_list('id', flat=True))
+            old_keys = set(Folder.objects.filter(id__in=ids).values_list('container_key', flat=True))
+            old_keys.update(files.values_list('container_key', flat=True))
+            Folder.objects.filter(id__in=ids).update(
+                content_type=content_type, object_id=container.id, product=container.product, container_key=key)
+            files.update(
+                content_type=content_type, object_id=container.id, product=container.product, container_key=key)
             folder.refresh_from_db()
             folder.parent = None  # re-root in the target container
             folder.save()
+            # .update() sends no signals; log the subtree for the change feed by hand.
+            record_changes(ChangeLog.FOLDER, container.product_id, ids)
+            record_changes(ChangeLog.FILE, container.product_id, file_ids)
+            invalidate_file_payloads(file_ids)
+            if old_product_id != container.product_id:
+                record_changes(ChangeLog.FOLDER, old_product_id, ids, ChangeLog.DELETE)
+                record_changes(ChangeLog.FILE, old_product_id, file_ids, ChangeLog.DELETE)
+            bump_versions(old_product_id, *old_keys)
+            bump_versions(container.product_id, key)
         return Response(FolderSerializer(folder, context={'request': request}).data)
 
     @action(detail=True, methods=['post'])
@@ -806,7 +1208,7 @@ class FolderViewSet(viewsets.ModelViewSet):
                 cur = parent_map.get(cur)
             return '/'.join(reversed(parts))
 
-        files_qs = File.objects.filter(folder_id__in=subtree)
+        files_qs = File.objects.filter(folder_id__in=subtree).select_related('current_file_revision')
         if container_type and container_id:
             ct = None
             if container_type == 'stage':
@@ -816,12 +1218,16 @@ class FolderViewSet(viewsets.ModelViewSet):
             if ct is not None:
                 files_qs = files_qs.filter(content_type=ct, object_id=container_id)
 
-        buffer = io.BytesIO()
-        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
+        files = list(files_qs)
+        revisions = current_revisions(files)
+        # Same folder tree, same archive: members in path order, however the rows came.
+        files.sort(key=lambda f: (rel_path(f.folder_id), f.name, f.id))
+
+        def members():
             used = set()
-            for f in files_qs:
+            for f in files:
                 # Use the current revision's file, falling back to the file's own upload.
-                rev = f.revisions.filter(revision_number=f.current_revision).first() or f.latest_revision
+                rev = revisions.get(f.id)
                 field = rev.uploaded_file if (rev and rev.uploaded_file) else f.uploaded_file
                 if not field:
                     continue
@@ -834,17 +1240,38 @@ class FolderViewSet(viewsets.ModelViewSet):
                     arcname = (f"{stem}_{i}{dot}{ext}" if dot else f"{base}_{i}")
                     i += 1
                 used.add(arcname)
-                try:
-                    field.open('rb')
-                    data = field.read()
+                yield arcname, field, timezone.localtime(rev.created_at if rev else f.updated_at).timetuple()
+
+        def send(member, field):
+            try:
+                yield from member
+            finally:
+                field.close()
+
+        def archive():
+            # Streamed member by member (files.zipstream). The next READ_AHEAD members are
+            # opened and read on a thread pool while the current one is deflated and sent.
+            zip_stream, read_ahead, pending = ZipStream(), ReadAhead(), deque()
+            try:
+                for arcname, field, modified in members():
+                    try:
+                        pending.append((field_member(zip_stream, arcname, field, modified, read_ahead), field))
+                    except Exception:
+                        continue
+                    if len(pending) > READ_AHEAD:
+                        yield from send(*pending.popleft())
+                while pending:
+                    yield from send(*pending.popleft())
+                yield zip_stream.close()
+            finally:
+                read_ahead.close()
+                for _, field in pending:
                     field.close()
-                except Exception:
-                    continue
-                zf.writestr(arcname, data)
 
-        buffer.seek(0)
         safe_name = ''.join(c for c in folder.name if c.isalnum() or c in (' ', '-', '_')).strip() or 'folder'
-        response = HttpResponse(buffer.getvalue(), content_type='application/zip')
+        response = StreamingHttpResponse(archive(), content_type='application/zip')
+        # Don't let nginx spool the archive to a temp file before passing it on.
+        response['X-Accel-Buffering'] = 'no'
         response['Content-Disposition'] = f'attachment; filename="{safe_name}.zip"'
         return response
 
@@ -1,5 +1,6 @@
 import os
 import sys
+import tempfile
 from pathlib import Path
 import dj_database_url
 
@@ -68,6 +69,9 @@ else:
         'default': {
             'ENGINE': 'django.db.backends.sqlite3',
             'NAME': BASE_DIR / 'db.sqlite3',
+            # File-backed rather than in-memory, so tests running requests on several
+            # threads (files.tests.ConcurrentUploadTests) share one database.
+            'TEST': {'NAME': os.path.join(tempfile.gettempdir(), 'mpp-test-db.sqlite3')},
         }
     }
     print("Using SQLite fallback database", file=sys.stderr)
@@ -83,12 +87,80 @@ STATICFILES_DIRS = [
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'mpp_files')
 
-# Keep uploads up to 50MB in memory so they're written to storage in a single pass
-# instead of via a disk temp file that gets copied across filesystems — that copy
-# intermittently fails with OSError(Errno 5) on the Windows/WSL2 bind mount used for
-# mpp_files, which was aborting multi-file (repo) uploads.
-FILE_UPLOAD_MAX_MEMORY_SIZE = 52428800   # 50 MB
+# Uploads are stored once per distinct content under MEDIA_ROOT/.blobs and hard-linked
+# into the human-readable uploads/ tree (files/blobstore.py); compressible formats are
+# gzipped on disk when MEDIA_COMPRESSION is on (files/compression.py).
+STORAGES = {
+    'default': {'BACKEND': 'files.compression.CompressedDedupStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+
 DATA_UPLOAD_MAX_MEMORY_SIZE = 52428800   # 50 MB
+# A folder drop posts every file of the folder to /api/files/batch/ in one request
+# (files/drops.py); Django's defaults of 100 files / 1000 fields would reject a repo.
+DATA_UPLOAD_MAX_NUMBER_FILES = 2000
+DATA_UPLOAD_MAX_NUMBER_FIELDS = 5000
+
+# Every upload, whatever its size, streams into a temp file in the media storage's
+# staging directory (MEDIA_ROOT/.blobs/tmp), hashed on the way, and becomes its stored
+# file by rename/hard link (files/digests.py, files/blobstore.py). Memory per upload
+# stays at one chunk, and there is no temp-file copy from /tmp across filesystems --
+# the copy that intermittently failed with OSError(Errno 5) on the Windows/WSL2 bind
+# mount used for mpp_files, and the reason uploads up to 50MB used to be held in RAM.
+FILE_UPLOAD_HANDLERS = [
+    'files.digests.DigestStagingFileUploadHandler',
+]
+
+# Optional: store STEP/IGES/DXF/OBJ, Gerber, CSV and log uploads gzipped (as name.gz)
+# and serve them as such (nginx gzip_static). Reads are transparent either way, so this
+# can be switched off again without touching stored files.
+MEDIA_COMPRESSION = os.getenv('MEDIA_COMPRESSION', 'False').lower() in ('true', '1', 'yes')
+
+# Behind nginx, /api/file-revisions/<id>/download/ checks access and hands the transfer
+# to nginx's internal location at this prefix (X-Accel-Redirect; see
+# nginx/conf/default.conf). Unset, Django streams the file itself.
+MEDIA_ACCEL_REDIRECT = os.getenv('MEDIA_ACCEL_REDIRECT', '')
+
+# Optional: keep older revisions of text formats (markdown, KiCad, G-code, source,
+# CSV, ...) as compressed deltas against the next revision, with every
+# REVISION_SNAPSHOT_EVERY-th revision kept in full (files/deltas.py). Uploads only
+# queue the superseded revision; `manage.py encode_revision_deltas` does the diffing.
+# Run `manage.py measure_revision_deltas` to see what it would save first.
+REVISION_DELTAS = os.getenv('REVISION_DELTAS', 'False').lower() in ('true', '1', 'yes')
+REVISION_SNAPSHOT_EVERY = int(os.getenv('REVISION_SNAPSHOT_EVERY', '10'))
+
+# Part files of resumable chunked uploads (files/upload_views.py). Kept outside
+# MEDIA_ROOT, so nothing ever hands them to nginx's /protected-media/.
+CHUNKED_UPLOAD_DIR = os.getenv('CHUNKED_UPLOAD_DIR', os.path.join(BASE_DIR, 'mpp_uploads'))
+
+# Traceability reindexing runs in a worker (manage.py index_traceability, see
+# files/indexing.py). TRACE_INDEX_EAGER=true runs it inside the upload request instead,
+# for a dev setup without the worker.
+TRACE_INDEX_EAGER = os.getenv('TRACE_INDEX_EAGER', 'False').lower() in ('true', '1', 'yes')
+
+# -- Cache --
+# REDIS_URL: a Redis every gunicorn worker shares (the compose files run one). The
+# serialized File payload cache (files/payload_cache.py) is only enabled with it: a
+# per-process cache would miss invalidations made by other workers and serve stale
+# payloads, and Django's file and database caches cull at random past MAX_ENTRIES,
+# scanning on every write -- far too slow for a 2000-file listing's fragments.
+# Redis evicts least-recently-used keys once its maxmemory is reached.
+REDIS_URL = os.getenv('REDIS_URL')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'mpp-file-payloads',
+        }
+    }
+FILE_PAYLOAD_CACHE = 'default' if REDIS_URL else None
 
 # -- CORS Configuration --
 CORS_ALLOW_ALL_ORIGINS = True
@@ -19,6 +19,8 @@ from files.views import (
     FolderViewSet,
     initial_setup
 )
+from files.compression import serve_media
+from files.upload_views import UploadSessionViewSet
 from files.auth_views import login_view, logout_view, check_auth, register_user
 
 # CSRF token endpoint for frontend
@@ -34,6 +36,7 @@ router.register(r'iterations', IterationViewSet)
 router.register(r'files', FileViewSet)
 router.register(r'file-revisions', FileRevisionViewSet)
 router.register(r'folders', FolderViewSet)
+router.register(r'uploads', UploadSessionViewSet)
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -50,4 +53,4 @@ urlpatterns = [
 
 # Serve media files in development
 if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    urlpatterns += static(settings.MEDIA_URL, view=serve_media, document_root=settings.MEDIA_ROOT)
@@ -33,6 +33,7 @@ import KicadSchematicViewer from './components/viewers/KicadSchematicViewer';
 import KicadPcbViewer from './components/viewers/KicadPcbViewer';
 import { CodePreview, MarkdownPreview, CsvPreview, ExcelPreview } from './components/viewers/FilePreviewers';
 import { readDropEntries, isIgnoredDropPath } from './utils/dropUpload';
+import { revisionCount, revisionNumbers, findRevision } from './utils/revisionHistory';
 
 function triggerDownload(url, filename) {
   const a = document.createElement('a');
@@ -49,10 +50,8 @@ function renderPreview(fileObj, handleRevisionChange, handleChildRevisionChange)
 
   const selectedRevision = fileObj.selected_revision_obj || fileObj.latest_revision || fileObj;
   const normalizeUrl = (url) => url ? url.replace(/^https?:\/\/[^/]+/, window.location.origin) : null;
-  const serverUrl = normalizeUrl(selectedRevision.uploaded_file) ||
-    normalizeUrl(fileObj.uploaded_file) ||
-    (fileObj.file_path ? `/media/${fileObj.file_path}` : null) ||
-    `/media/uploads/${fileObj.name}`;
+  // Access-checked download URLs; stored files are not served by path (/media/).
+  const serverUrl = normalizeUrl(selectedRevision.uploaded_file) || normalizeUrl(fileObj.uploaded_file);
 
   const revisionSelector = (
     // gap so the full-width toggle does not sit flush against the Download button, which
@@ -71,8 +70,8 @@ function renderPreview(fileObj, handleRevisionChange, handleChildRevisionChange)
           else handleRevisionChange(fileObj, revNum);
         }}
       >
-        {fileObj.revisions?.length > 0
-          ? fileObj.revisions.map(rev => <option key={rev.revision_number} value={rev.revision_number}>v {rev.revision_number}.0</option>)
+        {revisionCount(fileObj) > 0
+          ? revisionNumbers(fileObj).map(n => <option key={n} value={n}>v {n}.0</option>)
           : <option value={1}>v 1.0</option>}
       </Form.Select>
       {selectedRevision.description && (
@@ -117,7 +116,7 @@ function renderPreview(fileObj, handleRevisionChange, handleChildRevisionChange)
     return wrap(<KicadPcbViewer key={fileUrl} fileUrl={fileUrl} />);
 
   if (['.stl', '.dxf', '.stp', '.step'].some(e => nameLower.endsWith(e)))
-    return wrap(<Model3DPreview fileUrl={fileUrl} />);
+    return wrap(<Model3DPreview fileUrl={fileUrl} name={fileObj.name} />);
 
   if (['.js', '.jsx', '.ts', '.tsx', '.py', '.cpp', '.cc', '.cxx', '.c', '.h', '.hpp', '.hh', '.hxx',
        '.ino', '.java', '.txt', '.log', '.json', '.xml', '.yml', '.yaml', '.toml', '.ini', '.cfg',
@@ -633,7 +632,7 @@ function MainApp() {
     if (!fileObj) return null;
     const normalizeUrl = (url) => url ? url.replace(/^https?:\/\/[^/]+/, window.location.origin) : null;
     const rev = fileObj.selected_revision_obj || fileObj.latest_revision;
-    return normalizeUrl(rev?.uploaded_file) || normalizeUrl(fileObj.uploaded_file) || (fileObj.file_path ? `/media/${fileObj.file_path}` : null);
+    return normalizeUrl(rev?.uploaded_file) || normalizeUrl(fileObj.uploaded_file);
   }
 
   function handleDownloadFile(fileObj) {
@@ -1007,21 +1006,27 @@ function MainApp() {
     finally { setIsLoading(false); e.target.value = ''; setParentFileForChild(null); }
   }
 
-  function handleRevisionChange(fileObj, revisionNumber) {
-    const revision = fileObj.revisions?.find(r => r.revision_number === revisionNumber);
+  async function handleRevisionChange(fileObj, revisionNumber) {
+    // File payloads only carry the latest revision; the history is fetched on first use
+    // and kept on the file (utils/revisionHistory).
+    let found;
+    try { found = await findRevision(fileObj, revisionNumber); }
+    catch (err) { setToastMsg(`Could not load revisions: ${err.message}`); return; }
+    const { revision, revisions } = found;
     if (!revision) return;
+    const changes = { current_revision: revisionNumber, selected_revision_obj: revision, revisions };
     const containerKey = `${fileObj.container_type}_${fileObj.container_db_id}`;
     setProducts(prev => {
       const updated = [...prev];
       const updatedProd = { ...updated[selectedProductIndex], filesByContainer: { ...updated[selectedProductIndex].filesByContainer } };
       const files = [...(updatedProd.filesByContainer[containerKey] || [])];
       const idx = files.findIndex(f => f.id === fileObj.id);
-      if (idx !== -1) files[idx] = { ...files[idx], current_revision: revisionNumber, selected_revision_obj: revision };
+      if (idx !== -1) files[idx] = { ...files[idx], ...changes };
       updatedProd.filesByContainer[containerKey] = files;
       updated[selectedProductIndex] = updatedProd;
       return updated;
     });
-    setSelectedFileObj(prev => prev?.id === fileObj.id ? { ...prev, current_revision: revisionNumber, selected_revision_obj: revision } : prev);
+    setSelectedFileObj(prev => prev?.id === fileObj.id ? { ...prev, ...changes } : prev);
   }
 
   function handleChildRevisionChange(childFileObj, revisionNumber) {
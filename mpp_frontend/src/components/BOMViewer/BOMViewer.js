@@ -207,9 +207,7 @@ function normalizeUrl(url) {
 /** Server URL for a file's current revision - same resolution order as the preview pane. */
 function serverUrlFor(file) {
   const revision = file.selected_revision_obj || file.latest_revision;
-  return normalizeUrl(revision && revision.uploaded_file)
-    || normalizeUrl(file.uploaded_file)
-    || (file.file_path ? `/media/${file.file_path}` : null);
+  return normalizeUrl(revision && revision.uploaded_file) || normalizeUrl(file.uploaded_file);
 }
 
 /** Turn the container's files into flat BOM line items.
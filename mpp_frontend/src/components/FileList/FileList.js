@@ -3,6 +3,7 @@ import { Table, Form, Spinner } from 'react-bootstrap';
 import { FaPlus, FaFolder, FaFolderOpen, FaChevronRight, FaChevronDown } from 'react-icons/fa';
 import AppFileIcon from '../FileIcon/AppFileIcon';
 import styles from '../../constants/styles';
+import { revisionCount, revisionNumbers, currentRevisionObj } from '../../utils/revisionHistory';
 
 const showQtyPriceExtensions = ['dxf', 'step', 'stp', 'stl', 'kicad_sch', 'gbr', 'gerber', 'kicad_pcb'];
 
@@ -157,7 +158,7 @@ function FileList({
   // --- file row (with its child files) ---
   const renderFileRow = (fileObj, depth) => {
     const icon = <AppFileIcon filename={fileObj.name} />;
-    const hasRevisions = fileObj.revisions?.length > 0;
+    const hasRevisions = revisionCount(fileObj) > 0;
     const childFiles = childrenOf(fileObj);
     const namePad = depth * INDENT + INDENT + 4; // +INDENT lines file icons up under folder icons (past the chevron)
 
@@ -190,10 +191,8 @@ function FileList({
           </td>
           <td style={{ whiteSpace: 'nowrap', color: styles.colors.text.muted, fontSize: styles.fonts.size.xs }}>
             {(() => {
-              if (fileObj.revisions && fileObj.current_revision) {
-                const currentRev = fileObj.revisions.find(r => r.revision_number === fileObj.current_revision);
-                if (currentRev?.created_at) return new Date(currentRev.created_at).toLocaleDateString('en-GB');
-              }
+              const currentRev = currentRevisionObj(fileObj);
+              if (currentRev?.created_at) return new Date(currentRev.created_at).toLocaleDateString('en-GB');
               return new Date(fileObj.created_at || fileObj.upload_date).toLocaleDateString('en-GB');
             })()}
           </td>
@@ -212,7 +211,7 @@ function FileList({
               }}
             >
               {hasRevisions
-                ? fileObj.revisions.map(rev => <option key={rev.revision_number} value={rev.revision_number}>v {rev.revision_number}.0</option>)
+                ? revisionNumbers(fileObj).map(n => <option key={n} value={n}>v {n}.0</option>)
                 : <option value={1}>v 1.0</option>}
             </Form.Select>
           </td>
@@ -220,7 +219,7 @@ function FileList({
 
         {childFiles.map(childFile => {
           const childIcon = <AppFileIcon filename={childFile.name} />;
-          const hasChildRevisions = childFile.revisions?.length > 0;
+          const hasChildRevisions = revisionCount(childFile) > 0;
           return (
             <tr key={childFile.id} onClick={() => setSelectedFileObj(childFile)} style={selectedFileObj?.id === childFile.id ? { backgroundColor: styles.colors.primaryActive } : {}}>
               <td style={{ maxWidth: 0, overflow: 'hidden', paddingLeft: `${namePad + 20}px`, position: 'relative' }} onContextMenu={e => onFileRightClick(e, childFile)}>
@@ -256,7 +255,7 @@ function FileList({
                   }}
                 >
                   {hasChildRevisions
-                    ? childFile.revisions.map(rev => <option key={rev.revision_number} value={rev.revision_number}>v {rev.revision_number}.0</option>)
+                    ? revisionNumbers(childFile).map(n => <option key={n} value={n}>v {n}.0</option>)
                     : <option value={1}>v 1.0</option>}
                 </Form.Select>
               </td>
@@ -1,5 +1,6 @@
 ﻿import React from 'react';
 import styles from '../../constants/styles';
+import { revisionCount } from '../../utils/revisionHistory';
 
 function KPICard({ label, value, unit = '', color = styles.colors.primary }) {
   return (
@@ -25,9 +26,9 @@ function KPIDashboard({ prod }) {
   const allFiles        = Object.values(prod.filesByContainer || {}).flat();
   const totalFiles      = allFiles.length;
 
-  const filesWithRevisions = allFiles.filter(f => f.revisions?.length > 0);
+  const filesWithRevisions = allFiles.filter(f => revisionCount(f) > 0);
   const avgRevisions = filesWithRevisions.length
-    ? (filesWithRevisions.reduce((sum, f) => sum + (f.revisions?.length ?? 0), 0) / filesWithRevisions.length).toFixed(1)
+    ? (filesWithRevisions.reduce((sum, f) => sum + revisionCount(f), 0) / filesWithRevisions.length).toFixed(1)
     : '—';
 
   const statusCounts = allFiles.reduce((acc, f) => {
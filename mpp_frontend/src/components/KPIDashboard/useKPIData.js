@@ -1,5 +1,6 @@
 ﻿import { useState, useEffect } from 'react';
 import authenticatedFetch from '../../utils/authenticatedFetch';
+import { revisionCount } from '../../utils/revisionHistory';
 
 /**
  * useKPIData
@@ -24,8 +25,8 @@ function useKPIData(product) {
       totalIterations: product.iterations?.length ?? 0,
       totalStages: product.stages?.length ?? 0,
       totalFiles: allFiles.length,
-      avgRevisions: allFiles.filter(f => f.revisions?.length > 0).length
-        ? (allFiles.reduce((s, f) => s + (f.revisions?.length ?? 0), 0) / allFiles.length).toFixed(1)
+      avgRevisions: allFiles.filter(f => revisionCount(f) > 0).length
+        ? (allFiles.reduce((s, f) => s + revisionCount(f), 0) / allFiles.length).toFixed(1)
         : 0,
       statusDistribution: allFiles.reduce((acc, f) => {
         const s = (f.status || 'in_work').toLowerCase();
@@ -11,13 +11,11 @@ function normalizeUrl(url) {
 }
 
 /** Same resolution order the file preview pane uses: current revision, then the file's
- *  own upload, then the stored path. */
+ *  own upload. */
 function serverUrlFor(file) {
   if (!file) return null;
   const revision = file.selected_revision_obj || file.latest_revision;
-  return normalizeUrl(revision && revision.uploaded_file)
-    || normalizeUrl(file.uploaded_file)
-    || (file.file_path ? `/media/${file.file_path}` : null);
+  return normalizeUrl(revision && revision.uploaded_file) || normalizeUrl(file.uploaded_file);
 }
 
 /** Fetch the File row behind a node so the excerpt can be previewed. The graph carries
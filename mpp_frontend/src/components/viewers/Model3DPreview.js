@@ -154,7 +154,7 @@ const barBtn = {
   lineHeight: 1.4,
 };
 
-function Model3DPreview({ fileUrl }) {
+function Model3DPreview({ fileUrl, name }) {
   const [brightness, setBrightness] = useState(1.5);
   const [contrast, setContrast] = useState(1.2);
   const [gridPosition, setGridPosition] = useState(-2);
@@ -172,12 +172,13 @@ function Model3DPreview({ fileUrl }) {
       setLastFileUrl(fileUrl);
     }
     if (fileUrl) {
-      const lowerUrl = fileUrl.toLowerCase();
-      if (lowerUrl.endsWith('.dxf')) { setFileType('dxf'); setMaterialColor('#4285F4'); }
-      else if (lowerUrl.endsWith('.stp') || lowerUrl.endsWith('.step')) { setFileType('step'); setMaterialColor('#cccccc'); }
+      // Download URLs (/api/file-revisions/<id>/download/) carry no extension: go by name.
+      const lower = (name || fileUrl).toLowerCase();
+      if (lower.endsWith('.dxf')) { setFileType('dxf'); setMaterialColor('#4285F4'); }
+      else if (lower.endsWith('.stp') || lower.endsWith('.step')) { setFileType('step'); setMaterialColor('#cccccc'); }
       else { setFileType('stl'); setMaterialColor('#cccccc'); }
     }
-  }, [fileUrl, lastFileUrl]);
+  }, [fileUrl, name, lastFileUrl]);
 
   const fallback = <Html center><div style={{ color: 'white', textAlign: 'center' }}>Loading...</div></Html>;
   const canvasStyle = { position: 'absolute', top: 0, left: 0, width: '100%', height: '100%', background: 'transparent' };
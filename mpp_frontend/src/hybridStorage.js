@@ -619,10 +619,11 @@ export const createFileUploadHandler = (
         existingFile.updated_at = uploadResult.data.created_at;
         existingFile.file_path = uploadResult.data.file_path;
         existingFile.latest_revision = uploadResult.data.latest_revision;
+        existingFile.revision_count = uploadResult.data.revision_count;
         
-        // Add to revisions array if it exists
+        // Add to the revision history if it has been loaded (utils/revisionHistory)
         if (existingFile.revisions) {
-          existingFile.revisions = [...existingFile.revisions, uploadResult.data.latest_revision];
+          existingFile.revisions = [uploadResult.data.latest_revision, ...existingFile.revisions];
         }
 
         updatedProduct.filesByContainer[containerKey][existingFileIndex] = existingFile;
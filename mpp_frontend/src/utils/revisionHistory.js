@@ -0,0 +1,56 @@
+// A file's revision history. File payloads carry `latest_revision` and `revision_count`
+// instead of every revision; the full history is the paged
+// /api/file-revisions/?file_id=<id> resource. It is loaded when a version is picked and
+// then kept on the file object as `revisions` (newest first), the shape the payload
+// used to embed, so code that finds a revision there keeps working.
+import authenticatedFetch from './authenticatedFetch';
+
+const PAGE_SIZE = 1000; // the endpoint's maximum page size
+
+// How many revisions the file has, whether or not its history is loaded.
+export const revisionCount = (fileObj) =>
+  fileObj?.revision_count ?? fileObj?.revisions?.length ?? (fileObj?.latest_revision ? 1 : 0);
+
+// Revision numbers for a version dropdown, newest first. Before the history is loaded
+// they are counted down from the latest one: numbers are handed out in sequence, and a
+// number whose revision was deleted simply finds nothing when picked.
+export function revisionNumbers(fileObj) {
+  if (fileObj?.revisions?.length) return fileObj.revisions.map(rev => rev.revision_number);
+  const latest = fileObj?.latest_revision?.revision_number || fileObj?.current_revision || 1;
+  return Array.from({ length: latest }, (_, i) => latest - i);
+}
+
+// The revision object behind fileObj.current_revision, if it is at hand without a fetch.
+export function currentRevisionObj(fileObj) {
+  if (!fileObj?.current_revision) return null;
+  const number = fileObj.current_revision;
+  if (fileObj.selected_revision_obj?.revision_number === number) return fileObj.selected_revision_obj;
+  if (fileObj.latest_revision?.revision_number === number) return fileObj.latest_revision;
+  return fileObj.revisions?.find(rev => rev.revision_number === number) || null;
+}
+
+// Every revision of a file, newest first, following the endpoint's `next` links.
+export async function loadRevisionHistory(fileId) {
+  const revisions = [];
+  let url = `/api/file-revisions/?file_id=${encodeURIComponent(fileId)}&page_size=${PAGE_SIZE}`;
+  while (url) {
+    const response = await authenticatedFetch(url);
+    if (!response.ok) throw new Error(response.statusText);
+    const page = await response.json();
+    revisions.push(...page.results);
+    url = page.next ? page.next.replace(/^https?:\/\/[^/]+/, '') : null;
+  }
+  return revisions;
+}
+
+// The revision numbered `revisionNumber` and the file's history, fetching the history
+// only when the revision isn't loaded yet.
+export async function findRevision(fileObj, revisionNumber) {
+  let revisions = fileObj.revisions;
+  let revision = revisions?.find(rev => rev.revision_number === revisionNumber);
+  if (!revision) {
+    revisions = await loadRevisionHistory(fileObj.id);
+    revision = revisions.find(rev => rev.revision_number === revisionNumber);
+  }
+  return { revision: revision || null, revisions: revisions || [] };
+}